@@ -0,0 +1,181 @@
+"""
+Runs the load scenarios against every app and worker type, the microbenchmarks, and writes
+everything to one JSON file. Run from the repository root:
+
+    python -m benchmarks --output results.json
+    python -m benchmarks --output new.json --compare results.json
+"""
+import argparse
+import json
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import time
+from .loadgen import run_scenario
+from .micro import run_micro, MICROBENCHMARKS
+from .scenarios import SCENARIOS, scenarios_for
+
+
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOST = '127.0.0.1'
+
+DEFAULT_APPS = ['app.app_example:basic_app', 'app.app_example:app', 'benchmarks.apps:bench_app']
+DEFAULT_WORKERS = ['sync', 'threaded', 'asyncio']
+
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+
+def start_server(app: str, workertype: str, port: int, extra: list[str]) -> subprocess.Popen:
+    command = [sys.executable, 'run.py', app, '--bind', f'{HOST}:{port}', '--workertype', workertype,
+               '--static', '/static=app/static', '--logging_level', 'warning', *extra]
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(process.stderr.read().decode(errors='replace').strip().splitlines()[-1])
+        try:
+            socket.create_connection((HOST, port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    stop_server(process)
+    raise RuntimeError("server didnt start listening in 10 seconds")
+
+
+
+def stop_server(process: subprocess.Popen):
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+
+def run_load(args: argparse.Namespace) -> list[dict]:
+    results = []
+    for app in args.apps:
+        for workertype in args.workertypes:
+            port = free_port()
+            try:
+                process = start_server(app, workertype, port, args.server_args)
+            except RuntimeError as e:
+                print(f"{app} [{workertype}] skipped: {e}", file=sys.stderr)
+                results.append({'app': app, 'workertype': workertype, 'skipped': str(e)})
+                continue
+
+            try:
+                for scenario in scenarios_for(app, args.scenarios):
+                    result = run_scenario(HOST, port, scenario, connections=args.connections,
+                                          duration=args.duration, warmup=args.warmup)
+                    result.update(app=app, workertype=workertype)
+                    results.append(result)
+                    print(f"{app} [{workertype}] {scenario.name}: {result['rps']} rps, "
+                          f"p50 {result['p50_ms']}ms p99 {result['p99_ms']}ms p999 {result['p999_ms']}ms, "
+                          f"{result['errors']} errors")
+            finally:
+                stop_server(process)
+    return results
+
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> bool:
+    """
+    Print how the results moved against a baseline, returns False if anything regressed by more than `threshold`.
+    """
+    ok = True
+
+    def load_key(result: dict) -> tuple:
+        return (result['app'], result['workertype'], result['scenario'])
+
+    old_load = {load_key(r): r for r in baseline.get('load', []) if 'scenario' in r}
+    for result in current.get('load', []):
+        if 'scenario' not in result or load_key(result) not in old_load:
+            continue
+        old = old_load[load_key(result)]
+        rps = (result['rps'] - old['rps']) / old['rps'] if old['rps'] else 0.0
+        p99 = (result['p99_ms'] - old['p99_ms']) / old['p99_ms'] if old['p99_ms'] else 0.0
+        regressed = rps < -threshold or p99 > threshold
+        ok = ok and not regressed
+        print(f"{'REGRESSED ' if regressed else ''}{' '.join(load_key(result))}: rps {rps:+.1%}, p99 {p99:+.1%}")
+
+    old_micro = {r['benchmark']: r for r in baseline.get('micro', [])}
+    for result in current.get('micro', []):
+        old = old_micro.get(result['benchmark'])
+        if old is None:
+            continue
+        change = (result['ns_per_op'] - old['ns_per_op']) / old['ns_per_op']
+        regressed = change > threshold
+        ok = ok and not regressed
+        print(f"{'REGRESSED ' if regressed else ''}{result['benchmark']}: {change:+.1%} ns/op")
+    return ok
+
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('--apps', type=str, default=DEFAULT_APPS, nargs='+')
+    parser.add_argument('--workertypes', type=str, default=DEFAULT_WORKERS, nargs='+')
+    parser.add_argument('--scenarios', type=str, default=list(SCENARIOS), nargs='+', choices=list(SCENARIOS))
+    parser.add_argument('--micro', type=str, default=list(MICROBENCHMARKS), nargs='*', choices=list(MICROBENCHMARKS))
+    parser.add_argument('--no_load', action='store_true')
+    parser.add_argument('--connections', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--warmup', type=float, default=1)
+    parser.add_argument('--server_args', type=str, default=[], nargs=argparse.REMAINDER)
+    parser.add_argument('--output', type=str, default='benchmark_results.json')
+    parser.add_argument('--compare', type=str, default=None)
+    parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args()
+
+    results = {
+        'meta': {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'timestamp': time.time(),
+            'connections': args.connections,
+            'duration': args.duration,
+        },
+        'micro': run_micro(args.micro) if args.micro else [],
+    }
+    for result in results['micro']:
+        print(f"{result['benchmark']}: {result['ns_per_op']} ns/op")
+    results['load'] = [] if args.no_load else run_load(args)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+
+if __name__ == '__main__':
+    main()
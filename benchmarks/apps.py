@@ -0,0 +1,29 @@
+"""
+WSGI app the scenarios are written against. Unlike `basic_app` it reads upload bodies
+and has a large response, so every part of the request path gets exercised.
+"""
+
+
+
+
+LARGE_BODY = b"x" * (1024 * 1024)
+
+
+
+def bench_app(environ, start_response):
+    path = environ['PATH_INFO']
+
+    if path == '/large':
+        start_response('200 OK', [('Content-Type', 'application/octet-stream'), ('Content-Length', str(len(LARGE_BODY)))])
+        return [LARGE_BODY]
+
+    if path == '/upload':
+        size = 0
+        while data := environ['wsgi.input'].read(65536):
+            size += len(data)
+        body = str(size).encode()
+        start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', str(len(body)))])
+        return [body]
+
+    start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', '11')])
+    return [b"Hello world"]
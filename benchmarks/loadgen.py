@@ -0,0 +1,200 @@
+import asyncio
+import time
+import typing
+
+
+
+
+class Scenario:
+    """
+    One kind of request the load generator keeps sending.
+
+    `slow` clients send the request in `slow_parts` pieces with `slow_delay` seconds between them,
+    the way clients on bad links (or slowloris) do.
+    """
+    __slots__ = ('name', 'method', 'path', 'body', 'headers', 'keepalive', 'slow', 'slow_parts', 'slow_delay')
+
+    def __init__(self, name: str, method: str = 'GET', path: str = '/', body: bytes = b'',
+                 headers: list[tuple[str, str]] = (), keepalive: bool = True,
+                 slow: bool = False, slow_parts: int = 4, slow_delay: float = 0.01):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.body = body
+        self.headers = list(headers)
+        self.keepalive = keepalive
+        self.slow = slow
+        self.slow_parts = slow_parts
+        self.slow_delay = slow_delay
+
+
+    def encode(self, host: str) -> bytes:
+        lines = [f"{self.method} {self.path} HTTP/1.1", f"Host: {host}"]
+        lines.extend(f"{name}: {value}" for name, value in self.headers)
+        if self.body:
+            lines.append(f"Content-Length: {len(self.body)}")
+        if not self.keepalive:
+            lines.append("Connection: close")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + self.body
+
+
+
+class Result:
+    """
+    What one scenario run measured. Latencies are in seconds.
+    """
+    def __init__(self, scenario: str, connections: int):
+        self.scenario = scenario
+        self.connections = connections
+        self.latencies: list[float] = []
+        self.errors: int = 0
+        self.bytes_in: int = 0
+        self.elapsed: float = 0
+        self.statuses: dict[int, int] = {}
+
+
+    def to_dict(self) -> dict:
+        requests = len(self.latencies)
+        ordered = sorted(self.latencies)
+
+        def pick(p: float) -> float:
+            if not ordered:
+                return 0.0
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 3)
+
+        return {
+            'scenario': self.scenario,
+            'connections': self.connections,
+            'requests': requests,
+            'errors': self.errors,
+            'rps': round(requests / self.elapsed, 1) if self.elapsed else 0.0,
+            'p50_ms': pick(0.50),
+            'p99_ms': pick(0.99),
+            'p999_ms': pick(0.999),
+            'max_ms': round(ordered[-1] * 1000, 3) if ordered else 0.0,
+            'bytes_in': self.bytes_in,
+            'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+        }
+
+
+
+async def read_response(reader: asyncio.StreamReader) -> tuple[int, int, bool]:
+    """
+    Read one response, returns the status, the size of the body and if the connection can be reused.
+    """
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head[:-4].split(b"\r\n")
+    status = int(lines[0].split(b" ", 2)[1])
+
+    length, chunked, close = None, False, lines[0].startswith(b"HTTP/1.0")
+    for line in lines[1:]:
+        name, _, value = line.partition(b":")
+        name, value = name.strip().lower(), value.strip().lower()
+        if name == b"content-length":
+            length = int(value)
+        elif name == b"transfer-encoding":
+            chunked = value == b"chunked"
+        elif name == b"connection":
+            close = value == b"close"
+
+    size = 0
+    if chunked:
+        while True:
+            chunk_size = int((await reader.readuntil(b"\r\n")).split(b";", 1)[0], 16)
+            if chunk_size == 0:
+                # trailers end with an empty line
+                while await reader.readuntil(b"\r\n") != b"\r\n":
+                    pass
+                break
+            size += len(await reader.readexactly(chunk_size + 2)) - 2
+    elif length is not None:
+        size = len(await reader.readexactly(length))
+    elif status not in (204, 304) and status >= 200:
+        # delimited by the end of the connection
+        size = len(await reader.read())
+        close = True
+    return status, size, not close
+
+
+
+class LoadGenerator:
+    """
+    Keeps `connections` clients busy with `scenario` for `duration` seconds, after a `warmup`
+    that isnt measured. All clients run on one event loop over loopback, so on a fast server
+    the generator can become the bottleneck, compare runs made on the same machine only.
+    """
+    def __init__(self, host: str, port: int, scenario: Scenario, connections: int = 32,
+                 duration: float = 5, warmup: float = 1, timeout: float = 10):
+        self.host = host
+        self.port = port
+        self.scenario = scenario
+        self.connections = connections
+        self.duration = duration
+        self.warmup = warmup
+        self.timeout = timeout
+        self.request: bytes = scenario.encode(f"{host}:{port}")
+        self.measuring: bool = False
+        self.deadline: float = 0
+
+
+    async def run(self) -> Result:
+        result = Result(self.scenario.name, self.connections)
+        loop = asyncio.get_running_loop()
+        self.deadline = loop.time() + self.warmup + self.duration
+
+        clients = [asyncio.create_task(self.client(result)) for _ in range(self.connections)]
+        await asyncio.sleep(self.warmup)
+        self.measuring = True
+        started = time.perf_counter()
+        await asyncio.gather(*clients)
+        result.elapsed = time.perf_counter() - started
+        return result
+
+
+    async def client(self, result: Result):
+        loop = asyncio.get_running_loop()
+        reader = writer = None
+        while loop.time() < self.deadline:
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+
+                started = time.perf_counter()
+                await self.send(writer)
+                status, size, reusable = await asyncio.wait_for(read_response(reader), self.timeout)
+                latency = time.perf_counter() - started
+
+                if self.measuring:
+                    result.latencies.append(latency)
+                    result.bytes_in += size
+                    result.statuses[status] = result.statuses.get(status, 0) + 1
+                if not reusable or not self.scenario.keepalive:
+                    writer.close()
+                    reader = writer = None
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+                if self.measuring:
+                    result.errors += 1
+                if writer is not None:
+                    writer.close()
+                reader = writer = None
+
+        if writer is not None:
+            writer.close()
+
+
+    async def send(self, writer: asyncio.StreamWriter):
+        if not self.scenario.slow:
+            writer.write(self.request)
+            await writer.drain()
+            return
+
+        step = max(len(self.request) // self.scenario.slow_parts, 1)
+        for start in range(0, len(self.request), step):
+            writer.write(self.request[start:start + step])
+            await writer.drain()
+            await asyncio.sleep(self.scenario.slow_delay)
+
+
+
+def run_scenario(host: str, port: int, scenario: Scenario, **kwargs: typing.Any) -> dict:
+    return asyncio.run(LoadGenerator(host, port, scenario, **kwargs).run()).to_dict()
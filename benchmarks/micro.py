@@ -0,0 +1,116 @@
+import socket
+import timeit
+import typing
+from server.sock import SocketReader, BufferPool
+from server.http.handlers import Request, Response
+from server.http.parser import RequestParser
+
+
+
+
+HEAD = (
+    b"GET /get/benchmark?page=2&sort=desc HTTP/1.1\r\n"
+    b"Host: 127.0.0.1:8000\r\n"
+    b"User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:128.0) Gecko/20100101 Firefox/128.0\r\n"
+    b"Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n"
+    b"Accept-Language: en-US,en;q=0.5\r\n"
+    b"Accept-Encoding: gzip, deflate, br\r\n"
+    b"Connection: keep-alive\r\n"
+    b"Cookie: session=6f1c2a7d9e; theme=dark\r\n"
+    b"Upgrade-Insecure-Requests: 1\r\n"
+    b"\r\n"
+)
+
+RESPONSE_HEADERS = [
+    ('Content-Type', 'application/json'),
+    ('Content-Length', '27'),
+    ('X-custom-header', 'its custom!'),
+    ('X-powered-by', 'Deouserver'),
+]
+
+
+
+def parsed_request() -> Request:
+    request = Request(reader=None)
+    buf = bytearray(HEAD)
+    RequestParser(request).parse(buf, 0, len(buf))
+    return request
+
+
+
+def bench_parse_head():
+    buf = bytearray(HEAD)
+    end = len(buf)
+
+    def run():
+        RequestParser(Request(reader=None)).parse(buf, 0, end)
+    return run
+
+
+
+def bench_build_environ():
+    request = parsed_request()
+
+    def run():
+        Response(None, request).build_environ()
+    return run
+
+
+
+def bench_serialize_headers():
+    request = parsed_request()
+
+    def run():
+        response = Response(None, request)
+        response.status = '200 OK'
+        response.process_headers(RESPONSE_HEADERS)
+        response.serialize_headers()
+    return run
+
+
+
+def bench_socket_reader():
+    # one head per recv, the way keep-alive clients send them
+    a, b = socket.socketpair()
+    reader = SocketReader(a, BufferPool())
+
+    def run():
+        b.send(HEAD)
+        reader.fill()
+        reader.consume(len(reader))
+    return run, (a, b)
+
+
+
+MICROBENCHMARKS: dict[str, typing.Callable] = {
+    'parse_head': bench_parse_head,
+    'build_environ': bench_build_environ,
+    'serialize_headers': bench_serialize_headers,
+    'socket_reader': bench_socket_reader,
+}
+
+
+
+def measure(func: typing.Callable, repeat: int = 5) -> float:
+    """
+    Best time per call in nanoseconds, the minimum is the run with the least noise in it.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e9
+
+
+
+def run_micro(names: list[str] = None, repeat: int = 5) -> list[dict]:
+    results = []
+    for name in names or MICROBENCHMARKS:
+        setup = MICROBENCHMARKS[name]()
+        resources = ()
+        if isinstance(setup, tuple):
+            setup, resources = setup
+        try:
+            results.append({'benchmark': name, 'ns_per_op': round(measure(setup, repeat), 1)})
+        finally:
+            for resource in resources:
+                resource.close()
+    return results
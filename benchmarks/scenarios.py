@@ -0,0 +1,32 @@
+from .loadgen import Scenario
+
+
+
+
+UPLOAD_BODY = b"u" * (256 * 1024)
+
+
+SCENARIOS: dict[str, Scenario] = {
+    'small_get': Scenario('small_get', path='/'),
+    'small_get_close': Scenario('small_get_close', path='/', keepalive=False),
+    'large_response': Scenario('large_response', path='/large'),
+    'post_upload': Scenario('post_upload', method='POST', path='/upload', body=UPLOAD_BODY,
+                            headers=[('Content-Type', 'application/octet-stream')]),
+    'slow_client': Scenario('slow_client', path='/', slow=True),
+    'static_file': Scenario('static_file', path='/static/image.jpg'),
+    'flask_json': Scenario('flask_json', path='/get/benchmark'),
+}
+
+# scenarios that only make sense against some apps, the rest run everywhere
+APP_SCENARIOS: dict[str, tuple[str, ...]] = {
+    'flask_json': ('app.app_example:app',),
+}
+
+
+def scenarios_for(app: str, names: list[str]) -> list[Scenario]:
+    selected = []
+    for name in names:
+        only = APP_SCENARIOS.get(name)
+        if only is None or app in only:
+            selected.append(SCENARIOS[name])
+    return selected
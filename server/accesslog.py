@@ -0,0 +1,157 @@
+import os
+import sys
+import time
+import random
+import threading
+import logging
+from collections import deque
+
+
+
+
+DEFAULT_FORMAT = '{remote} - - [{time}] "{method} {path} {version}" {status} {bytes} {duration_ms:.3f}ms'
+# what a record queued by `AccessLog.log` looks like, for trying out a format
+SAMPLE_RECORD = (0.0, ('127.0.0.1', 0), b"GET", b"/", b"HTTP/1.1", 200, 0, 0.0, None, None)
+
+
+
+def check_format(format: str):
+    """
+    Format a sample record with `format`, raises ValueError saying what is wrong with the template.
+    """
+    try:
+        AccessLog(format=format).format_record(SAMPLE_RECORD, 0)
+    except KeyError as e:
+        raise ValueError(f"unknown field {e} in access log format {format!r}") from None
+    except (IndexError, ValueError, TypeError, AttributeError) as e:
+        raise ValueError(f"invalid access log format {format!r}: {e}") from None
+
+
+
+class AccessLog:
+    """
+    Access log written from a background thread.
+
+    Request handling only appends a tuple to a bounded deque, formatting and writing
+    happens in the writer thread in batches of everything that piled up since the last
+    wake-up. When the deque is full records are dropped and counted instead of making
+    the request wait, the number of dropped records is written to the log as well.
+
+    `format` is a `str.format` template with the fields remote, time, method, path, version,
+    status, bytes, duration (seconds), duration_ms, user_agent, referer and pid. Only
+    `sample_rate` of the successful requests are logged, server errors always are.
+    """
+    def __init__(self, target: str = '-', format: str = DEFAULT_FORMAT, sample_rate: float = 1.0,
+                 max_queue: int = 10000, flush_interval: float = 0.2):
+        self.target = target
+        self.format = format
+        self.sample_rate = sample_rate
+        self.max_queue = max_queue
+        self.flush_interval = flush_interval
+        self.wants_headers: bool = '{user_agent' in format or '{referer' in format
+        self.records: deque[tuple] = deque()
+        self.dropped: int = 0
+        self.reported_drops: int = 0
+        self.wakeup = threading.Event()
+        self.thread: threading.Thread = None
+        self.running: bool = False
+        self.stream = None
+        self.cached_time: tuple[int, str] = (0, '')
+        self.logger = logging.getLogger(__name__)
+
+
+    def start(self):
+        # after the fork, threads dont survive it
+        if self.target == '-':
+            self.stream = sys.stderr
+        else:
+            self.stream = open(self.target, 'a', buffering=65536)
+        self.running = True
+        self.thread = threading.Thread(target=self.writer, name='access-log', daemon=True)
+        self.thread.start()
+
+
+    def log(self, addr, request, status: int, size: int, duration: float):
+        if self.sample_rate < 1.0 and status < 500 and random.random() >= self.sample_rate:
+            return
+        if len(self.records) >= self.max_queue:
+            self.dropped += 1
+            return
+
+        user_agent = referer = None
+        if self.wants_headers:
+            user_agent = request.get_header('user-agent')
+            referer = request.get_header('referer')
+        # deque.append is atomic, no lock on the request path
+        self.records.append((time.time(), addr, request.method, request.path, request.version,
+                             status, size, duration, user_agent, referer))
+
+
+    def writer(self):
+        while self.running:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.write_batch()
+        self.write_batch()
+
+
+    def write_batch(self):
+        records = self.records
+        lines = []
+        pid = os.getpid()
+        while records:
+            record = records.popleft()
+            try:
+                lines.append(self.format_record(record, pid))
+            except Exception:
+                # the format is checked at startup, still never let one record stop the writer
+                self.logger.exception("Couldnt format an access log record")
+
+        dropped = self.dropped
+        if dropped != self.reported_drops:
+            lines.append(f"access log queue full, {dropped - self.reported_drops} record(s) dropped")
+            self.reported_drops = dropped
+
+        if not lines:
+            return
+        try:
+            self.stream.write("\n".join(lines) + "\n")
+            self.stream.flush()
+        except (OSError, ValueError) as e:
+            self.logger.error("Couldnt write the access log: %s", str(e))
+
+
+    def format_record(self, record: tuple, pid: int) -> str:
+        timestamp, addr, method, path, version, status, size, duration, user_agent, referer = record
+        return self.format.format_map({
+            'remote': addr[0] if isinstance(addr, tuple) else (addr or '-'),
+            'time': self.format_time(timestamp),
+            'method': method.decode('latin-1'),
+            'path': path.decode('latin-1'),
+            'version': version.decode('latin-1'),
+            'status': status,
+            'bytes': size,
+            'duration': duration,
+            'duration_ms': duration * 1000,
+            'user_agent': user_agent or '-',
+            'referer': referer or '-',
+            'pid': pid,
+        })
+
+
+    def format_time(self, timestamp: float) -> str:
+        second = int(timestamp)
+        if second != self.cached_time[0]:
+            self.cached_time = (second, time.strftime('%d/%b/%Y:%H:%M:%S %z', time.localtime(second)))
+        return self.cached_time[1]
+
+
+    def close(self):
+        if self.thread is None:
+            return
+        self.running = False
+        self.wakeup.set()
+        self.thread.join(timeout=5)
+        self.thread = None
+        if self.stream is not sys.stderr:
+            self.stream.close()
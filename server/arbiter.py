@@ -0,0 +1,500 @@
+import os
+import sys
+import errno
+import select
+import signal
+import socket
+import time
+import typing
+import logging
+import importlib
+import gc
+import struct
+from .config import Config
+from .sock import create_sockets, SocketOptions, INHERIT_ENV
+from .utils import init_signals, find_application
+from .errors import ApplicationStartupFailed, FatalConfigException
+from .metrics import Metrics, StatsListener, STATS_FD_ENV
+from .workers.base import BaseWorker
+
+
+
+
+class Arbiter:
+    """
+    Master process that forks and supervises the worker pool.
+
+    The master itself never accepts connections. It forks `cfg.workers` workers that share
+    the listeners created by `create_sockets`, restarts the ones that die and passes SIGINT/SIGTERM
+    through to them. With SO_REUSEPORT every worker slot gets listeners of its own instead, the
+    master keeps them open so the connections queued on them wait for the replacement of a worker
+    that exits instead of being reset. With a stats listener configured it also serves the
+    request metrics the workers collect.
+
+    SIGHUP reloads: the app is imported again and a new generation of workers starts on the
+    same listeners, the old one is told to finish what it has in flight once every new worker
+    reported it is serving. Connections waiting in the backlog are picked up by whichever
+    generation accepts first. If a new worker exits before that, the reload is given up
+    and the old generation keeps serving. SIGUSR2
+    execs a new master that takes over the listeners, this one keeps serving until it gets
+    SIGINT, so the new code can be checked before the old master is stopped.
+    """
+    # exit code used by a worker that couldnt even start, respawning it would just loop
+    WORKER_BOOT_ERROR = 3
+    # a worker crashing sooner than this after it was spawned makes the next respawn wait,
+    # twice as long every time up to the maximum, so a crash loop doesnt fork as fast as it can
+    RESPAWN_WINDOW = 5.0
+    MAX_RESPAWN_DELAY = 60.0
+
+    READY = struct.Struct('i') # pid a worker writes to the ready pipe once it is serving
+
+    SIGNALS = [signal.SIGINT, signal.SIGTERM, signal.SIGCHLD, signal.SIGHUP, signal.SIGUSR2, signal.SIGUSR1]
+
+    def __init__(self, app: typing.Callable, listeners: list[socket.socket], cfg: Config):
+        self.app = app
+        self.cfg = cfg
+        self.listeners = listeners
+        self.worker_class: type[BaseWorker] = cfg.workertype
+        self.num_workers: int = cfg.workers
+        self.graceful_timeout: int | float = cfg.graceful_timeout
+        self.workers: dict[int, BaseWorker] = {}
+        self.retiring: dict[int, float] = {} # workers of a previous generation draining, pid -> deadline
+        self.spawned_at: dict[int, float] = {} # worker pid -> time.monotonic() it was forked
+        self.respawn_delay: float = 0
+        self.respawn_at: float = 0 # no workers are respawned before this
+        self.reloading: list[int] = [] # workers of the previous generation, kept until the new one is up
+        self.booting: set[int] = set() # workers of the new generation that didnt report yet
+        self.boot_deadline: float = 0
+        self.previous_app: typing.Callable = None # the app a given up reload goes back to
+        self.port_listeners: list[list[socket.socket]] = [] # SO_REUSEPORT listeners of every worker slot
+        self.port_slots: dict[int, int] = {} # worker pid -> its slot in port_listeners
+        self.alive: bool = False
+        self.failed: bool = False
+        self.pid: int = None
+        self.signal_queue: list[int] = []
+        self.wakeup_pipe: tuple[int, int] = None
+        self.ready_pipe: tuple[int, int] = None
+        self.metrics: Metrics = None
+        self.stats: StatsListener = None
+        self.metric_slots: dict[int, int] = {} # worker pid -> its slot in the shared metrics
+        if cfg.stats_bind:
+            # room for a second generation of workers while the old one drains
+            self.metrics = Metrics(self.num_workers * 2)
+        self.logger = logging.getLogger(__name__)
+
+
+    def run(self):
+        self.start()
+
+        try:
+            while self.alive:
+                self.sleep()
+                self.process_signals()
+                if self.alive:
+                    self.manage_workers()
+        except Exception:
+            self.logger.exception("Unhandled exception in the master process")
+            self.failed = True
+        finally:
+            # no worker should outlive the master
+            if self.workers:
+                self.stop(graceful=False)
+            if self.stats:
+                self.stats.close()
+
+
+    def start(self):
+        self.pid = os.getpid()
+        self.alive = True
+        self.wakeup_pipe = os.pipe()
+        self.ready_pipe = os.pipe()
+        for fd in self.wakeup_pipe + self.ready_pipe:
+            os.set_blocking(fd, False)
+            os.set_inheritable(fd, False)
+
+        init_signals([(sig, self.signal_handler) for sig in self.SIGNALS])
+
+        if self.metrics:
+            self.stats = StatsListener(self.cfg.stats_bind, self.metrics)
+            fd = os.environ.pop(STATS_FD_ENV, None)
+            try:
+                self.stats.listen(int(fd) if fd else None)
+            except FatalConfigException as e:
+                self.logger.critical(str(e))
+                self.stats = None
+                self.alive = False
+                self.failed = True
+                return
+
+        if self.cfg.reuse_port and not self.bind_port_listeners():
+            self.alive = False
+            self.failed = True
+            return
+
+        self.logger.info("Master process started (pid: %s), spawning %i %s worker(s)",
+                         self.pid, self.num_workers, self.worker_class.__name__)
+        self.freeze()
+        self.manage_workers()
+
+
+    def bind_port_listeners(self) -> bool:
+        """
+        One set of SO_REUSEPORT listeners per worker slot, the ones bound before the master started
+        are the first. A unix socket path can only be bound once, those stay shared.
+        """
+        first = [sock for sock in self.listeners if sock.family != socket.AF_UNIX]
+        self.listeners = [sock for sock in self.listeners if sock.family == socket.AF_UNIX]
+        self.port_listeners = [first]
+        addresses = [address for address in self.cfg.bind if not isinstance(address, str)]
+        try:
+            for _ in range(self.num_workers - 1):
+                self.port_listeners.append(create_sockets(addresses, self.cfg.backlog, True,
+                                                          SocketOptions.from_config(self.cfg)))
+        except OSError:
+            self.logger.exception("Couldnt bind the listeners of every worker")
+            return False
+        return True
+
+
+    def signal_handler(self, signum, frame):
+        if len(self.signal_queue) < 5:
+            self.signal_queue.append(signum)
+        self.wakeup()
+
+
+    def wakeup(self):
+        try:
+            os.write(self.wakeup_pipe[1], b'.')
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EINTR):
+                raise
+
+
+    def sleep(self):
+        try:
+            ready = select.select([self.wakeup_pipe[0], self.ready_pipe[0]] + ([self.stats] if self.stats else []), [], [], 1.0)
+            if not ready[0]:
+                return
+            if self.stats in ready[0]:
+                self.stats.handle()
+            if self.ready_pipe[0] in ready[0]:
+                self.read_ready()
+            if self.wakeup_pipe[0] not in ready[0]:
+                return
+            while os.read(self.wakeup_pipe[0], 1):
+                pass
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EINTR):
+                raise
+
+
+    def process_signals(self):
+        while self.signal_queue:
+            signum = self.signal_queue.pop(0)
+            if signum == signal.SIGCHLD:
+                self.reap_workers()
+            elif signum == signal.SIGINT:
+                self.logger.info("Gracefully shutting down the workers. . .")
+                self.stop(graceful=True)
+            elif signum == signal.SIGTERM:
+                self.logger.info("Forcefully shutting down the workers. . .")
+                self.stop(graceful=False)
+            elif signum == signal.SIGHUP and self.alive:
+                self.reload()
+            elif signum == signal.SIGUSR2 and self.alive:
+                self.upgrade()
+            elif signum == signal.SIGUSR1:
+                # allocation dumps are written by the workers
+                self.kill_workers(signal.SIGUSR1)
+
+
+    def read_ready(self):
+        # every message is as long as a pid and written at once, a read never splits one
+        while True:
+            try:
+                data = os.read(self.ready_pipe[0], self.READY.size * 256)
+            except BlockingIOError:
+                return
+            if not data:
+                return
+            for (pid,) in self.READY.iter_unpack(data):
+                self.booting.discard(pid)
+
+
+    def manage_workers(self):
+        self.reap_workers()
+        self.check_reload()
+        self.kill_retiring()
+        if time.monotonic() < self.respawn_at:
+            return
+        while self.alive and len(self.workers) - len(self.retiring) < self.num_workers:
+            self.spawn_worker()
+
+
+    def reload(self):
+        if self.reloading:
+            self.logger.warning("The previous reload is still waiting for its workers, ignoring SIGHUP")
+            return
+        app = self.reload_app()
+        if app is None:
+            return
+        self.previous_app, self.app = self.app, app
+        self.freeze()
+
+        self.reloading = [pid for pid in self.workers if pid not in self.retiring]
+        self.logger.info("Reloading, replacing %i worker(s)", len(self.reloading))
+        # the new generation is up before the old one stops accepting
+        self.boot_deadline = time.monotonic() + self.graceful_timeout
+        for _ in range(self.num_workers):
+            self.booting.add(self.spawn_worker())
+
+
+    def check_reload(self):
+        if not self.reloading:
+            return
+        if not self.booting:
+            self.logger.info("New workers are serving, retiring %i old worker(s)", len(self.reloading))
+            self.retire([pid for pid in self.reloading if pid in self.workers])
+            self.reloading = []
+            self.previous_app = None
+        elif time.monotonic() >= self.boot_deadline:
+            self.logger.error("%i new worker(s) didnt start serving in time", len(self.booting))
+            self.give_up_reload()
+
+
+    def give_up_reload(self):
+        self.logger.error("Reload failed, keeping the old workers")
+        new = [pid for pid in self.workers if pid not in self.retiring and pid not in self.reloading]
+        self.retire(new)
+        self.reloading = []
+        self.booting.clear()
+        # respawned workers run the app the old generation does
+        self.app, self.previous_app = self.previous_app, None
+        self.freeze()
+
+
+    def retire(self, pids: list[int]):
+        deadline = time.monotonic() + self.graceful_timeout
+        for pid in pids:
+            self.retiring[pid] = deadline
+            try:
+                os.kill(pid, signal.SIGINT)
+            except ProcessLookupError:
+                pass
+
+
+    def reload_app(self) -> typing.Callable | None:
+        uri = self.cfg.app_uri
+        if uri is None:
+            # passed in as a callable, there is nothing to import again
+            return self.app
+
+        module = uri.split(':', 1)[0]
+        if not module.endswith('.py'):
+            # drop the package of the app from the import cache, so its modules are read from disk again
+            package = module.split('.')[0]
+            if package != __name__.split('.')[0]:
+                for name in [name for name in sys.modules if name == package or name.startswith(package + '.')]:
+                    del sys.modules[name]
+        importlib.invalidate_caches()
+
+        try:
+            return find_application(uri)
+        except Exception:
+            self.logger.exception("Couldnt reload the app from %s, keeping the current workers", uri)
+            return None
+
+
+    def freeze(self):
+        if not self.cfg.preload:
+            return
+        # whatever the app import left behind goes first, the rest is never looked at by the gc again.
+        # after a reload the previous app has to become collectable again before that
+        gc.unfreeze()
+        gc.collect()
+        gc.freeze()
+        self.logger.info("Froze %i objects before forking", gc.get_freeze_count())
+
+
+    def kill_retiring(self):
+        now = time.monotonic()
+        for pid, deadline in list(self.retiring.items()):
+            if now < deadline:
+                continue
+            self.logger.warning("Old worker %s didnt finish in time, killing it", pid)
+            self.retiring.pop(pid)
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+
+    def upgrade(self):
+        """
+        Exec a new master with the same command line, it inherits the listeners instead of binding them.
+        """
+        env = os.environ.copy()
+        fds = [sock.fileno() for sock in self.listeners]
+        env[INHERIT_ENV] = ','.join(map(str, fds))
+        if self.stats:
+            fds.append(self.stats.fileno())
+            env[STATS_FD_ENV] = str(self.stats.fileno())
+
+        pid = os.fork()
+        if pid != 0:
+            if self.stats:
+                # the socket file belongs to the new master now
+                self.stats.unix_path = None
+            self.logger.info("Started a new master (pid: %s), stop this one with SIGINT once it serves", pid)
+            return
+
+        try:
+            for fd in fds:
+                os.set_inheritable(fd, True)
+            os.execve(sys.executable, [sys.executable] + sys.argv, env)
+        except Exception:
+            self.logger.exception("Couldnt exec the new master")
+        finally:
+            os._exit(1)
+
+
+    def spawn_worker(self) -> int:
+        worker = self.worker_class(app=self.app, listeners=self.listeners, cfg=self.cfg)
+        worker.ready_fd = self.ready_pipe[1]
+        slot = None
+        if self.metrics:
+            slot = min(set(range(self.metrics.slots)) - set(self.metric_slots.values()), default=None)
+            if slot is not None:
+                worker.metrics = self.metrics.for_worker(slot)
+        port_slot = None
+        if self.port_listeners:
+            # the slot with the fewest workers that keep accepting, during a reload both generations share them
+            taken = [self.port_slots[pid] for pid in self.workers if pid not in self.retiring]
+            port_slot = min(range(len(self.port_listeners)), key=taken.count)
+            worker.listeners = self.listeners + self.port_listeners[port_slot]
+
+        pid = os.fork()
+        if pid != 0:
+            worker.pid = pid
+            self.workers[pid] = worker
+            if slot is not None:
+                self.metric_slots[pid] = slot
+            if port_slot is not None:
+                self.port_slots[pid] = port_slot
+            self.spawned_at[pid] = time.monotonic()
+            self.logger.debug("Spawned worker (pid: %s)", pid)
+            return pid
+
+        # worker process from here on, it must never return into the master loop
+        exitcode = 0
+        try:
+            worker.pid = os.getpid()
+            self.reset_signals()
+            worker.run()
+        except ApplicationStartupFailed as e:
+            # every other worker would fail the same way, let the master stop
+            self.logger.critical("Worker %s: %s", worker.pid, str(e))
+            exitcode = self.WORKER_BOOT_ERROR
+        except SystemExit as e:
+            exitcode = e.code if type(e.code) == int else 1
+        except Exception:
+            self.logger.exception("Worker %s crashed", worker.pid)
+            exitcode = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(exitcode)
+
+
+    def reset_signals(self):
+        for sig in self.SIGNALS:
+            # reloads are the masters business, a worker that gets one sent to the whole group keeps serving.
+            # SIGUSR1 is ignored as well unless the worker installs its allocation dump for it
+            signal.signal(sig, signal.SIG_IGN if sig in (signal.SIGHUP, signal.SIGUSR2, signal.SIGUSR1) else signal.SIG_DFL)
+        for fd in self.wakeup_pipe:
+            os.close(fd)
+        os.close(self.ready_pipe[0])
+        if self.stats:
+            self.stats.close(unlink=False)
+
+
+    def reap_workers(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+            self.metric_slots.pop(pid, None)
+            self.port_slots.pop(pid, None)
+            lived = time.monotonic() - self.spawned_at.pop(pid, 0)
+
+            exitcode = os.waitstatus_to_exitcode(status)
+            if self.retiring.pop(pid, None) is not None:
+                self.logger.info("Old worker %s finished draining", pid)
+            elif pid in self.booting:
+                # whatever made it fail, the old generation still serves and is not touched
+                self.booting.discard(pid)
+                self.logger.error("New worker %s exited with code %s before it started serving", pid, exitcode)
+                self.give_up_reload()
+            elif exitcode == self.WORKER_BOOT_ERROR and self.alive:
+                self.logger.critical("Worker %s failed to boot, shutting down the master", pid)
+                self.alive = False
+                self.failed = True
+            elif self.alive:
+                if exitcode < 0:
+                    self.logger.error("Worker %s was killed by signal %s, respawning", pid, -exitcode)
+                elif exitcode != 0:
+                    self.logger.error("Worker %s exited with code %s, respawning", pid, exitcode)
+                else:
+                    self.logger.info("Worker %s exited, respawning", pid)
+                if exitcode != 0:
+                    self.back_off(lived)
+
+
+    def back_off(self, lived: float):
+        if lived >= self.RESPAWN_WINDOW:
+            self.respawn_delay = 0
+            return
+        if time.monotonic() < self.respawn_at:
+            # the others of the same round dont make it longer
+            return
+        self.respawn_delay = min(max(self.respawn_delay * 2, 1.0), self.MAX_RESPAWN_DELAY)
+        self.respawn_at = time.monotonic() + self.respawn_delay
+        self.logger.warning("Workers crash right after starting, waiting %.0fs before respawning", self.respawn_delay)
+
+
+    def kill_workers(self, sig: int):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                self.workers.pop(pid, None)
+                self.metric_slots.pop(pid, None)
+                self.port_slots.pop(pid, None)
+                self.spawned_at.pop(pid, None)
+                self.retiring.pop(pid, None)
+
+
+    def stop(self, graceful: bool = True):
+        self.alive = False
+        self.reloading = []
+        self.booting.clear()
+        self.kill_workers(signal.SIGINT if graceful else signal.SIGTERM)
+
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.workers and time.monotonic() < deadline:
+            self.reap_workers()
+            time.sleep(0.1)
+
+        if self.workers:
+            self.logger.warning("%i worker(s) didnt stop in time, killing them", len(self.workers))
+            self.kill_workers(signal.SIGKILL)
+            while self.workers:
+                self.reap_workers()
+                time.sleep(0.1)
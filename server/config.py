@@ -3,6 +3,9 @@ from server.utils import find_application
 from .errors import FatalConfigException
 import typing
 import importlib
+import os
+from .http.compression import DEFAULT_TYPES
+from .accesslog import DEFAULT_FORMAT, check_format
 
 
 
@@ -16,8 +19,9 @@ class Config:
         app (typing.Callable): The WSGI application callable that will handle requests.
         
         
-        bind (list[tuple[str, int]]): List of (host, port) tuples to bind the server to.
-            Currently only supports TCP.
+        bind (list[tuple[str, int] | str]): List of (host, port) tuples and unix socket paths to bind the server to.
+        Given as `host:port`, `[ipv6]:port` or `unix:/path/to/socket`. Listeners passed by systemd socket
+        activation are used instead when there are any.
             
             Default: ('127.0.0.1', 8000)
         
@@ -27,9 +31,12 @@ class Config:
             Default: 2048
         
         
-        workertype (typing.Literal['sync']): The type of worker processing model to use.
+        workertype (typing.Literal['sync', 'threaded', 'asyncio']): The type of worker processing model to use.
             Options:
             'sync' - Synchronous worker, processes one request at a time
+            'threaded' - Thread pool worker, parks idle keep-alive connections in a selector
+            and hands ready requests to a pool of `threads` threads
+            'asyncio' - Event loop worker, runs ASGI 3 apps natively and WSGI apps in a pool of `threads` threads
             
             Default: 'sync'
             
@@ -40,14 +47,293 @@ class Config:
             Default: 'info'
             
             
-        avoid_keepalive (bool): Avoid keeping the socket connection alive. (sync workers ignore this)
+        avoid_keepalive (bool): Avoid keeping the socket connection alive. Sync workers serve nothing else
+        while a connection is kept alive, consider it for them if clients are slow to reuse connections.
         
             Default: False
             
             
-        client_timeout (int): How much time we give the client before closing the connection.
+        keepalive_timeout (int | float): How long an idle keep-alive connection is kept open waiting for
+        the next request.
+        
+            Default: 2
+            
+            
+        max_keepalive_requests (int): How many requests are served on one connection before it gets closed.
+        
+            Default: 100
+            
+            
+        threads (int): Size of the thread pool of a threaded worker, or of the executor running WSGI apps
+        in an asyncio worker.
+        
+            Default: 4
+            
+            
+        worker_connections (int): Maximum number of connections a threaded worker holds at once
+        (including the idle keep-alive ones). The worker stops accepting while at the limit.
+        
+            Default: 1000
+            
+            
+        write_batch_size (int): Response bytes collected before they are handed to the kernel in one
+        `sendmsg` call. Bodies returned as a list go out together with the headers up to this size,
+        streamed bodies are never held back.
+        
+            Default: 65536
+            
+            
+        client_timeout (int): How long a single receive from the client may wait, and how long the client may
+        take to accept one write of the response, before the connection is closed.
         
             Default: 5
+            
+            
+        header_timeout (int | float): Total time a client gets to send the head of a request, counted from the
+        accept or, on a keep-alive connection, from the first byte of the request. Unlike `client_timeout` it
+        isnt reset by every byte that trickles in, so slow clients cant hold a worker forever. 0 disables it.
+        
+            Default: 10
+            
+            
+        body_timeout (int | float): Total time a client gets to send a request body, counted from when the app
+        starts reading it. 0 disables it.
+        
+            Default: 60
+            
+            
+        write_timeout (int | float): Total time a client gets to take in a response, counted from the first
+        byte sent. A client reading a little every few seconds would otherwise hold the connection as long as
+        it likes. Long streaming responses need it raised. 0 disables it, then only `client_timeout` bounds
+        every single write.
+        
+            Default: 60
+            
+            
+        workers (int): Number of worker processes the master forks. All of them share the same listeners.
+        
+            Default: 1
+            
+            
+        accept_batch (int): How many connections a worker accepts from one listener in a row before it moves
+        on to the next ready one, so with several `bind` addresses a busy port cant starve the others.
+        
+            Default: 16
+            
+            
+        reuse_port (bool): Give every worker its own listeners with SO_REUSEPORT, so the kernel balances
+        accepted connections between workers instead of waking all of them on a shared socket.
+        The master binds them and keeps them open, a worker that is replaced hands its queue
+        to the next one. Unix sockets stay shared.
+        
+            Default: False
+            
+            
+        tcp_nodelay (bool): Disable Nagle's algorithm on the connections. Responses are already written in as
+        few calls as possible, it mostly helps streamed responses.
+        
+            Default: False
+            
+            
+        tcp_quickack (bool): Set TCP_QUICKACK on accepted connections so the kernel doesnt delay the ACK of
+        the first request. Linux only.
+        
+            Default: False
+            
+            
+        tcp_defer_accept (int): Seconds the kernel holds a new connection back until it sent data, workers
+        never wake up for connections that dont send a request. Linux only, 0 disables it.
+        
+            Default: 0
+            
+            
+        tcp_fastopen (int): Length of the TCP Fast Open queue of the listeners, clients that support it can
+        send the request along with the SYN. 0 disables it.
+        
+            Default: 0
+            
+            
+        socket_rcvbuf (int): SO_RCVBUF of the listeners in bytes, inherited by accepted connections.
+        0 leaves the kernel default and its autotuning.
+        
+            Default: 0
+            
+            
+        socket_sndbuf (int): SO_SNDBUF of the listeners in bytes, inherited by accepted connections.
+        0 leaves the kernel default and its autotuning.
+        
+            Default: 0
+            
+            
+        preload (bool): The app is always imported by the master before it forks. With preload the master also
+        collects garbage and moves everything it allocated into the permanent generation with `gc.freeze()`,
+        so collections in the workers never write to those pages and they stay shared with the master.
+        Refcount updates still copy the pages of objects the workers actually touch.
+        
+            Default: False
+            
+            
+        gc_threshold (list[int]): `gc.set_threshold` values for the workers, up to three of them.
+        A single 0 disables the automatic collection in the workers. Empty keeps the interpreter defaults.
+        
+            Default: []
+            
+            
+        max_requests (int): Requests a worker serves before it finishes its current connection and exits to be
+        replaced by a fresh one, a way to keep slow leaks in the app bounded. 0 disables it.
+        
+            Default: 0
+            
+            
+        max_requests_jitter (int): Each worker adds a random number of requests up to this to `max_requests`,
+        so the workers dont all restart at the same moment.
+        
+            Default: 0
+            
+            
+        max_worker_memory (int): Resident memory in bytes past which a worker is replaced the same way, checked
+        between requests at most once a second. 0 disables it.
+        
+            Default: 0
+            
+            
+        tracemalloc_dir (str | None): Workers trace their allocations with `tracemalloc` and on SIGUSR1 (sent to
+        the master, it passes it on) write the allocations that grew since the previous dump to a file in this
+        directory. Tracing slows the workers down, only meant for hunting leaks. None disables it.
+        
+            Default: None
+            
+            
+        graceful_timeout (int): How long the master waits for workers to finish in-flight requests on shutdown,
+        or for the old workers to drain after a reload (SIGHUP), before killing them.
+        
+            Default: 30
+            
+            
+        static (list[tuple[str, str]]): URL prefixes mapped to directories served by the workers themselves,
+        passed as `prefix=directory` (e.g. `/static=app/static`). Files that dont exist fall through to the app.
+        
+            Default: []
+            
+            
+        static_cache_size (int): How many open static files (with their stat results and validators) every
+        worker keeps around.
+        
+            Default: 256
+            
+            
+        cache_ttl (int | float): Seconds a response to a GET is kept in the per-worker response cache and replayed
+        without calling the app. `Cache-Control` of the response can only shorten it, `no-store`, `private`,
+        `no-cache` and `Set-Cookie` keep the response out. 0 disables the cache.
+        
+            Default: 0
+            
+            
+        cache_size (int): Memory cap of the response cache in bytes, least recently used responses are evicted
+        first. A single response may take up to a 16th of it.
+        
+            Default: 67108864
+            
+            
+        cache_vary (list[str]): Request headers that are part of the cache key, besides the path and query string.
+        Responses varying on any other header are not cached.
+        
+            Default: []
+            
+            
+        cache_routes (list[tuple[str, int | float]]): Path prefixes with their own ttl, passed as `prefix=seconds`
+        (e.g. `/get=30`). A ttl of 0 keeps the route out of the cache.
+        
+            Default: []
+            
+            
+        cache_coalesce (int | float): Seconds identical cacheable requests wait for one of them that is already
+        running the app, instead of each running it. They are answered with its response once it is cached,
+        or run the app themselves when it turns out uncacheable or takes longer. Needs the response cache and
+        only applies to the threaded and asyncio workers. 0 disables it.
+        
+            Default: 0
+            
+            
+        compression (bool): Compress response bodies with gzip or deflate when the client accepts it. Lists are
+        compressed whole and keep a Content-Length, streamed bodies are compressed as they go. Static files are
+        compressed once per file version and kept in memory.
+        
+            Default: False
+            
+            
+        compression_level (int): zlib compression level, 1 (fastest) to 9 (smallest).
+        
+            Default: 6
+            
+            
+        compression_min_size (int): Bodies known to be smaller than this many bytes are sent as they are.
+        
+            Default: 1024
+            
+            
+        compression_types (list[str]): Content types that get compressed, `type/*` matches a whole top level type.
+        
+            Default: text/html, text/plain, text/css, text/xml, text/javascript, text/csv, application/javascript,
+            application/json, application/xml, image/svg+xml
+            
+            
+        stats_bind (str | None): Address of the metrics listener served by the master, `host:port` or
+        `unix:/path/to/socket`. Workers time every phase of every request into histograms kept in shared
+        memory, the listener exposes them for all workers in the Prometheus text format. None disables it.
+        
+            Default: None
+            
+            
+        max_body_size (int): Largest request body accepted, in bytes. Bigger announced bodies are answered
+        with 413 before they are read, chunked ones as soon as they grow past it. 0 means no limit.
+        
+            Default: 0
+            
+            
+        body_spool_size (int): Request bodies WSGI apps read are kept in memory up to this many bytes
+        and spilled to a temporary file above it. 0 lets the sync and threaded workers read bodies
+        straight from the socket, the asyncio worker always keeps them in memory then.
+        
+            Default: 1048576
+            
+            
+        max_queue_latency (float): Latency budget in seconds. A request that waited longer than this for a
+        worker to get to it, in the listen backlog or in the workers own queue, is answered right away with a
+        503 and `Retry-After` instead of being served, its client has likely given up already. Every worker
+        applies it on its own. The wait is taken from TCP_INFO where it exists, elsewhere only the threaded
+        worker measures its own queue. 0 disables it.
+        
+            Default: 0
+            
+            
+        retry_after (int): Seconds sent in the `Retry-After` header of those 503 responses.
+        
+            Default: 1
+            
+            
+        access_log (str | None): Where every worker appends one line per request, a file path or `-` for stderr.
+        Lines are queued and written in batches by a background thread of the worker, so a slow disk never
+        holds up a response. None disables it.
+        
+            Default: None
+            
+            
+        access_log_format (str): `str.format` template of an access log line. Fields: remote, time, method, path,
+        version, status, bytes, duration, duration_ms, user_agent, referer, pid.
+        
+            Default: {remote} - - [{time}] "{method} {path} {version}" {status} {bytes} {duration_ms:.3f}ms
+            
+            
+        access_log_queue_size (int): Lines a worker keeps waiting for the writer, lines that dont fit anymore are
+        dropped and only counted.
+        
+            Default: 10000
+            
+            
+        access_log_sample (float): Share of the requests that get logged, between 0 and 1. Server errors are always logged.
+        
+            Default: 1.0
     
             
     Examples:
@@ -66,14 +352,59 @@ class Config:
     def __init__(self):
         # server config options
         self.app: typing.Callable = None
-        self.bind: list[tuple[str, int]] = []
+        self.app_uri: str | None = None # `module:callable` the app was imported from, reloads import it again
+        self.bind: list[tuple[str, int] | str] = []
         self.backlog: int = 2048
-        self.workertype: typing.Literal['sync'] = 'sync'
+        self.workertype: typing.Literal['sync', 'threaded', 'asyncio'] = 'sync'
         self.logging_level: typing.Literal['critical', 'error', 'warning', 'info', 'debug'] = 'info'
+        self.workers: int = 1
+        self.reuse_port: bool = False
+        self.tcp_nodelay: bool = False
+        self.tcp_quickack: bool = False
+        self.tcp_defer_accept: int = 0
+        self.tcp_fastopen: int = 0
+        self.socket_rcvbuf: int = 0
+        self.socket_sndbuf: int = 0
+        self.accept_batch: int = 16
+        self.graceful_timeout: int = 30
+        self.preload: bool = False
+        self.max_requests: int = 0
+        self.max_requests_jitter: int = 0
+        self.max_worker_memory: int = 0
+        self.tracemalloc_dir: str | None = None
+        self.gc_threshold: list[int] = []
 
         # worker specific
         self.client_timeout: int = 5
         self.avoid_keepalive: bool = False
+        self.keepalive_timeout: int | float = 2
+        self.header_timeout: int | float = 10
+        self.body_timeout: int | float = 60
+        self.write_timeout: int | float = 60
+        self.max_keepalive_requests: int = 100
+        self.threads: int = 4
+        self.worker_connections: int = 1000
+        self.write_batch_size: int = 65536
+        self.static: list[tuple[str, str]] = []
+        self.static_cache_size: int = 256
+        self.cache_ttl: int | float = 0
+        self.cache_size: int = 64 * 1024 * 1024
+        self.cache_vary: list[str] = []
+        self.cache_routes: list[tuple[str, int | float]] = []
+        self.cache_coalesce: int | float = 0
+        self.compression: bool = False
+        self.compression_level: int = 6
+        self.compression_min_size: int = 1024
+        self.compression_types: list[str] = list(DEFAULT_TYPES)
+        self.stats_bind: str | None = None
+        self.max_body_size: int = 0
+        self.body_spool_size: int = 1024 * 1024
+        self.max_queue_latency: float = 0
+        self.retry_after: int = 1
+        self.access_log: str | None = None
+        self.access_log_format: str = DEFAULT_FORMAT
+        self.access_log_queue_size: int = 10000
+        self.access_log_sample: float = 1.0
         
         # internal
         self._exceptions: list[tuple[str, str]] = []
@@ -82,12 +413,26 @@ class Config:
     def perform_validations(self):
         self.verify_app(self.app)
         self.verify_worker(self.workertype)
+        self.verify_workers_count(self.workers)
+        self.verify_threads_count(self.threads)
+        self.verify_accept_batch(self.accept_batch)
+        self.verify_static(self.static)
+        self.verify_cache_routes(self.cache_routes)
+        self.verify_cache_coalesce(self.cache_coalesce, self.cache_ttl)
+        self.verify_compression_level(self.compression_level)
+        self.verify_access_log_format(self.access_log_format)
+        self.verify_access_log_sample(self.access_log_sample)
+        self.verify_gc_threshold(self.gc_threshold)
+        self.verify_recycling(self.max_requests, self.max_requests_jitter, self.max_worker_memory)
+        self.verify_load_shedding(self.max_queue_latency, self.retry_after)
         self.verify_bind_addresses(self.bind) # first it accepts raw addresses passed by argparse, like 127.0.0.1:8000, only then assigns tuples to self.bind
 
 
     def verify_worker(self, worker_class: str):
         WORKERS_MAP = {
            'sync': 'server.workers.sync.SyncWorker',
+           'threaded': 'server.workers.threaded.ThreadedWorker',
+           'asyncio': 'server.workers.aio.AsyncioWorker',
         }
         if worker_class not in WORKERS_MAP:
             self._exceptions.append(('workertype', "Incorrect workertype name, using sync worker instead."))
@@ -102,7 +447,111 @@ class Config:
         self.workertype = worker_instance
 
 
+    def verify_workers_count(self, count: int):
+        if type(count) != int or count < 1:
+            self._exceptions.append(('workers', "Workers count must be a positive integer, using 1 worker instead."))
+            self.workers = 1
+
+
+    def verify_accept_batch(self, batch: int):
+        if batch < 1:
+            self._exceptions.append(('accept_batch', "Accept batch must be at least 1, using 16."))
+            self.accept_batch = 16
+
+
+    def verify_threads_count(self, count: int):
+        if type(count) != int or count < 1:
+            self._exceptions.append(('threads', "Threads count must be a positive integer, using 4 threads instead."))
+            self.threads = 4
+
+
+    def verify_static(self, mounts: list[str]):
+        _static = []
+        for mount in mounts:
+            if isinstance(mount, tuple):
+                _static.append(mount)
+                continue
+            prefix, sep, directory = mount.partition('=')
+            if not sep or not prefix.startswith('/') or not os.path.isdir(directory):
+                self._exceptions.append(('static', f'Couldnt mount {mount}, expected /prefix=existing_directory'))
+                continue
+            _static.append((prefix, directory))
+        self.static = _static
+
+
+    def verify_cache_routes(self, routes: list[str]):
+        _routes = []
+        for route in routes:
+            if isinstance(route, tuple):
+                _routes.append(route)
+                continue
+            prefix, _, ttl = route.partition('=')
+            try:
+                _routes.append((prefix, float(ttl)))
+            except ValueError:
+                self._exceptions.append(('cache_routes', f'Couldnt resolve the route ttl {route}, expected /prefix=seconds'))
+        self.cache_routes = _routes
+
+
+    def verify_cache_coalesce(self, coalesce: int | float, ttl: int | float):
+        if coalesce < 0:
+            self._exceptions.append(('cache_coalesce', "Coalescing wait cant be negative, requests wont be coalesced."))
+            self.cache_coalesce = 0
+        elif coalesce > 0 and ttl <= 0:
+            self._exceptions.append(('cache_coalesce', "Coalescing needs the response cache, set cache_ttl."))
+            self.cache_coalesce = 0
+
+
+    def verify_compression_level(self, level: int):
+        if type(level) != int or not 1 <= level <= 9:
+            self._exceptions.append(('compression_level', "Compression level must be between 1 and 9, using 6 instead."))
+            self.compression_level = 6
+
+
+    def verify_access_log_format(self, format: str):
+        # a bad template would only fail in the writer thread of every worker, refuse to start instead
+        try:
+            check_format(format)
+        except ValueError as e:
+            raise FatalConfigException(str(e))
+
+
+    def verify_access_log_sample(self, sample: float):
+        if not 0 <= sample <= 1:
+            self._exceptions.append(('access_log_sample', "Access log sample must be between 0 and 1, logging every request instead."))
+            self.access_log_sample = 1.0
+
+
+    def verify_gc_threshold(self, threshold: list[int]):
+        if len(threshold) > 3 or any(type(value) != int or value < 0 for value in threshold):
+            self._exceptions.append(('gc_threshold', "GC threshold takes up to 3 non-negative integers, keeping the defaults."))
+            self.gc_threshold = []
+
+
+    def verify_recycling(self, max_requests: int, jitter: int, max_memory: int):
+        if max_requests < 0:
+            self._exceptions.append(('max_requests', "Max requests cant be negative, workers wont be restarted after a number of requests."))
+            self.max_requests = 0
+        if jitter < 0:
+            self._exceptions.append(('max_requests_jitter', "Max requests jitter cant be negative, using no jitter."))
+            self.max_requests_jitter = 0
+        if max_memory < 0:
+            self._exceptions.append(('max_worker_memory', "Max worker memory cant be negative, workers memory wont be checked."))
+            self.max_worker_memory = 0
+
+
+    def verify_load_shedding(self, latency: float, retry_after: int):
+        if latency < 0:
+            self._exceptions.append(('max_queue_latency', "Max queue latency cant be negative, requests wont be shed."))
+            self.max_queue_latency = 0
+        if retry_after < 0:
+            self._exceptions.append(('retry_after', "Retry-After cant be negative, using 1 second."))
+            self.retry_after = 1
+
+
     def verify_app(self, path: str):
+        if isinstance(path, str):
+            self.app_uri = path
         try:
             self.app = find_application(path)
         except Exception as e:
@@ -112,8 +561,18 @@ class Config:
     def verify_bind_addresses(self, bind_to: list[str]):
         _bind = []
         for addr in bind_to:
+            if addr.startswith('unix:'):
+                if not addr[5:]:
+                    self._exceptions.append(('bind', f'Unix socket address {addr} has no path'))
+                    continue
+                _bind.append(addr[5:])
+                continue
             try:
-                host, port = addr.split(':')
+                host, port = addr.rsplit(':', 1)
+                if host.startswith('[') and host.endswith(']'):
+                    host = host[1:-1]
+                elif ':' in host:
+                    raise ValueError('IPv6 addresses go in brackets')
                 _bind.append((host, int(port)))
             except ValueError:
                 self._exceptions.append(('bind', f'Couldnt resolve the address {addr}')) 
@@ -126,7 +585,51 @@ class Config:
         parser.add_argument('app', type=str)
         parser.add_argument('--bind', type=str, default=['127.0.0.1:8000'], nargs='+')
         parser.add_argument('--workertype', type=str, default='sync')
-        parser.add_argument('--avoid_keepalive', action='store_false')
+        parser.add_argument('--avoid_keepalive', action='store_true')
+        parser.add_argument('--keepalive_timeout', type=float, default=2)
+        parser.add_argument('--header_timeout', type=float, default=10)
+        parser.add_argument('--body_timeout', type=float, default=60)
+        parser.add_argument('--write_timeout', type=float, default=60)
+        parser.add_argument('--max_keepalive_requests', type=int, default=100)
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--worker_connections', type=int, default=1000)
+        parser.add_argument('--write_batch_size', type=int, default=65536)
+        parser.add_argument('--workers', type=int, default=1)
+        parser.add_argument('--reuse_port', action='store_true')
+        parser.add_argument('--tcp_nodelay', action='store_true')
+        parser.add_argument('--tcp_quickack', action='store_true')
+        parser.add_argument('--tcp_defer_accept', type=int, default=0)
+        parser.add_argument('--tcp_fastopen', type=int, default=0)
+        parser.add_argument('--socket_rcvbuf', type=int, default=0)
+        parser.add_argument('--socket_sndbuf', type=int, default=0)
+        parser.add_argument('--accept_batch', type=int, default=16)
+        parser.add_argument('--graceful_timeout', type=int, default=30)
+        parser.add_argument('--preload', action='store_true')
+        parser.add_argument('--max_requests', type=int, default=0)
+        parser.add_argument('--max_requests_jitter', type=int, default=0)
+        parser.add_argument('--max_worker_memory', type=int, default=0)
+        parser.add_argument('--tracemalloc_dir', type=str, default=None)
+        parser.add_argument('--gc_threshold', type=int, default=[], nargs='+')
+        parser.add_argument('--static', type=str, default=[], nargs='+')
+        parser.add_argument('--static_cache_size', type=int, default=256)
+        parser.add_argument('--cache_ttl', type=float, default=0)
+        parser.add_argument('--cache_size', type=int, default=64 * 1024 * 1024)
+        parser.add_argument('--cache_vary', type=str, default=[], nargs='+')
+        parser.add_argument('--cache_routes', type=str, default=[], nargs='+')
+        parser.add_argument('--cache_coalesce', type=float, default=0)
+        parser.add_argument('--compression', action='store_true')
+        parser.add_argument('--compression_level', type=int, default=6)
+        parser.add_argument('--compression_min_size', type=int, default=1024)
+        parser.add_argument('--compression_types', type=str, default=list(DEFAULT_TYPES), nargs='+')
+        parser.add_argument('--stats_bind', type=str, default=None)
+        parser.add_argument('--max_body_size', type=int, default=0)
+        parser.add_argument('--body_spool_size', type=int, default=1024 * 1024)
+        parser.add_argument('--max_queue_latency', type=float, default=0)
+        parser.add_argument('--retry_after', type=int, default=1)
+        parser.add_argument('--access_log', type=str, default=None)
+        parser.add_argument('--access_log_format', type=str, default=DEFAULT_FORMAT)
+        parser.add_argument('--access_log_queue_size', type=int, default=10000)
+        parser.add_argument('--access_log_sample', type=float, default=1.0)
         parser.add_argument('--logging_level', type=str, choices=['critical', 'error', 'warning', 'info', 'debug'], default='info')
 
         args = parser.parse_args()
@@ -8,6 +8,19 @@ class ClientDisconnect(ClientException):
     pass
 
 
+class ClientTimeout(ClientDisconnect, TimeoutError):
+    pass
+
+
+def client_error(error: OSError) -> ClientDisconnect:
+    """
+    An error of the client socket as our own exception, apps use sockets too and their errors must not be taken for the client's.
+    """
+    if isinstance(error, TimeoutError):
+        return ClientTimeout(str(error))
+    return ClientDisconnect(str(error))
+
+
 class InvalidAppReturnType(ApplicationException):
     def __init__(self):
         super().__init__("Application must return an iterable of bytestrings (b'')")
@@ -18,6 +31,11 @@ class IncorrectWriteArgument(ApplicationException):
         super().__init__("Bytes must be passed into write()")
 
 
+class ApplicationStartupFailed(ApplicationException):
+    def __init__(self, message: str):
+        super().__init__(f"Application startup failed: {message}")
+
+
 class FatalConfigException(Exception):
     def __init__(self, message: str):
         super().__init__(f"Server couldnt start because some config options werent resolved: {message}")
\ No newline at end of file
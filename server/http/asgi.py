@@ -0,0 +1,336 @@
+import asyncio
+import time
+import inspect
+import typing
+import logging
+from http import HTTPStatus
+from urllib.parse import unquote
+from .handlers import Request, Response, LAST_CHUNK
+from .wrappers import ChunkedBodyWrapper, HEX_RE, CONTINUE
+from .compression import CompressionPolicy
+from ..timers import Deadline
+from .errors import *
+from ..errors import *
+
+
+
+
+def is_asgi_app(app: typing.Callable) -> bool:
+    # ASGI 3 apps are coroutine functions (or objects with a coroutine __call__) taking (scope, receive, send)
+    if inspect.iscoroutinefunction(app):
+        return True
+    call = getattr(app, '__call__', None)
+    return inspect.iscoroutinefunction(call)
+
+
+
+def reason_phrase(status: int) -> str:
+    try:
+        return HTTPStatus(status).phrase
+    except ValueError:
+        return 'Unknown'
+
+
+
+class ASGICycle:
+    """
+    A single http request/response cycle of an ASGI 3 application.
+
+    The request body is pulled from the stream lazily through `receive`,
+    `send` validates the messages and writes them to the transport. With a `deadline` the body
+    has to arrive within `body_timeout` of the first read and the response has to be taken within
+    `write_timeout` of its first write, or without it every write within `client_timeout`.
+    """
+    __slots__ = ('request', 'response', 'reader', 'writer', 'body_left', 'chunks', 'continue_pending',
+                 'response_started', 'response_complete', 'more_body', 'disconnected', 'logger',
+                 'deadline', 'body_timeout', 'client_timeout', 'body_started')
+
+    def __init__(self, request: Request, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 compression: CompressionPolicy = None, max_body_size: int = 0, deadline: Deadline = None,
+                 body_timeout: float = 0, write_timeout: float = 0, client_timeout: float = 0):
+        self.request = request
+        self.response = Response(None, request, compression=compression, write_timeout=write_timeout)
+        self.reader = reader
+        self.writer = writer
+        self.body_left: int = request.content_len
+        self.chunks: AsyncChunkedReader = AsyncChunkedReader(reader, max_body_size) if request.chunked else None
+        self.continue_pending: bool = request.expect_continue and bool(request.content_len or request.chunked)
+        self.response_started: bool = False
+        self.response_complete: asyncio.Event = asyncio.Event()
+        self.more_body: bool = True
+        self.disconnected: bool = False
+        self.logger = logging.getLogger(__name__)
+        self.deadline = deadline
+        self.body_timeout = body_timeout
+        self.client_timeout = client_timeout
+        self.body_started: bool = False
+
+
+    def build_scope(self, server: tuple[str, int], client: tuple[str, int], state: dict) -> dict:
+        req = self.request
+        raw_path, _, query_string = bytes(req.path).partition(b'?')
+
+        return {
+            'type': 'http',
+            'asgi': {'version': '3.0', 'spec_version': '2.3'},
+            'http_version': req.version.decode()[5:],
+            'method': req.method.decode(),
+            'scheme': 'http',
+            'path': unquote(raw_path.decode('latin-1')),
+            'raw_path': raw_path,
+            'query_string': query_string,
+            'root_path': '',
+            'headers': [(name.lower().encode('latin-1'), value.strip().encode('latin-1')) for name, value in req.headers],
+            # unix sockets have no peer address, ipv6 ones carry flow info and scope id we dont pass on
+            'client': client[:2] if isinstance(client, tuple) else None,
+            'server': server[:2] if isinstance(server, tuple) else (server, None),
+            'state': state.copy(),
+        }
+
+
+    async def receive(self) -> dict:
+        if self.more_body and not self.disconnected:
+            try:
+                data = await self.read_body()
+            except ClientDisconnect:
+                self.disconnected = True
+                return {'type': 'http.disconnect'}
+            self.more_body = self.body_pending()
+            return {'type': 'http.request', 'body': data, 'more_body': self.more_body}
+
+        # nothing left to read, the only thing that can happen now is the cycle ending
+        await self.response_complete.wait()
+        return {'type': 'http.disconnect'}
+
+
+    async def read_body(self) -> bytes:
+        if self.deadline is not None and not self.body_started:
+            self.body_started = True
+            self.deadline.start('body', self.body_timeout)
+        data = await self.read_chunk()
+        if self.deadline is not None and not self.body_pending():
+            self.deadline.stop()
+        return data
+
+
+    async def read_chunk(self) -> bytes:
+        if self.continue_pending:
+            # the client waits for this before sending the body, only ask once the app wants it
+            self.continue_pending = False
+            self.writer.write(CONTINUE)
+        if self.chunks is not None:
+            return await self.chunks.read()
+        if self.body_left == 0:
+            return b''
+        data = await self.reader.read(min(self.body_left, 65536))
+        if not data:
+            raise ClientDisconnect
+        self.body_left -= len(data)
+        return data
+
+
+    def body_pending(self) -> bool:
+        if self.chunks is not None:
+            return not self.chunks.done
+        return self.body_left > 0
+
+
+    async def send(self, message: dict):
+        msg_type = message['type']
+
+        if self.disconnected:
+            raise ClientDisconnect
+
+        if msg_type == 'http.response.start':
+            if self.response_started:
+                raise AssertionError("Response had already been started")
+            self.response_started = True
+            if self.continue_pending:
+                # too late for 100 Continue, the client may or may not send the body now
+                self.continue_pending = False
+                self.request.keepalive = 0
+
+            status = message['status']
+            headers = [(name.decode('latin-1'), value.decode('latin-1')) for name, value in message.get('headers', [])]
+            self.response.status = f"{status} {reason_phrase(status)}"
+            self.response.process_headers(headers)
+
+        elif msg_type == 'http.response.body':
+            if not self.response_started:
+                raise AssertionError("http.response.start must be sent before the body")
+            if self.response_complete.is_set():
+                return
+
+            response = self.response
+            body = message.get('body', b'')
+            if response.response_length is not None:
+                body = body[:max(response.response_length - response.sent, 0)]
+
+            more_body = message.get('more_body', False)
+
+            buffers = []
+            if not response.headers_sent:
+                buffers.append(response.serialize_headers())
+                response.headers_sent = True
+            response.sent += len(body)
+            if self.request.method != b"HEAD":
+                body = response.encode_body(body, sync=more_body)
+                if not more_body:
+                    body += response.encode_tail()
+                buffers.extend(response.frame(body))
+                if response.chunked and not more_body:
+                    buffers.append(LAST_CHUNK)
+            # headers and the first body part leave in one write
+            self.writer.writelines(buffers)
+            response.written += sum(map(len, buffers))
+
+            started = time.perf_counter()
+            if self.deadline is not None:
+                write_deadline = response.write_deadline()
+                if write_deadline is not None:
+                    self.deadline.start_by('write', write_deadline)
+                else:
+                    self.deadline.start('write', self.client_timeout)
+            try:
+                await self.writer.drain()
+            except ConnectionError:
+                self.disconnected = True
+                raise ClientDisconnect
+            if self.deadline is not None:
+                self.deadline.stop()
+            if self.writer.transport.is_closing():
+                # an aborted transport wakes the drain up without an error
+                self.disconnected = True
+                raise ClientDisconnect
+            response.send_time += time.perf_counter() - started
+
+            if not more_body:
+                response.complete = True
+                self.response_complete.set()
+        else:
+            raise ApplicationException(f"Unexpected ASGI message type {msg_type!r}")
+
+
+    async def discard_body(self):
+        while self.body_pending():
+            await self.read_body()
+
+
+
+class AsyncChunkedReader:
+    """
+    Decodes a chunked request body from an asyncio stream, the async twin of `ChunkedBodyWrapper`.
+    """
+    __slots__ = ('reader', 'left', 'started', 'done', 'max_size', 'total')
+
+    def __init__(self, reader: asyncio.StreamReader, max_size: int = 0):
+        self.reader = reader
+        self.left: int = 0 # what is left of the current chunk
+        self.started: bool = False
+        self.done: bool = False
+        self.max_size: int = max_size
+        self.total: int = 0
+
+
+    async def read(self, size: int = 65536) -> bytes:
+        """
+        Return the next piece of the body, an empty bytestring once it ended.
+        """
+        if self.left == 0:
+            if self.done:
+                return b''
+            if self.started and await self.read_line() != b'':
+                # chunk data has to be followed by CRLF
+                raise InvalidChunkedEncoding(b"missing CRLF after chunk data")
+            self.started = True
+
+            line = await self.read_line()
+            chunk_size = line.split(b";", 1)[0].strip(b" \t")
+            if not HEX_RE.fullmatch(chunk_size):
+                raise InvalidChunkedEncoding(line)
+
+            self.left = int(chunk_size, 16)
+            self.total += self.left
+            if self.max_size and self.total > self.max_size:
+                raise BodyTooLarge(self.max_size)
+            if self.left == 0:
+                # skip the trailer section, we dont pass trailers to the app
+                while await self.read_line() != b'':
+                    pass
+                self.done = True
+                return b''
+
+        data = await self.reader.read(min(self.left, size))
+        if not data:
+            raise ClientDisconnect
+        self.left -= len(data)
+        return data
+
+
+    async def read_line(self) -> bytes:
+        try:
+            line = await self.reader.readuntil(b"\r\n")
+        except asyncio.IncompleteReadError:
+            raise ClientDisconnect
+        except asyncio.LimitOverrunError:
+            raise InvalidChunkedEncoding(b"chunk line too long")
+        if len(line) > ChunkedBodyWrapper.MAX_CHUNK_LINE:
+            raise InvalidChunkedEncoding(b"chunk line too long")
+        return line[:-2]
+
+
+
+class LifespanManager:
+    """
+    Runs the `lifespan` scope of an ASGI app, apps that dont support it are tolerated.
+    """
+    def __init__(self, app: typing.Callable):
+        self.app = app
+        self.receive_queue: asyncio.Queue = asyncio.Queue()
+        self.startup_done: asyncio.Event = asyncio.Event()
+        self.shutdown_done: asyncio.Event = asyncio.Event()
+        self.task: asyncio.Task = None
+        self.supported: bool = True
+        self.failed: str = None # message of a `lifespan.startup.failed`
+        self.state: dict = {} # copied into every http scope
+        self.logger = logging.getLogger(__name__)
+
+
+    async def startup(self):
+        self.task = asyncio.get_running_loop().create_task(self.main())
+        await self.receive_queue.put({'type': 'lifespan.startup'})
+        await self.startup_done.wait()
+
+
+    async def shutdown(self):
+        if not self.supported or self.task.done():
+            return
+        await self.receive_queue.put({'type': 'lifespan.shutdown'})
+        await self.shutdown_done.wait()
+
+
+    async def main(self):
+        scope = {'type': 'lifespan', 'asgi': {'version': '3.0', 'spec_version': '2.0'}, 'state': self.state}
+        try:
+            await self.app(scope, self.receive_queue.get, self.send)
+        except Exception:
+            self.supported = False
+            self.logger.debug("Application doesnt support the lifespan protocol")
+        finally:
+            self.startup_done.set()
+            self.shutdown_done.set()
+
+
+    async def send(self, message: dict):
+        msg_type = message['type']
+        if msg_type == 'lifespan.startup.failed':
+            self.failed = message.get('message', '')
+            self.logger.error("Application startup failed: %s", self.failed)
+        elif msg_type == 'lifespan.shutdown.failed':
+            self.logger.error("Application shutdown failed: %s", message.get('message', ''))
+
+        if msg_type.startswith('lifespan.startup'):
+            self.startup_done.set()
+        elif msg_type.startswith('lifespan.shutdown'):
+            self.shutdown_done.set()
+
@@ -0,0 +1,193 @@
+import time
+import threading
+import typing
+from concurrent import futures
+from collections import OrderedDict
+from .headers import encode_header, encode_status, SERVER_HEADER
+
+if typing.TYPE_CHECKING:
+    from .handlers import Request, Response
+
+
+
+
+# statuses that are cacheable by default, RFC 9110 15.1
+CACHEABLE_STATUSES = frozenset(('200', '203', '204', '300', '301', '404', '405', '410', '414', '501'))
+
+# describe a single connection or message, never stored
+HOP_HEADERS = frozenset(('date', 'connection', 'keep-alive', 'transfer-encoding', 'content-length'))
+
+
+
+class CachedResponse:
+    """
+    A response serialized once: status line and headers up to (not including) the per-request
+    ones, and the body. `Date` and `Connection` are added on every hit.
+    """
+    __slots__ = ('status', 'head', 'body', 'expires', 'size')
+
+    def __init__(self, status: str, head: bytes, body: bytes, expires: float):
+        self.status = status
+        self.head = head
+        self.body = body
+        self.expires = expires
+        self.size: int = len(head) + len(body)
+
+
+
+class ResponseCache:
+    """
+    Micro-cache for identical GET (and HEAD) requests.
+
+    Entries are keyed on the path with the query string and the values of the `vary` request
+    headers, and kept for `ttl` seconds unless a route prefix in `routes` or the response's
+    `Cache-Control: max-age` says otherwise. The cache holds at most `max_size` bytes, least
+    recently used entries go first. Responses with cookies, `no-store`/`private`/`no-cache`,
+    a `Vary` we dont key on, or a body larger than `max_entry_size` are never stored.
+
+    With `coalesce` a miss becomes a flight: the first request runs the app, identical ones
+    arriving meanwhile wait up to `coalesce` seconds for the entry it lands.
+    """
+    def __init__(self, ttl: int | float, max_size: int, vary: list[str] = (), routes: list[tuple[str, int | float]] = (),
+                 coalesce: int | float = 0):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_entry_size: int = max(max_size // 16, 1)
+        self.vary: tuple[str, ...] = tuple(name.lower() for name in vary)
+        # the longest prefix wins
+        self.routes: list[tuple[bytes, int | float]] = sorted(
+            [(prefix.encode('latin-1'), route_ttl) for prefix, route_ttl in routes],
+            key=lambda route: len(route[0]), reverse=True)
+        self.entries: OrderedDict[tuple, CachedResponse] = OrderedDict()
+        self.size: int = 0
+        self.coalesce = coalesce
+        self.flights: dict[tuple, futures.Future] = {} # keys some request is running the app for
+        self.lock = threading.Lock()
+
+
+    def key(self, request: "Request") -> tuple | None:
+        """
+        Cache key of the request, None if it must not be answered from or stored in the cache.
+        """
+        if request.method not in (b"GET", b"HEAD") or request.content_len or request.chunked:
+            return None
+        if self.route_ttl(request.path) <= 0:
+            return None
+
+        cache_control = request.get_header('cache-control')
+        if cache_control is not None and 'no-store' in cache_control.lower():
+            return None
+        if request.get_header('authorization') is not None:
+            return None
+        return (bytes(request.path),) + tuple(request.get_header(name) for name in self.vary)
+
+
+    def route_ttl(self, path: bytes) -> int | float:
+        for prefix, ttl in self.routes:
+            if path.startswith(prefix):
+                return ttl
+        return self.ttl
+
+
+    def get(self, key: tuple, request: "Request") -> CachedResponse | None:
+        cache_control = request.get_header('cache-control')
+        if cache_control is not None and 'no-cache' in cache_control.lower():
+            # the client wants a fresh answer, which may still refresh the entry
+            return None
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires <= time.monotonic():
+                self.remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+
+    def join(self, key: tuple) -> tuple[futures.Future, bool]:
+        """
+        The flight of `key` and whether the caller leads it. The leader runs the app and has
+        to `land` the flight, the others wait on it for the resulting entry (None if there is none).
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self.flights[key] = futures.Future()
+            return flight, True
+
+
+    def land(self, key: tuple, flight: futures.Future, entry: CachedResponse | None):
+        with self.lock:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+        if not flight.done():
+            flight.set_result(entry)
+
+
+    def store(self, key: tuple, response: "Response") -> CachedResponse | None:
+        """
+        Keep a complete response whose body was captured while it was sent, returns the entry if it was kept.
+        """
+        body = response.captured()
+        if body is None or response.request.method != b"GET" or response.status[:3] not in CACHEABLE_STATUSES:
+            return None
+
+        ttl = self.route_ttl(key[0])
+        parts = [encode_status(response.status)]
+        has_server = False
+        for name, value in response.headers:
+            line, lname = encode_header(name, value)
+            if lname in HOP_HEADERS:
+                continue
+            if lname == 'set-cookie':
+                return None
+            if lname == 'cache-control':
+                ttl = self.response_ttl(value.lower(), ttl)
+                if ttl <= 0:
+                    return None
+            elif lname == 'vary':
+                varies = [field.strip().lower() for field in value.split(',')]
+                if any(field not in self.vary for field in varies):
+                    return None
+            elif lname == 'server':
+                has_server = True
+            parts.append(line)
+
+        if not has_server:
+            parts.append(SERVER_HEADER)
+        if response.has_body():
+            parts.append(b"Content-Length: %d\r\n" % len(body))
+
+        entry = CachedResponse(response.status, b"".join(parts), body, time.monotonic() + ttl)
+        with self.lock:
+            self.remove(key)
+            self.entries[key] = entry
+            self.size += entry.size
+            while self.size > self.max_size:
+                self.remove(next(iter(self.entries)))
+        return entry
+
+
+    def response_ttl(self, cache_control: str, ttl: int | float) -> int | float:
+        directives = {}
+        for directive in cache_control.split(','):
+            name, _, value = directive.strip().partition('=')
+            directives[name] = value.strip('"')
+
+        if 'no-store' in directives or 'private' in directives or 'no-cache' in directives:
+            return 0
+        # a shared cache prefers s-maxage, the route ttl still caps it
+        for name in ('s-maxage', 'max-age'):
+            if directives.get(name, '').isdigit():
+                return min(int(directives[name]), ttl)
+        return ttl
+
+
+    def remove(self, key: tuple):
+        # called under the lock
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
@@ -0,0 +1,141 @@
+import os
+import zlib
+import threading
+import functools
+from collections import OrderedDict
+
+
+
+
+DEFAULT_TYPES = (
+    'text/html', 'text/plain', 'text/css', 'text/xml', 'text/javascript', 'text/csv',
+    'application/javascript', 'application/json', 'application/xml', 'image/svg+xml',
+)
+
+# zlib window bits of every content-coding we produce, "deflate" is the zlib format (RFC 9110 8.4.1.2)
+WBITS = {'gzip': 31, 'deflate': 15}
+
+
+
+@functools.lru_cache(maxsize=256)
+def choose_encoding(accept_encoding: str) -> str | None:
+    """
+    The coding we answer with for an `Accept-Encoding` value, gzip wins ties.
+    """
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        q = 1.0
+        name, _, value = params.strip().partition('=')
+        if name.strip() == 'q':
+            try:
+                q = float(value)
+            except ValueError:
+                q = 0.0
+        qualities[coding.strip().lower()] = q
+
+    wildcard = qualities.get('*', 0.0)
+    best, best_q = None, 0.0
+    for coding in ('gzip', 'deflate'):
+        q = qualities.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+
+class Compressor:
+    """
+    Streaming compressor for one response body.
+    """
+    __slots__ = ('compressobj',)
+
+    def __init__(self, encoding: str, level: int):
+        self.compressobj = zlib.compressobj(level, zlib.DEFLATED, WBITS[encoding])
+
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressobj.compress(data)
+
+
+    def sync(self) -> bytes:
+        # everything compressed so far becomes decodable, for bodies that are streamed on purpose
+        return self.compressobj.flush(zlib.Z_SYNC_FLUSH)
+
+
+    def flush(self) -> bytes:
+        return self.compressobj.flush()
+
+
+
+class CompressedFiles:
+    """
+    Compressed variants of static files, keyed on the inode, mtime and size of the file, so
+    each version of a file is compressed once per worker. Holds at most `max_size` bytes.
+    """
+    def __init__(self, max_size: int = 32 * 1024 * 1024):
+        self.max_size = max_size
+        self.max_file_size: int = max_size // 8
+        self.variants: OrderedDict[tuple, bytes] = OrderedDict()
+        self.size: int = 0
+        self.lock = threading.Lock()
+
+
+    def get(self, file, inode: tuple[int, int, int], size: int, encoding: str, level: int) -> bytes | None:
+        key = (inode, encoding)
+        with self.lock:
+            data = self.variants.get(key)
+            if data is not None:
+                self.variants.move_to_end(key)
+                return data
+
+        if size > self.max_file_size:
+            return None
+        # pread, the file object may be sent from by other threads at the same time
+        raw = os.pread(file.fileno(), size, 0)
+        if len(raw) != size:
+            return None # changed under us, the next stat will notice
+        compressor = Compressor(encoding, level)
+        data = compressor.compress(raw) + compressor.flush()
+
+        with self.lock:
+            if key not in self.variants:
+                self.variants[key] = data
+                self.size += len(data)
+            while self.size > self.max_size:
+                _, old = self.variants.popitem(last=False)
+                self.size -= len(old)
+        return data
+
+
+
+class CompressionPolicy:
+    """
+    Decides which responses get compressed and with what.
+
+    Bodies of a `types` content type and at least `min_size` bytes (if their size is known
+    up front) are compressed at `level` with the coding the client prefers.
+    """
+    def __init__(self, level: int = 6, min_size: int = 1024, types: list[str] = DEFAULT_TYPES):
+        self.level = level
+        self.min_size = min_size
+        self.types: frozenset[str] = frozenset(t.lower() for t in types if not t.endswith('/*'))
+        self.type_prefixes: tuple[str, ...] = tuple(t[:-1].lower() for t in types if t.endswith('/*'))
+        self.files: CompressedFiles = CompressedFiles()
+
+
+    def compressible(self, content_type: str | None) -> bool:
+        if not content_type:
+            return False
+        mime = content_type.split(';', 1)[0].strip().lower()
+        return mime in self.types or (bool(self.type_prefixes) and mime.startswith(self.type_prefixes))
+
+
+    def choose(self, accept_encoding: str | None) -> str | None:
+        if not accept_encoding:
+            return None
+        return choose_encoding(accept_encoding)
+
+
+    def compressor(self, encoding: str) -> Compressor:
+        return Compressor(encoding, self.level)
@@ -22,4 +22,22 @@ class HeaderOverflow(RequestBuildingError):
         
 class RequestLineOverflow(RequestBuildingError):
     def __init__(self, size: int):
-        super().__init__(f"Request line size limit exceeded ({size})")
\ No newline at end of file
+        super().__init__(f"Request line size limit exceeded ({size})")
+        
+        
+class InvalidChunkedEncoding(RequestBuildingError):
+    def __init__(self, line: bytes):
+        self.line = line
+        super().__init__(f"Invalid chunked body framing {line}")
+
+
+class UnsupportedTransferEncoding(RequestBuildingError):
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        super().__init__(f"Unsupported transfer encoding {encoding}")
+
+
+class BodyTooLarge(RequestBuildingError):
+    def __init__(self, limit: int):
+        self.limit = limit
+        super().__init__(f"Request body size limit exceeded ({limit})")
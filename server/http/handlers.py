@@ -9,47 +9,195 @@ import re
 import mmap
 import os
 import logging
-from ..sock import SocketReader
-from .wrappers import FileWrapper, BodyWrapper
+import time
+import select
+from concurrent import futures
+from urllib.parse import unquote_to_bytes
+from ..sock import SocketReader, corked
+from .wrappers import FileWrapper, BodyWrapper, ChunkedBodyWrapper, SpooledBody
+from .parser import RequestParser
+from .static import StaticResult
+from .cache import CachedResponse
+from .compression import CompressionPolicy, Compressor
+from .headers import encode_header, encode_status, cgi_name, decode_token, date_header, SERVER_HEADER, CONNECTION_CLOSE, TRANSFER_ENCODING_CHUNKED
 
 
 
 
-# thanks gunicorn
-RFC9110_5_6_2_TOKEN_SPECIALS = r"!#$%&'*+-.^_`|~"
-TOKEN_RE = re.compile(r"[%s0-9a-zA-Z]+" % (re.escape(RFC9110_5_6_2_TOKEN_SPECIALS)))
 
-HEADER_VALUE_RE = re.compile(r'[ \t\x21-\x7e\x80-\xff]*')
 
+LAST_CHUNK = b"0\r\n\r\n"
+BAD_REQUEST = b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+INTERNAL_ERROR = b"HTTP/1.1 500 Internal Server Error\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+HEADERS_TOO_LARGE = b"HTTP/1.1 431 Request Header Fields Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+PAYLOAD_TOO_LARGE = b"HTTP/1.1 413 Content Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+SERVICE_UNAVAILABLE = b"HTTP/1.1 503 Service Unavailable\r\nRetry-After: %d\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
 
-class Response:
-    __slots__ = ('sock', 'response_length', 'status', 'headers_sent',
-                 'headers', 'sent', 'body', 'logger', 'request')
 
-    def __init__(self, sock: socket.socket, request: "Request"):
+
+def environ_template(multithread: bool = False, multiprocess: bool = False) -> dict:
+    """
+    The keys of the environ that are the same for every request of a worker,
+    built once and copied for each request by `Response.build_environ`.
+    """
+    return {
+        'SCRIPT_NAME': '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': multithread,
+        'wsgi.multiprocess': multiprocess,
+        'wsgi.run_once': False,
+        'wsgi.file_wrapper': FileWrapper,
+    }
+
+
+
+class Response:
+    __slots__ = ('sock', 'response_length', 'status', 'headers_sent', 'headers', 'sent', 'body',
+                 'logger', 'request', 'pending', 'pending_size', 'write_batch_size',
+                 'chunked', 'chunk_parts', 'chunk_size', 'complete', 'cache_key', 'capture', 'capture_size',
+                 'capture_limit', 'flight', 'compression', 'compressor', 'written', 'send_time',
+                 'write_timeout', 'deadline', 'built')
+
+    # sendmsg takes at most IOV_MAX buffers per call
+    MAX_IOVECS = 1024
+    # most a single sendfile call under a write deadline is asked to send
+    SENDFILE_SLICE = 256 * 1024
+
+    def __init__(self, sock: socket.socket, request: "Request", write_batch_size: int = 65536, compression: CompressionPolicy = None,
+                 write_timeout: float = 0):
         self.sock: socket.socket = sock
         self.response_length: int = None
         self.status: str = None
         self.headers_sent: bool = False
         self.headers: list[tuple[str, str]] = []
         self.sent: int = 0
-        self.body: bytearray = None
+        self.body: BodyWrapper = None
         self.logger = logging.getLogger(__name__)
         self.request: "Request" = request
+        self.pending: list[bytes | memoryview] = [] # buffers waiting for the next sendmsg
+        self.pending_size: int = 0
+        self.write_batch_size: int = write_batch_size
+        self.chunked: bool = False # body of unknown length sent with chunked transfer-encoding
+        self.chunk_parts: list[bytes | memoryview] = [] # payloads that go out as the next chunk
+        self.chunk_size: int = 0
+        self.complete: bool = False
+        self.cache_key: tuple = None # set when the response should end up in the response cache
+        self.capture: list[bytes] = None # body bytes as the app produced them, for the cache
+        self.capture_size: int = 0
+        self.capture_limit: int = 0
+        self.flight: futures.Future = None # the cache flight this response leads, landed once it is stored
+        self.compression: CompressionPolicy = compression # cleared once the coding is decided
+        self.compressor: Compressor = None
+        self.written: int = 0 # bytes handed to the kernel, headers and framing included
+        self.send_time: float = 0 # seconds spent in sendmsg and sendfile
+        self.write_timeout: float = write_timeout # total time to send the response, 0 is no limit
+        self.deadline: float | None = None # time.monotonic() the response has to be out by
+        self.built: float = None # time.perf_counter() the environ or scope was ready, where the worker doesnt keep it itself
+
+
+    def serialize_headers(self) -> bytes:
+        if self.compression is not None:
+            self.negotiate_encoding(self.response_length)
+        if self.response_length is None:
+            if self.request.version == b"HTTP/1.1" and self.request.method != b"HEAD" and self.has_body():
+                self.chunked = True
+            else:
+                # without a length the only way to end the body is to close the connection
+                self.request.keepalive = 0
+        if self.body is not None and self.body.continue_pending:
+            # too late for 100 Continue, the client may or may not send the body now
+            self.body.continue_pending = False
+            self.request.keepalive = 0
+
+        parts = [encode_status(self.status)]
+        has_date = has_server = False
+        for name, val in self.headers:
+            line, lname = encode_header(name, val)
+            parts.append(line)
+            if lname == 'date':
+                has_date = True
+            elif lname == 'server':
+                has_server = True
+
+        if not has_date:
+            parts.append(date_header.get())
+        if not has_server:
+            parts.append(SERVER_HEADER)
+        if self.chunked:
+            parts.append(TRANSFER_ENCODING_CHUNKED)
+        if not self.request.keepalive:
+            parts.append(CONNECTION_CLOSE)
+        parts.append(b"\r\n")
+        return b"".join(parts)
+
+
+    def negotiate_encoding(self, size: int | None) -> bool:
+        """
+        Decide if the body gets compressed, before the headers go out. Compressed bodies
+        have no length we know in advance, their Content-Length is dropped.
+        """
+        policy, self.compression = self.compression, None
+        if self.request.method == b"HEAD" or not self.has_body() or self.status[:3] == '206':
+            return False
+        if size is not None and size < policy.min_size:
+            return False
 
+        content_type = vary = None
+        for name, value in self.headers:
+            lname = name.lower()
+            if lname == 'content-type':
+                content_type = value
+            elif lname == 'content-encoding':
+                return False
+            elif lname == 'cache-control' and 'no-transform' in value.lower():
+                return False
+            elif lname == 'vary':
+                vary = value
+        if not policy.compressible(content_type):
+            return False
 
-    def send_headers(self):
-        # prepare response
+        encoding = policy.choose(self.request.get_header('accept-encoding'))
+        if encoding is None:
+            return False
+
+        self.compressor = policy.compressor(encoding)
+        self.headers = [(name, value) for name, value in self.headers if name.lower() not in ('content-length', 'vary')]
+        self.headers.append(('Content-Encoding', encoding))
+        self.headers.append(('Vary', f"{vary}, Accept-Encoding" if vary else 'Accept-Encoding'))
+        self.response_length = None
+        return True
+
+
+    def encode_body(self, data: bytes, sync: bool = False) -> bytes:
+        # for writers that dont go through queue()
+        if self.compressor is None or not data:
+            return data
+        data = self.compressor.compress(data)
+        return data + self.compressor.sync() if sync else data
+
+
+    def encode_tail(self) -> bytes:
+        if self.compressor is None:
+            return b''
+        tail, self.compressor = self.compressor.flush(), None
+        return tail
+
+
+    def queue_headers(self):
         if self.headers_sent:
             return
-        
-        response = f"HTTP/1.1 {self.status}\r\n" + "\r\n".join([f"{name}: {val}" for name, val in self.headers]) + "\r\n\r\n"
-        response = response.encode()
-
-        self.sock.sendall(response)
+        self.pending.append(self.serialize_headers())
+        self.pending_size += len(self.pending[-1])
         self.headers_sent = True
 
 
+    def send_headers(self):
+        self.queue_headers()
+        self.flush()
+
+
     def start_response(self, status: str, response_headers: list[tuple[str, str]], exc_info = None) -> typing.Callable:
         if exc_info:
             try:
@@ -61,31 +209,179 @@ class Response:
             raise AssertionError("Response had already been started")
         
         self.status = status
+        self.headers = []
+        self.response_length = None
         self.process_headers(response_headers)
         return self.write
 
 
     def write(self, data: bytes):
-        self.send_headers()
+        # legacy write() and streamed chunks cant be held back, they go out together with anything queued
+        self.queue(data)
+        if self.compressor is not None:
+            self.queue_body(self.compressor.sync())
+        self.flush()
+
+
+    def queue(self, data: bytes):
+        self.queue_headers()
 
-        if not isinstance(data, bytes):
+        if not isinstance(data, (bytes, bytearray)):
             try:
                 data = data.encode()
             except AttributeError:
                 raise IncorrectWriteArgument
         
-        response = memoryview(data)
-        to_send = response.nbytes
-        
-        if self.response_length:
-            if self.response_length <= self.sent:
+        to_send = len(data)
+        if self.response_length is not None:
+            to_send = min(self.response_length - self.sent, to_send)
+            if to_send <= 0:
                 return
-            to_send = min(self.response_length-self.sent, to_send)
-            response = response[:to_send]
+            if to_send < len(data):
+                data = memoryview(data)[:to_send]
+
+        self.sent += to_send
+        if self.request.method == b"HEAD" or to_send == 0:
+            return
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        self.queue_body(data)
+
+
+    def queue_body(self, data: bytes | memoryview):
+        # data as it goes on the wire, only chunk framing is left to add
+        size = len(data)
+        if not size:
+            return
+        if self.capture is not None:
+            self.capture_data(data)
+
+        if self.chunked:
+            self.chunk_parts.append(data)
+            self.chunk_size += size
+        else:
+            self.pending.append(data)
+        self.pending_size += size
+        if self.pending_size >= self.write_batch_size:
+            self.flush()
+
+
+    def frame(self, data: bytes) -> list[bytes]:
+        # for writers that dont go through queue()
+        if not self.chunked or not data:
+            return [data] if data else []
+        return [b"%x\r\n" % len(data), data, b"\r\n"]
+
+
+    def frame_chunk(self):
+        # everything queued since the last flush becomes one chunk, small writes dont cost a frame each
+        if not self.chunk_size:
+            return
+        self.pending.append(b"%x\r\n" % self.chunk_size)
+        self.pending.extend(self.chunk_parts)
+        self.pending.append(b"\r\n")
+        self.chunk_parts.clear()
+        self.chunk_size = 0
+
+
+    def flush(self):
+        # send everything queued with as few sendmsg calls as possible, the kernel may take less than we gave it
+        self.frame_chunk()
+        pending = self.pending
+        if not pending:
+            return
+        started = time.perf_counter()
+        try:
+            while pending:
+                sent = self.send_within(self.sock.sendmsg, pending[:self.MAX_IOVECS])
+                self.written += sent
+                done = 0
+                for buf in pending:
+                    if sent < len(buf):
+                        break
+                    sent -= len(buf)
+                    done += 1
+                del pending[:done]
+                if sent:
+                    pending[0] = memoryview(pending[0])[sent:]
+        except OSError as e:
+            raise client_error(e) from e
+        self.pending_size = 0
+        self.send_time += time.perf_counter() - started
+
+
+    def start_capture(self, key: tuple, limit: int, flight: futures.Future = None):
+        self.cache_key = key
+        self.capture = []
+        self.capture_limit = limit
+        self.flight = flight
+
+
+    def capture_data(self, data: bytes | memoryview):
+        self.capture_size += len(data)
+        if self.capture_size > self.capture_limit:
+            # too big to be worth caching, stop copying
+            self.capture = None
+            return
+        self.capture.append(bytes(data))
 
-        self.sent += response.nbytes
-        self.sock.sendall(response)
-        response.release()
+
+    def captured(self) -> bytes | None:
+        """
+        The whole body if it was captured and fully sent.
+        """
+        if self.capture is None or not self.complete:
+            return None
+        return b"".join(self.capture)
+
+
+    def cached_buffers(self, entry: CachedResponse) -> list[bytes]:
+        self.status = entry.status
+        self.response_length = self.sent = len(entry.body)
+        self.headers_sent = self.complete = True
+
+        buffers = [entry.head, date_header.get()]
+        if not self.request.keepalive:
+            buffers.append(CONNECTION_CLOSE)
+        buffers.append(b"\r\n")
+        if entry.body and self.request.method != b"HEAD":
+            buffers.append(entry.body)
+        return buffers
+
+
+    def write_cached(self, entry: CachedResponse):
+        # a hit goes out in one sendmsg, the app isnt involved
+        self.pending.extend(self.cached_buffers(entry))
+        self.flush()
+
+
+    def compress_list(self, app_result: typing.Iterable) -> typing.Iterable:
+        # a complete body is compressed in one go and keeps its Content-Length
+        if self.compression is None or self.headers_sent or not isinstance(app_result, (list, tuple)):
+            return app_result
+        if not all(isinstance(chunk, (bytes, bytearray)) for chunk in app_result):
+            return app_result
+        if not self.negotiate_encoding(sum(map(len, app_result))):
+            return app_result
+        body = self.compressor.compress(b"".join(app_result)) + self.encode_tail()
+        return [body]
+
+
+    def set_length(self, app_result: typing.Iterable):
+        # a list of bytestrings has a known size, so we can frame it ourselves and keep the connection
+        if self.response_length is not None or self.headers_sent or not isinstance(app_result, (list, tuple)):
+            return
+        if not self.has_body():
+            # these never have a body and must not announce one
+            self.response_length = 0
+            return
+        length = 0
+        for chunk in app_result:
+            if not isinstance(chunk, (bytes, bytearray)):
+                return
+            length += len(chunk)
+        self.response_length = length
+        self.headers.append(('Content-Length', str(length)))
 
 
     def write_file(self, file_wrapper: FileWrapper):
@@ -102,16 +398,108 @@ class Response:
         except (OSError, io.UnsupportedOperation):
             return False
         
+        self.compression = None # sendfile sends the file as it is
         self.send_headers()
+        self.capture = None # the file never passes through us
 
-        if self.response_length > 0:
-            self.sock.sendfile(file_wrapper.filelike, offset, self.response_length)
+        if self.response_length > 0 and self.request.method != b"HEAD":
+            self.sendfile(file_wrapper.filelike, offset, self.response_length)
 
         os.lseek(fileno, offset, os.SEEK_SET)
 
         return True
 
 
+    def sendfile(self, file: typing.BinaryIO, offset: int, length: int):
+        started = time.perf_counter()
+        try:
+            if self.write_deadline() is not None:
+                sent = self.sendfile_within(file, offset, length)
+            else:
+                sent = self.sock.sendfile(file, offset, length)
+        except OSError as e:
+            raise client_error(e) from e
+        self.sent += sent
+        self.written += sent
+        self.send_time += time.perf_counter() - started
+
+
+    def sendfile_within(self, file: typing.BinaryIO, offset: int, length: int) -> int:
+        # socket.sendfile gives every wait the whole socket timeout again, here all of them share the deadline
+        sock_fd, file_fd = self.sock.fileno(), file.fileno()
+        timeout = self.sock.gettimeout()
+        poller = select.poll()
+        poller.register(sock_fd, select.POLLOUT)
+        sent = 0
+        while sent < length:
+            remaining = self.deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("Deadline of the response passed")
+            if not poller.poll((remaining if timeout is None else min(remaining, timeout)) * 1000):
+                raise TimeoutError("Client didnt take the response in time")
+            try:
+                part = os.sendfile(sock_fd, file_fd, offset + sent, min(length - sent, self.SENDFILE_SLICE))
+            except BlockingIOError:
+                continue
+            if part == 0:
+                break
+            sent += part
+        return sent
+
+
+    def write_deadline(self) -> float | None:
+        """
+        When the whole response has to be out, None without a `write_timeout`. The clock starts with the first send.
+        """
+        if self.write_timeout and self.deadline is None:
+            self.deadline = time.monotonic() + self.write_timeout
+        return self.deadline
+
+
+    def send_within(self, send: typing.Callable, *args) -> int:
+        # like SocketReader.recv_into, the socket timeout is only shortened for the last sends before the deadline
+        deadline = self.write_deadline()
+        if deadline is None:
+            return send(*args)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("Deadline of the response passed")
+        timeout = self.sock.gettimeout()
+        if timeout is not None and remaining >= timeout:
+            return send(*args)
+        self.sock.settimeout(remaining)
+        try:
+            return send(*args)
+        finally:
+            self.sock.settimeout(timeout)
+
+
+    def prepare_static(self, result: StaticResult):
+        self.compression = None # the static files decided on the coding themselves
+        self.status = result.status
+        self.headers = result.headers
+        self.response_length = result.length
+
+
+    def write_static(self, result: StaticResult):
+        self.prepare_static(result)
+        self.queue_headers()
+
+        if self.request.method == b"HEAD" or not result.length:
+            self.flush()
+            self.sent = result.length
+        elif result.body is not None:
+            # a compressed variant from memory
+            self.queue_body(result.body)
+            self.flush()
+            self.sent = result.length
+        else:
+            with corked(self.sock):
+                self.flush()
+                self.sendfile(result.entry.file, result.offset, result.length)
+        self.complete = True
+
+
     def handle_app(self, app: typing.Callable, environ: dict):
         app_result = app(environ, self.start_response)
 
@@ -119,65 +507,98 @@ class Response:
             if not self.write_file(app_result):
                 for chunk in app_result: self.write(chunk)
 
+        elif isinstance(app_result, (list, tuple)):
+            # the whole body is already there, batch it with the headers
+            body = self.compress_list(app_result)
+            self.set_length(body)
+            for chunk in body:
+                self.queue(chunk)
+
         else:
             for chunk in app_result:
                 self.write(chunk)
+
+        self.finish()
                 
         # some wsgi apps close their resources, return to make it possible
         return app_result
+
+
+    def finish(self):
+        # empty bodies still need their headers
+        self.queue_headers()
+        if self.compressor is not None:
+            self.queue_body(self.encode_tail())
+        if self.chunked:
+            self.frame_chunk()
+            self.pending.append(LAST_CHUNK)
+        self.flush()
+        self.complete = True
+
+
+    def has_body(self) -> bool:
+        return not (self.status[:3] in ('204', '304') or self.status[0] == '1')
     
 
+    def should_keepalive(self) -> bool:
+        # the connection can only be reused if the client allows it and the body was framed and fully sent
+        if not self.request.keepalive:
+            return False
+        if self.chunked:
+            return self.complete
+        if self.response_length is None:
+            return False
+        return self.sent >= self.response_length
+
+
     def process_headers(self, headers: list[tuple[str, str]]):
         for token, val in headers:
-            if type(token) != str or not TOKEN_RE.fullmatch(token):
-                raise IncorrectHeadersFormat(token)
-            
-            if type(val) != str or not HEADER_VALUE_RE.fullmatch(val):
-                raise IncorrectHeadersFormat(val)
-            
-            ltoken = token.lower()
+            # validated once per distinct header, serialize_headers hits the same cache
+            _, ltoken = encode_header(token, val)
             if ltoken == 'content-length':
                 self.response_length = int(val)
 
             self.headers.append((token, val))
-        
-        if not self.request.keepalive:
-            self.headers.append(('Connection', 'close'))    
 
 
-    def build_environ(self) -> dict:
+    def build_environ(self, template: dict = None, max_body_size: int = 0,
+                      body: typing.BinaryIO = None, body_timeout: float = 0, spool_size: int = 0) -> dict:
+        """
+        The environ starts as a copy of `template`, see `environ_template`.
+        `body` replaces the wrappers reading from the request reader as `wsgi.input`,
+        those get `body_timeout` to receive the whole body once the app starts reading.
+        Bodies that may be larger than `spool_size` are received into a temporary file first.
+        """
         req = self.request
-        split_path = (req.path.decode()).split('?')
-
-        if len(split_path) != 2:
-            path, query_string = split_path[0], ''
-        else:
-            path, query_string = split_path
-
-        environ = {
-            'REQUEST_METHOD': req.method.decode(),
-            'PATH_INFO': path,
-            'SERVER_PROTOCOL': req.version.decode(),
-            'QUERY_STRING': query_string,
-            'wsgi.version': (1, 0),
-            'wsgi.url_scheme': 'http',
-            'wsgi.input': BodyWrapper(self.request.reader, self.request.content_len),
-            'wsgi.errors': sys.stderr,
-            'wsgi.multithread': False,
-            'wsgi.multiprocess': False,
-            'wsgi.run_once': False,
-            'wsgi.file_wrapper': FileWrapper
-        }
-        # write headers to environ
-        for header_pair in req.headers:
-            name, value = header_pair
-            name = name.replace('-', '_')
-
-            if name == 'Content_Type' or name == 'Content_Length':
-                environ[name.upper()] = value.strip()
+        environ = (template or environ_template()).copy()
+
+        path, _, query_string = req.path.partition(b'?')
+        # PEP 3333 wants PATH_INFO unquoted and as latin-1, the app decodes it as utf-8 if it likes
+        if b'%' in path:
+            path = unquote_to_bytes(path)
+        environ['PATH_INFO'] = path.decode('latin-1')
+        environ['QUERY_STRING'] = query_string.decode('latin-1')
+        environ['REQUEST_METHOD'] = decode_token(req.method)
+        environ['SERVER_PROTOCOL'] = decode_token(req.version)
+
+        if body is None:
+            if req.chunked:
+                body = ChunkedBodyWrapper(req.reader, max_body_size, req.expect_continue, body_timeout)
+            else:
+                body = BodyWrapper(req.reader, req.content_len, req.expect_continue, body_timeout)
+            if spool_size and (req.chunked or req.content_len > spool_size):
+                body = SpooledBody(expect_continue=body.continue_pending, source=body, spool_size=spool_size)
+        self.body = body
+        environ['wsgi.input'] = body
+
+        # the parser already stripped the values
+        for name, value in req.headers:
+            key = cgi_name(name)
+            if key in environ and key != 'CONTENT_LENGTH':
+                # repeated headers are folded into one as a proxy would, cookies have their own separator
+                environ[key] += ('; ' if key == 'HTTP_COOKIE' else ',') + value
             else:
-                name = 'HTTP_' + name
-                environ[name] = value.strip()
+                environ[key] = value
 
         return environ
 
@@ -185,15 +606,15 @@ class Response:
 
 
 class Request:
-    __slots__ = ('bufsize', 'content_len', 'headers', 'method',
-                  'path', 'version', 'keepalive', 'logger', 'reader')
+    __slots__ = ('content_len', 'chunked', 'headers', 'method',
+                  'path', 'version', 'keepalive', 'logger', 'reader', 'first_byte_at', 'expect_continue')
     
     MAX_REQUEST_LINE = 8192
     MAX_HEADER_SIZE = 32768
 
     def __init__(self, reader: SocketReader):
-        self.bufsize: int = 8192
         self.content_len: int = 0
+        self.chunked: bool = False
         self.headers: list[tuple[str, str]] = []
         self.method: bytes = None
         self.path: bytes = None
@@ -201,69 +622,31 @@ class Request:
         self.keepalive: int = 1
         self.logger: logging.Logger = logging.getLogger(__name__)
         self.reader: "SocketReader" = reader
+        self.first_byte_at: float = None
+        self.expect_continue: bool = False # only honored for HTTP/1.1
         
 
     def build_request(self):
-        # begin reading request line and headers
-        buf = bytearray()
-        self.read_into(buf)
-
-        headers_start = self.parse_request_line(buf)
-        
-        headers_end = buf.find(b"\r\n\r\n")
-        while headers_end == -1:
-            self.read_into(buf)
-            headers_end = buf.find(b"\r\n\r\n")
-            if headers_end != -1:
-                break
-
-        self.parse_headers(buf, headers_start, headers_end)
-        self.reader.put_back(buf, start=headers_end+4)
+        parser = RequestParser(self)
+        reader = self.reader
 
-    
-    def parse_headers(self, buf: bytearray, headers_start: int, headers_end: int) -> int:
-        try:
-            raw_headers = buf[headers_start:headers_end]
-            
-            if len(raw_headers) > self.MAX_HEADER_SIZE:
-                raise HeaderOverflow(self.MAX_HEADER_SIZE)
-            
-            raw_headers = raw_headers.split(b"\r\n")
-            for pair in raw_headers:
-                k, v = (pair.decode()).split(": ", 1)
-
-                if k == 'Content-Length':
-                    self.content_len = int(v)
-                elif k == 'Connection':
-                    if v == 'close':
-                        self.keepalive = 0
-
-                self.headers.append((k, v))
-
-        except ValueError:
-            raise IncorrectHeadersFormat(raw_headers)
-        
-        
-    def parse_request_line(self, data: bytearray) -> int:
-        idx = data.find(b"\r\n")
-        try:
-            req_line = data[:idx]
-            
-            if len(req_line) > self.MAX_REQUEST_LINE:
-                raise RequestLineOverflow(self.MAX_REQUEST_LINE)
-            
-            self.method, self.path, self.version = req_line.split(b" ", 2)
-            return idx+2
-        except ValueError:
-            raise MalformedRequestLineError(req_line)
-        
-        
-    def read_into(self, buf: bytearray, amount: int = -1):
-        data = self.reader.read(amount)
-        if len(data) == 0:
+        # parse in place from the reader buffer, only the head is consumed,
+        # whatever follows belongs to the body or to the next pipelined request
+        if not len(reader) and not reader.fill():
             raise ClientDisconnect
-        buf.extend(data)
-    
-    
-    def notify(self):
-        self.logger.info("%s %s", self.method.decode(), self.path.decode())
\ No newline at end of file
+        self.first_byte_at = time.perf_counter()
+        while not parser.parse(reader.buf, reader.start, reader.end):
+            if not reader.fill():
+                raise ClientDisconnect
+
+        reader.consume(parser.head_length)
+
+
+    def get_header(self, lname: str) -> str | None:
+        """
+        First value of a header, `lname` has to be lowercase.
+        """
+        for name, value in self.headers:
+            if name.lower() == lname:
+                return value
+        return None
\ No newline at end of file
@@ -0,0 +1,91 @@
+import re
+import sys
+import time
+import functools
+from email.utils import formatdate
+from .errors import IncorrectHeadersFormat
+
+
+
+
+# thanks gunicorn
+RFC9110_5_6_2_TOKEN_SPECIALS = r"!#$%&'*+-.^_`|~"
+TOKEN_RE = re.compile(r"[%s0-9a-zA-Z]+" % (re.escape(RFC9110_5_6_2_TOKEN_SPECIALS)))
+
+HEADER_VALUE_RE = re.compile(r'[ \t\x21-\x7e\x80-\xff]*')
+
+SERVER_HEADER = b"Server: Deouserver\r\n"
+CONNECTION_CLOSE = b"Connection: close\r\n"
+TRANSFER_ENCODING_CHUNKED = b"Transfer-Encoding: chunked\r\n"
+
+
+# apps send the same handful of headers over and over, validating and encoding
+# each of them once per worker is enough. lru_cache is thread safe, so the threaded
+# and asyncio workers can share it too.
+@functools.lru_cache(maxsize=2048)
+def _encode_header(name: str, value: str) -> tuple[bytes, str]:
+    if type(name) != str or not TOKEN_RE.fullmatch(name):
+        raise IncorrectHeadersFormat(name)
+    if type(value) != str or not HEADER_VALUE_RE.fullmatch(value):
+        raise IncorrectHeadersFormat(value)
+    return f"{name}: {value}\r\n".encode('latin-1'), name.lower()
+
+
+def encode_header(name: str, value: str) -> tuple[bytes, str]:
+    """
+    Validate a header and return its encoded line together with the lowercased name.
+    """
+    try:
+        return _encode_header(name, value)
+    except TypeError:
+        # unhashable garbage instead of strings
+        raise IncorrectHeadersFormat(f"{name!r}: {value!r}")
+
+
+@functools.lru_cache(maxsize=128)
+def encode_status(status: str) -> bytes:
+    return f"HTTP/1.1 {status}\r\n".encode('latin-1')
+
+
+# clients send the same request header names over and over as well, the environ key
+# of each is built once and interned, so environ lookups compare by identity
+@functools.lru_cache(maxsize=1024)
+def cgi_name(name: str) -> str:
+    """
+    The environ key of a request header, `User-Agent` -> `HTTP_USER_AGENT`.
+    """
+    key = name.upper().replace('-', '_')
+    if key != 'CONTENT_TYPE' and key != 'CONTENT_LENGTH':
+        key = 'HTTP_' + key
+    return sys.intern(key)
+
+
+@functools.lru_cache(maxsize=64)
+def decode_token(token: bytes) -> str:
+    # request methods and protocol versions, a handful of distinct values
+    return sys.intern(token.decode('latin-1'))
+
+
+
+class DateHeader:
+    """
+    Pre-encoded `Date` header, formatted at most once a second.
+    """
+    __slots__ = ('cached',)
+
+    def __init__(self):
+        self.cached: tuple[int, bytes] = (0, b"")
+
+
+    def get(self) -> bytes:
+        now = int(time.time())
+        second, value = self.cached
+        if now != second:
+            value = f"Date: {formatdate(now, usegmt=True)}\r\n".encode('latin-1')
+            # one assignment, concurrent readers see either the old or the new pair
+            self.cached = (now, value)
+        return value
+
+
+
+date_header = DateHeader()
@@ -0,0 +1,181 @@
+import re
+import typing
+from .errors import *
+
+if typing.TYPE_CHECKING:
+    from .handlers import Request
+
+
+
+
+TOKEN_BYTES_RE = re.compile(rb"[!#$%&'*+\-.^_`|~0-9a-zA-Z]+")
+OWS = b" \t"
+
+# parser states
+REQUEST_LINE = 0
+HEADERS = 1
+DONE = 2
+
+
+
+class RequestParser:
+    """
+    Resumable parser for the request line and headers.
+
+    The head is parsed in place from the window `buf[base:end]`, normally the unread part
+    of the `SocketReader` buffer, and every call continues from a scan offset relative to
+    `base`, so every byte is looked at once no matter how the head was split between recvs
+    and no matter if the reader moved its data in between. Limits are enforced on incomplete
+    lines too, a client cant make us buffer more than `MAX_REQUEST_LINE` + `MAX_HEADER_SIZE`
+    bytes of head.
+
+    Parsed values are written straight into the `Request` passed in.
+    """
+    __slots__ = ('request', 'buf', 'base', 'pos', 'scan', 'state', 'headers_start', 'content_length', 'max_request_line', 'max_header_size')
+
+    def __init__(self, request: "Request"):
+        self.request = request
+        self.buf: bytearray = None
+        self.base: int = 0
+        self.pos: int = 0 # start of the line being parsed, relative to base
+        self.scan: int = 0 # where to continue looking for the end of that line
+        self.state: int = REQUEST_LINE
+        self.headers_start: int = 0
+        self.content_length: int = None # None until a Content-Length header was seen
+        self.max_request_line: int = request.MAX_REQUEST_LINE
+        self.max_header_size: int = request.MAX_HEADER_SIZE
+
+
+    @property
+    def done(self) -> bool:
+        return self.state == DONE
+
+
+    @property
+    def head_length(self) -> int:
+        return self.pos
+
+
+    def feed(self, data: bytes | bytearray) -> bool:
+        """
+        Parse from a buffer of our own, for callers that dont have a reader buffer to parse in.
+        """
+        if self.buf is None:
+            self.buf = bytearray(data)
+        else:
+            self.buf += data
+        return self.parse(self.buf, 0, len(self.buf))
+
+
+    def parse(self, buf: bytearray, base: int, end: int) -> bool:
+        """
+        Continue parsing the head in `buf[base:end]`, returns True once it is complete.
+        The head then takes the first `head_length` bytes of the window.
+        """
+        self.buf, self.base = buf, base
+        while self.state != DONE:
+            eol = buf.find(b"\r\n", base + self.scan, end)
+            if eol == -1:
+                # a trailing CR may be the first half of the line ending
+                self.scan = max(self.pos, end - base - 1)
+                self.check_limits(end - base)
+                return False
+
+            eol -= base
+            self.check_limits(eol)
+            if self.state == REQUEST_LINE:
+                if eol > self.pos:
+                    self.parse_request_line(base + self.pos, base + eol)
+                    self.state = HEADERS
+                    self.headers_start = eol + 2
+                # empty lines before the request line are ignored (RFC 9112 2.2)
+            elif eol == self.pos:
+                self.finish()
+            else:
+                self.parse_header(base + self.pos, base + eol)
+
+            self.pos = self.scan = eol + 2
+
+        return True
+
+
+    def check_limits(self, end: int):
+        if self.state == REQUEST_LINE:
+            if end - self.pos > self.max_request_line:
+                raise RequestLineOverflow(self.max_request_line)
+        elif end - self.headers_start > self.max_header_size:
+            raise HeaderOverflow(self.max_header_size)
+
+
+    def parse_request_line(self, start: int, end: int):
+        line = bytes(self.buf[start:end])
+        parts = line.split(b" ")
+        if len(parts) != 3:
+            raise MalformedRequestLineError(line)
+
+        method, path, version = parts
+        if not TOKEN_BYTES_RE.fullmatch(method) or not path or not version.startswith(b"HTTP/1."):
+            raise MalformedRequestLineError(line)
+
+        req = self.request
+        req.method, req.path, req.version = method, path, version
+
+
+    def parse_header(self, start: int, end: int):
+        buf = self.buf
+        colon = buf.find(b":", start, end)
+        if colon <= start:
+            raise IncorrectHeadersFormat(bytes(buf[start:end]))
+
+        with memoryview(buf) as view:
+            name = view[start:colon]
+            # no whitespace is allowed between the name and the colon, obs-fold lines start with it
+            if not TOKEN_BYTES_RE.fullmatch(name):
+                raise IncorrectHeadersFormat(bytes(buf[start:end]))
+
+            vstart, vend = colon + 1, end
+            while vstart < vend and buf[vstart] in OWS:
+                vstart += 1
+            while vend > vstart and buf[vend - 1] in OWS:
+                vend -= 1
+
+            name = str(name, 'latin-1')
+            value = str(view[vstart:vend], 'latin-1')
+
+        req = self.request
+        lname = name.lower()
+        if lname == 'content-length':
+            if not (value.isascii() and value.isdigit()):
+                raise IncorrectHeadersFormat(f"{name}: {value}")
+            length = int(value)
+            # repeats are only fine when they all agree, Content-Length: 0 included
+            if self.content_length is not None and self.content_length != length:
+                raise IncorrectHeadersFormat(f"{name}: {value}")
+            self.content_length = req.content_len = length
+        elif lname == 'connection':
+            if 'close' in value.lower():
+                req.keepalive = 0
+        elif lname == 'transfer-encoding':
+            # chunked has to be the final coding, we dont decode anything else
+            if value.lower() != 'chunked' or req.chunked:
+                raise UnsupportedTransferEncoding(value)
+            req.chunked = True
+        elif lname == 'expect':
+            if value.lower() == '100-continue':
+                req.expect_continue = True
+
+        req.headers.append((name, value))
+
+
+    def finish(self):
+        self.state = DONE
+        req = self.request
+        if req.chunked:
+            # a length next to chunked framing is a smuggling attempt or a broken proxy, trust neither again
+            if self.content_length is not None:
+                req.content_len = 0
+                req.keepalive = 0
+        # HTTP/1.0 connections are closed unless the client asks otherwise, we dont answer with keep-alive there
+        if self.request.version != b"HTTP/1.1":
+            self.request.keepalive = 0
+            self.request.expect_continue = False
@@ -0,0 +1,277 @@
+import os
+import stat
+import time
+import threading
+import mimetypes
+import typing
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import unquote
+from .compression import CompressionPolicy
+
+if typing.TYPE_CHECKING:
+    from .handlers import Request
+
+
+
+
+class StaticEntry:
+    """
+    An open file together with everything about it that doesnt change until the file does.
+    """
+    __slots__ = ('path', 'file', 'size', 'mtime', 'inode', 'etag', 'last_modified', 'content_type',
+                 'encoding', 'headers', 'checked', 'refs', 'evicted')
+
+    def __init__(self, path: str, file: typing.BinaryIO, st: os.stat_result):
+        self.path = path
+        self.file = file
+        self.size: int = st.st_size
+        self.mtime: int = int(st.st_mtime)
+        self.inode: tuple[int, int, int] = (st.st_ino, st.st_mtime_ns, st.st_size)
+        self.etag: str = f'"{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}"'
+        self.last_modified: str = formatdate(st.st_mtime, usegmt=True)
+        self.checked: float = time.monotonic()
+        self.refs: int = 0 # requests currently sending from the file
+        self.evicted: bool = False
+
+        content_type, encoding = mimetypes.guess_type(path)
+        self.content_type: str = content_type or 'application/octet-stream'
+        self.encoding: str | None = encoding
+        self.headers: list[tuple[str, str]] = [
+            ('Content-Type', self.content_type),
+            ('Last-Modified', self.last_modified),
+            ('ETag', self.etag),
+            ('Accept-Ranges', 'bytes'),
+        ]
+        if encoding:
+            self.headers.append(('Content-Encoding', encoding))
+
+
+
+class StaticResult:
+    """
+    What to answer a static request with, independent of how the worker writes it.
+    """
+    __slots__ = ('status', 'headers', 'entry', 'offset', 'length', 'body')
+
+    def __init__(self, status: str, headers: list[tuple[str, str]], entry: StaticEntry, offset: int = 0, length: int = 0, body: bytes = None):
+        self.status = status
+        self.headers = headers
+        self.entry = entry
+        self.offset = offset
+        self.length = length
+        self.body = body # compressed variant, sent instead of the file
+
+
+
+class StaticFiles:
+    """
+    Serves files under the configured mounts straight from the worker.
+
+    Open files and their stat results are kept in an LRU cache of `max_open` entries and
+    only stat'ed again after `recheck` seconds, ETag/Last-Modified are computed once per
+    file version. Conditional and single range requests are answered here too, files
+    that dont exist fall through to the application. With a `compression` policy, compressible
+    files are sent as compressed variants built once per file version.
+    """
+    def __init__(self, mounts: list[tuple[str, str]], max_open: int = 256, recheck: float = 1.0, compression: CompressionPolicy = None):
+        # the longest prefix wins
+        self.mounts: list[tuple[bytes, str]] = sorted(
+            [(prefix.rstrip('/').encode('latin-1') + b'/', os.path.abspath(root)) for prefix, root in mounts],
+            key=lambda mount: len(mount[0]), reverse=True)
+        self.max_open = max_open
+        self.recheck = recheck
+        self.compression = compression
+        self.cache: OrderedDict[str, StaticEntry] = OrderedDict()
+        self.lock = threading.Lock()
+
+
+    def resolve(self, request: "Request") -> StaticResult | None:
+        if request.method not in (b"GET", b"HEAD"):
+            return None
+
+        path = request.path.split(b"?", 1)[0]
+        for prefix, root in self.mounts:
+            if path.startswith(prefix):
+                break
+        else:
+            return None
+
+        fs_path = self.translate(path[len(prefix):], root)
+        if fs_path is None:
+            return None
+
+        entry = self.lookup(fs_path)
+        if entry is None:
+            return None
+        return self.negotiate(request, entry)
+
+
+    def translate(self, path: bytes, root: str) -> str | None:
+        rel = unquote(path.decode('latin-1'))
+        parts = rel.split('/')
+        # never step out of the mount, symlinks inside it are followed
+        if '\0' in rel or '..' in parts or (parts and parts[0] == ''):
+            return None
+        return os.path.join(root, *parts)
+
+
+    def lookup(self, fs_path: str) -> StaticEntry | None:
+        with self.lock:
+            entry = self.cache.get(fs_path)
+            if entry is not None:
+                self.cache.move_to_end(fs_path)
+                if time.monotonic() - entry.checked < self.recheck:
+                    entry.refs += 1
+                    return entry
+
+        try:
+            st = os.stat(fs_path)
+        except OSError:
+            self.evict(fs_path)
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+
+        if entry is not None and entry.inode == (st.st_ino, st.st_mtime_ns, st.st_size):
+            with self.lock:
+                # another thread may have evicted and closed it while we were stat'ing
+                if not entry.evicted:
+                    entry.checked = time.monotonic()
+                    entry.refs += 1
+                    return entry
+
+        # new file, or it changed since we opened it
+        try:
+            file = open(fs_path, 'rb', buffering=0)
+            st = os.fstat(file.fileno())
+        except OSError:
+            return None
+        entry = StaticEntry(fs_path, file, st)
+        entry.refs += 1
+
+        with self.lock:
+            old = self.cache.pop(fs_path, None)
+            if old is not None:
+                self.drop(old)
+            self.cache[fs_path] = entry
+            while len(self.cache) > self.max_open:
+                _, oldest = self.cache.popitem(last=False)
+                self.drop(oldest)
+        return entry
+
+
+    def evict(self, fs_path: str):
+        with self.lock:
+            entry = self.cache.pop(fs_path, None)
+            if entry is not None:
+                self.drop(entry)
+
+
+    def drop(self, entry: StaticEntry):
+        # called under the lock, files still being sent are closed by the last release()
+        entry.evicted = True
+        if entry.refs == 0:
+            entry.file.close()
+
+
+    def release(self, result: StaticResult):
+        entry = result.entry
+        with self.lock:
+            entry.refs -= 1
+            if entry.evicted and entry.refs == 0:
+                entry.file.close()
+
+
+    def negotiate(self, request: "Request", entry: StaticEntry) -> StaticResult:
+        byte_range = request.get_header('range')
+        varies = (self.compression is not None and entry.encoding is None
+                  and self.compression.compressible(entry.content_type))
+        encoding = body = None
+        if varies and byte_range is None and entry.size >= self.compression.min_size:
+            encoding = self.compression.choose(request.get_header('accept-encoding'))
+            if encoding is not None:
+                body = self.compression.files.get(entry.file, entry.inode, entry.size, encoding, self.compression.level)
+                if body is None:
+                    encoding = None
+
+        # every coding is its own representation with its own validator
+        etag = entry.etag if encoding is None else f'{entry.etag[:-1]}-{encoding}"'
+        if self.not_modified(request, entry, etag):
+            headers = [('Last-Modified', entry.last_modified), ('ETag', etag)]
+            if varies:
+                headers.append(('Vary', 'Accept-Encoding'))
+            return StaticResult('304 Not Modified', headers, entry)
+
+        if encoding is not None:
+            headers = [('Content-Type', entry.content_type), ('Last-Modified', entry.last_modified), ('ETag', etag),
+                       ('Content-Encoding', encoding), ('Vary', 'Accept-Encoding'), ('Content-Length', str(len(body)))]
+            return StaticResult('200 OK', headers, entry, 0, len(body), body)
+
+        size = entry.size
+        vary = [('Vary', 'Accept-Encoding')] if varies else []
+        if byte_range is not None and self.range_applies(request, entry):
+            bounds = self.parse_range(byte_range, size)
+            if bounds == (-1, -1):
+                headers = [('Content-Range', f'bytes */{size}'), ('Content-Length', '0')]
+                return StaticResult('416 Range Not Satisfiable', headers, entry)
+            if bounds is not None:
+                start, end = bounds
+                headers = entry.headers + vary + [('Content-Range', f'bytes {start}-{end}/{size}'),
+                                           ('Content-Length', str(end - start + 1))]
+                return StaticResult('206 Partial Content', headers, entry, start, end - start + 1)
+
+        return StaticResult('200 OK', entry.headers + vary + [('Content-Length', str(size))], entry, 0, size)
+
+
+    def not_modified(self, request: "Request", entry: StaticEntry, etag: str) -> bool:
+        if_none_match = request.get_header('if-none-match')
+        if if_none_match is not None:
+            # weak comparison, as RFC 9110 asks for If-None-Match
+            tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+            return '*' in tags or etag in tags
+
+        if_modified_since = request.get_header('if-modified-since')
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return entry.mtime <= since
+        return False
+
+
+    def range_applies(self, request: "Request", entry: StaticEntry) -> bool:
+        if_range = request.get_header('if-range')
+        if if_range is None:
+            return True
+        return if_range == entry.etag or if_range == entry.last_modified
+
+
+    def parse_range(self, header: str, size: int) -> tuple[int, int] | None:
+        """
+        Returns inclusive bounds, (-1, -1) if the range cant be satisfied and None if it should be
+        ignored. Multiple ranges are ignored too, the whole file is smaller than a multipart body.
+        """
+        unit, _, spec = header.partition('=')
+        if unit.strip().lower() != 'bytes' or ',' in spec:
+            return None
+
+        first, sep, last = spec.strip().partition('-')
+        first, last = first.strip(), last.strip()
+        if not sep or (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+
+        if not first:
+            if not last:
+                return None
+            suffix = int(last)
+            if suffix == 0 or size == 0:
+                return (-1, -1)
+            return (max(size - suffix, 0), size - 1)
+
+        start = int(first)
+        end = int(last) if last else size - 1
+        if start >= size or end < start:
+            return (-1, -1)
+        return (start, min(end, size - 1))
@@ -1,10 +1,19 @@
 import typing
+import tempfile
+import time
+import re
 from ..sock import SocketReader
-from ..errors import ClientDisconnect
+from ..errors import ClientDisconnect, client_error
+from .errors import InvalidChunkedEncoding, BodyTooLarge
 
 
 
 
+HEX_RE = re.compile(rb"[0-9a-fA-F]+")
+CONTINUE = b"HTTP/1.1 100 Continue\r\n\r\n"
+
+
+
 class FileWrapper:
     def __init__(self, filelike: typing.BinaryIO, chunksize: int = 8192):
         if not hasattr(filelike, 'read'):
@@ -24,74 +33,312 @@ class FileWrapper:
         data = self.filelike.read(self.chunk)
         if not data:
             raise StopIteration
+        return data
         
         
         
 class BodyWrapper:
-    __slots__ = ('reader', 'content_len')
+    """
+    `wsgi.input` for bodies framed by Content-Length, `content_len` is what is left to read.
+
+    A client that sent `Expect: 100-continue` holds the body back until it gets the interim
+    response, that is only sent once the app actually reads. From the first read on the whole
+    body has to arrive within `timeout`.
+    """
+    __slots__ = ('reader', 'content_len', 'continue_pending', 'timeout')
+
+    # the buffer handed out grows by at most this much ahead of what was received
+    READ_STEP = 65536
     
-    def __init__(self, reader: SocketReader, content_len: int = None):
+    def __init__(self, reader: SocketReader, content_len: int = None, expect_continue: bool = False, timeout: float = 0):
         self.reader = reader
         self.content_len = content_len
+        self.continue_pending: bool = expect_continue and bool(content_len)
+        self.timeout: float = timeout # cleared once the deadline is set
         
         
     def read(self, length: int = -1) -> bytearray:
+        if length is None:
+            length = -1
         if length < -1:
             raise TypeError("Length arg cant be less than -1")
-        elif length == 0:
+        
+        if length == -1 or length > self.content_len:
+            length = self.content_len
+        if length == 0:
             return bytearray()
+        if self.timeout:
+            self.start_deadline()
+        if self.continue_pending:
+            self.send_continue()
         
+        # the body is received straight into the buffer we hand out, which only grows as the body
+        # arrives, an announced length alone never makes us allocate it
         buf = bytearray()
-        
-        if length == -1:
-            recv_limit = self.content_len
-        else:
-            recv_limit = min(self.content_len, length)
-        
-        self._read_into(buf, recv_limit)
-        self.content_len -= len(buf)
+        while len(buf) < length:
+            start = len(buf)
+            buf += bytes(min(length - start, self.READ_STEP))
+            with memoryview(buf)[start:] as view:
+                received = self.reader.readinto(view)
+            self.content_len -= received
+            if received < len(buf) - start:
+                raise ClientDisconnect
         return buf
         
     
-    def readline(self, size=None) -> bytes:
-        buf = bytearray()
-        recv_limit = min(self.content_len, 8192)
-        while b"\n" not in buf:
-            self._read_into(buf, recv_limit)
+    def readline(self, size: int = None) -> bytes:
+        limit = -1 if size is None or size < 0 else size
+        reader = self.reader
+        if self.timeout:
+            self.start_deadline()
+        if self.continue_pending:
+            self.send_continue()
+        line = bytearray()
+        scanned = 0 # buffered bytes already known to hold no newline
         
-        self.content_len -= len(buf)
-        
-        idx = buf.find(b"\n")
-        if idx == -1:
-            return bytes(buf)
+        while limit == -1 or len(line) < limit:
+            available = self._available()
+            if available == 0:
+                break
+            if limit != -1:
+                available = min(available, limit - len(line))
+            
+            buffered = min(len(reader), available)
+            idx = reader.find(b"\n", scanned, buffered)
+            if idx != -1:
+                self._take(line, idx + 1)
+                break
+            
+            if buffered and (buffered == available or buffered == len(reader.buf)):
+                # the rest of what we may read is here, or the buffer is full, move it out of the way
+                self._take(line, buffered)
+                scanned = 0
+                continue
+            
+            scanned = buffered
+            if not reader.fill():
+                raise ClientDisconnect
         
-        self.reader.put_back(buf, start=idx+1)
-        return bytes(buf[:idx+1])
+        return bytes(line)
     
     
-    def readlines(self, sizehint=None) -> list[bytes]:
-        if sizehint < -1:
+    def readlines(self, sizehint: int = None) -> list[bytes]:
+        if sizehint is not None and sizehint < -1:
             raise TypeError("Sizehint arg cannot be less than -1")
-        if sizehint == 0:
-            return [b'']
         
-        if sizehint == -1:
-            recv_limit = self.content_len
-        else:
-            recv_limit = min(self.content_len, sizehint)
+        lines = []
+        total = 0
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            lines.append(line)
+            total += len(line)
+            if sizehint and sizehint > 0 and total >= sizehint:
+                break
+        return lines
+    
+    
+    def __iter__(self):
+        return self
+    
+    
+    def __next__(self) -> bytes:
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+    
+    
+    def discard(self):
+        # drop whatever the app didnt read so the next request on the connection starts at its request line
+        if self.timeout:
+            self.start_deadline()
+        while True:
+            available = self._available()
+            if available == 0:
+                return
+            data = self.reader.read(min(available, 65536))
+            if data.nbytes == 0:
+                raise ClientDisconnect
+            self.content_len -= data.nbytes
+    
+    
+    def send_continue(self):
+        self.continue_pending = False
+        try:
+            self.reader.sock.sendall(CONTINUE)
+        except OSError as e:
+            raise client_error(e) from e
+    
+    
+    def start_deadline(self):
+        self.reader.deadline = time.monotonic() + self.timeout
+        self.timeout = 0
+    
+    
+    def _available(self) -> int:
+        # body bytes that can be read before looking at the framing again
+        return self.content_len
+    
+    
+    def _take(self, buf: bytearray, amount: int):
+        buf += self.reader.read(amount)
+        self.content_len -= amount
+
+
+
+class ChunkedBodyWrapper(BodyWrapper):
+    """
+    `wsgi.input` for chunked request bodies, decoded while the app reads.
+    Here `content_len` is what is left of the current chunk. The size isnt known upfront,
+    so `max_size` is enforced as the chunk sizes come in.
+    """
+    __slots__ = ('started', 'done', 'max_size', 'total')
+    
+    MAX_CHUNK_LINE = 4096
+    
+    def __init__(self, reader: SocketReader, max_size: int = 0, expect_continue: bool = False, timeout: float = 0):
+        super().__init__(reader, 0, timeout=timeout)
+        self.continue_pending = expect_continue
+        self.started: bool = False
+        self.done: bool = False
+        self.max_size: int = max_size
+        self.total: int = 0
+        
+        
+    def read(self, length: int = -1) -> bytearray:
+        if length is None:
+            length = -1
+        if length < -1:
+            raise TypeError("Length arg cant be less than -1")
+        if self.timeout:
+            self.start_deadline()
+        if self.continue_pending:
+            self.send_continue()
         
         buf = bytearray()
-        while len(buf) < recv_limit:
-            self._read_into(buf, recv_limit)
-            
-        self.reader.put_back(buf, start=recv_limit)
-        buf = buf[:recv_limit]
+        while length == -1 or len(buf) < length:
+            available = self._available()
+            if available == 0:
+                break
+            if length != -1:
+                available = min(available, length - len(buf))
+            data = self.reader.read(available)
+            if data.nbytes == 0:
+                raise ClientDisconnect
+            buf += data
+            self.content_len -= data.nbytes
+        return buf
+    
+    
+    def _available(self) -> int:
+        if self.content_len or self.done:
+            return self.content_len
         
-        return buf.splitlines()
-            
+        if self.started and self._read_line() != b"":
+            # chunk data has to be followed by CRLF
+            raise InvalidChunkedEncoding(b"missing CRLF after chunk data")
+        self.started = True
+        
+        line = self._read_line()
+        size = line.split(b";", 1)[0].strip(b" \t")
+        if not HEX_RE.fullmatch(size):
+            raise InvalidChunkedEncoding(line)
         
-    def _read_into(self, buf: bytearray, amount: int = -1):
-        data = self.reader.read(amount)
-        if len(data) == 0:
-            raise ClientDisconnect
-        buf.extend(data)
\ No newline at end of file
+        self.content_len = int(size, 16)
+        self.total += self.content_len
+        if self.max_size and self.total > self.max_size:
+            raise BodyTooLarge(self.max_size)
+        if self.content_len == 0:
+            # skip the trailer section, we dont pass trailers to the app
+            while self._read_line() != b"":
+                pass
+            self.done = True
+        return self.content_len
+    
+    
+    def _read_line(self) -> bytes:
+        reader = self.reader
+        scanned = 0
+        while True:
+            idx = reader.find(b"\r\n", scanned)
+            if idx != -1:
+                line = bytes(reader.read(idx + 2)[:idx])
+                return line
+            if len(reader) > self.MAX_CHUNK_LINE:
+                raise InvalidChunkedEncoding(b"chunk line too long")
+            scanned = max(len(reader) - 1, 0)
+            if not reader.fill():
+                raise ClientDisconnect
+
+
+
+class SpooledBody:
+    """
+    `wsgi.input` that receives the whole body into a temporary file on the first read, which
+    stays in memory up to the spool size and spills to disk above it.
+    The asyncio worker passes `fetch`, its app runs in a thread away from the stream and the body
+    is received on the event loop. The sync and threaded workers pass the `source` wrapper
+    reading from the socket instead, for bodies that may be larger than the spool size.
+    """
+    __slots__ = ('fetch', 'file', 'continue_pending', 'source', 'spool_size')
+
+    def __init__(self, fetch: typing.Callable[[], typing.BinaryIO] = None, expect_continue: bool = False,
+                 source: BodyWrapper = None, spool_size: int = 0):
+        self.fetch = fetch
+        self.file: typing.BinaryIO = None
+        self.continue_pending: bool = expect_continue # cleared once the body was asked for
+        self.source = source
+        self.spool_size = spool_size
+
+
+    def read(self, length: int = -1) -> bytes:
+        return self._body().read(-1 if length is None else length)
+
+
+    def readline(self, size: int = -1) -> bytes:
+        return self._body().readline(-1 if size is None else size)
+
+
+    def readlines(self, sizehint: int = -1) -> list[bytes]:
+        return self._body().readlines(-1 if sizehint is None else sizehint)
+
+
+    def __iter__(self):
+        return iter(self._body())
+
+
+    def discard(self):
+        if self.file is None and self.source is not None:
+            self.source.discard()
+        self.close()
+
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+    def _body(self) -> typing.BinaryIO:
+        if self.file is None:
+            if self.fetch is not None:
+                self.file = self.fetch()
+            else:
+                # the response may have given up on 100 Continue before the app got to the body
+                self.source.continue_pending = self.continue_pending
+                self.file = self._spool()
+            self.continue_pending = False
+        return self.file
+
+
+    def _spool(self) -> typing.BinaryIO:
+        spool = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        try:
+            while chunk := self.source.read(BodyWrapper.READ_STEP):
+                spool.write(chunk)
+        except BaseException:
+            spool.close()
+            raise
+        spool.seek(0)
+        return spool
@@ -1,8 +1,9 @@
 import socket
-from ..sock import TCPsocket, BaseSocket, create_sockets
+from ..sock import TCPsocket, BaseSocket, SocketOptions, create_sockets, inherited_sockets, systemd_sockets, format_address
 import logging
 import signal
 from ..workers.base import BaseWorker
+from ..arbiter import Arbiter
 from ..utils import init_signals, Logger
 import datetime
 import typing
@@ -20,10 +21,11 @@ class Server:
         self.cfg = cfg
 
         self.app: typing.Callable = cfg.app
-        self.bind: list[tuple[str, str]] = cfg.bind
+        self.bind: list[tuple[str, int] | str] = cfg.bind
         self.backlog: int = cfg.backlog
         self.server_sockets: list[socket.socket] = None
-        self.worker: BaseWorker = cfg.workertype
+        self.worker: type[BaseWorker] = cfg.workertype
+        self.arbiter: Arbiter = None
 
         self.logger = logging.getLogger(__name__)
 
@@ -35,21 +37,35 @@ class Server:
             self.logger.fatal("Failed to prepare the server", exc_info=True)
             return
 
+        self.server_sockets = inherited_sockets()
+        if self.server_sockets:
+            self.logger.info("Took over %i listener(s) from the previous master", len(self.server_sockets))
+        else:
+            self.server_sockets = systemd_sockets()
+            if self.server_sockets:
+                self.logger.info("Using %i listener(s) passed by systemd, ignoring bind", len(self.server_sockets))
+
         # deploy sockets, retry up to 3 times with a timeout
         for att in range(1, 4):
+            if self.server_sockets:
+                break
             try:
-                self.server_sockets = create_sockets(self.bind, self.backlog)
+                self.server_sockets = create_sockets(self.bind, self.backlog, self.cfg.reuse_port, SocketOptions.from_config(self.cfg))
                 break
             except OSError as e:
                 if e.errno == errno.EADDRINUSE:
-                    self.logger.critical("Address %s:%s is in use, retrying. (Аttempt %i/3)", self.host, self.port, att)
+                    self.logger.critical("Address %s is in use, retrying. (Аttempt %i/3)", self.bind, att)
                 elif e.errno == errno.EADDRNOTAVAIL:
-                    self.logger.critical("Address %s:%s is not available, retrying. (Аttempt %i/3)", self.host, self.port, att)
+                    self.logger.critical("Address %s is not available, retrying. (Аttempt %i/3)", self.bind, att)
                 elif e.errno == errno.EACCES:
-                    self.logger.critical("No permission to open a socket at address %s:%s, retrying. (Аttempt %i/3)", self.host, self.port, att)
+                    self.logger.critical("No permission to open a socket at address %s, retrying. (Аttempt %i/3)", self.bind, att)
                 else:
-                    self.logger.critical("Unexpected OS error occured while starting socket at address %s:%s, retrying. (Аttempt %i/3) (Error: %s)", self.host, self.port, att, str(e))
+                    self.logger.critical("Unexpected OS error occured while starting socket at address %s, retrying. (Аttempt %i/3) (Error: %s)", self.bind, att, str(e))
                 time.sleep(2)
+            except FatalConfigException as e:
+                # retrying wont change what is at the path
+                self.logger.critical(str(e))
+                self.finish(True)
             except Exception as e:
                 self.logger.critical("Unexpected error occured while trying to init sockets: %s (Аttempt %i/3)", str(e), att)
                 time.sleep(2)
@@ -57,16 +73,15 @@ class Server:
             self.logger.critical("Sockets failed to deploy, finishing the process. . .")
             self.finish(True)
 
-        self.worker = self.worker(app=self.app, listeners=self.server_sockets, cfg=self.cfg)
         # log where we listen
         for sock in self.server_sockets:
-            address, port = sock.getsockname()
-            self.logger.info(f'Serving on http://{address}:{port}')
-        self.worker.run()
+            self.logger.info(f'Serving on {format_address(sock)}')
+
+        self.arbiter = Arbiter(app=self.app, listeners=self.server_sockets, cfg=self.cfg)
         try:
-            self.worker.run()
+            self.arbiter.run()
         finally:
-            self.finish()
+            self.finish(self.arbiter.failed)
 
 
     def prepare_server(self):
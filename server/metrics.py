@@ -0,0 +1,215 @@
+import os
+import mmap
+import socket
+import bisect
+import threading
+import logging
+from .sock import unlink_socket
+
+
+
+
+# upper bounds of the histogram buckets in seconds, the last bucket is +Inf
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PHASES = (
+    'accept_wait', # connection ready until a worker (thread) picks it up
+    'first_byte', # start of handling until the first byte of the request is there
+    'parse', # first byte until the head is parsed
+    'environ', # building the WSGI environ
+    'app', # the application, without the time spent sending
+    'send', # writing the response to the socket
+    'total', # whole request, from the start of handling until the response is sent
+)
+
+COUNTERS = ('requests', 'bytes_in', 'bytes_out', 'status_1xx', 'status_2xx', 'status_3xx', 'status_4xx', 'status_5xx', 'shed')
+
+HISTOGRAM_SIZE = len(BUCKETS) + 3 # buckets, +Inf, count and sum
+SLOT_SIZE = len(PHASES) * HISTOGRAM_SIZE + len(COUNTERS)
+COUNTERS_OFFSET = len(PHASES) * HISTOGRAM_SIZE
+
+PREFIX = 'deouserver'
+
+# stats listener descriptor passed on to the master execd for a binary upgrade
+STATS_FD_ENV = 'DEOUSERVER_STATS_FD'
+
+
+
+class Metrics:
+    """
+    Request metrics of all workers in one anonymous shared mapping.
+
+    The mapping is created in the master before forking, so every worker writes into the
+    same memory. Each worker owns one slot of doubles and is its only writer, the master
+    only reads and sums the slots up when the stats listener is scraped. Slots are never
+    cleared, a worker that replaces a dead one continues its counters, so they stay monotonic.
+    """
+    def __init__(self, slots: int):
+        self.slots = slots
+        self.mem = mmap.mmap(-1, slots * SLOT_SIZE * 8)
+        self.values = memoryview(self.mem).cast('d')
+
+
+    def for_worker(self, slot: int) -> "WorkerMetrics":
+        return WorkerMetrics(self.values, slot * SLOT_SIZE)
+
+
+    def render(self) -> bytes:
+        values = self.values
+        totals = [0.0] * SLOT_SIZE
+        per_worker = []
+        for slot in range(self.slots):
+            base = slot * SLOT_SIZE
+            for i in range(SLOT_SIZE):
+                totals[i] += values[base + i]
+            per_worker.append(values[base + COUNTERS_OFFSET])
+
+        lines = [
+            f"# HELP {PREFIX}_request_phase_seconds Time spent in each phase of a request.",
+            f"# TYPE {PREFIX}_request_phase_seconds histogram",
+        ]
+        for index, phase in enumerate(PHASES):
+            base = index * HISTOGRAM_SIZE
+            cumulative = 0.0
+            for i, bound in enumerate(BUCKETS):
+                cumulative += totals[base + i]
+                lines.append(f'{PREFIX}_request_phase_seconds_bucket{{phase="{phase}",le="{bound}"}} {cumulative:.0f}')
+            cumulative += totals[base + len(BUCKETS)]
+            lines.append(f'{PREFIX}_request_phase_seconds_bucket{{phase="{phase}",le="+Inf"}} {cumulative:.0f}')
+            lines.append(f'{PREFIX}_request_phase_seconds_count{{phase="{phase}"}} {totals[base + len(BUCKETS) + 1]:.0f}')
+            lines.append(f'{PREFIX}_request_phase_seconds_sum{{phase="{phase}"}} {totals[base + len(BUCKETS) + 2]}')
+
+        counters = dict(zip(COUNTERS, totals[COUNTERS_OFFSET:]))
+        lines.append(f"# HELP {PREFIX}_requests_total Requests served, by worker slot.")
+        lines.append(f"# TYPE {PREFIX}_requests_total counter")
+        for slot, count in enumerate(per_worker):
+            lines.append(f'{PREFIX}_requests_total{{worker="{slot}"}} {count:.0f}')
+        lines.append(f"# HELP {PREFIX}_responses_total Responses sent, by status class.")
+        lines.append(f"# TYPE {PREFIX}_responses_total counter")
+        for status in ('1xx', '2xx', '3xx', '4xx', '5xx'):
+            lines.append(f'{PREFIX}_responses_total{{code="{status}"}} {counters["status_" + status]:.0f}')
+        lines.append(f"# HELP {PREFIX}_received_bytes_total Bytes received from clients.")
+        lines.append(f"# TYPE {PREFIX}_received_bytes_total counter")
+        lines.append(f"{PREFIX}_received_bytes_total {counters['bytes_in']:.0f}")
+        lines.append(f"# HELP {PREFIX}_sent_bytes_total Bytes sent to clients.")
+        lines.append(f"# TYPE {PREFIX}_sent_bytes_total counter")
+        lines.append(f"{PREFIX}_sent_bytes_total {counters['bytes_out']:.0f}")
+        lines.append(f"# HELP {PREFIX}_shed_total Requests rejected with 503 because they waited too long.")
+        lines.append(f"# TYPE {PREFIX}_shed_total counter")
+        lines.append(f"{PREFIX}_shed_total {counters['shed']:.0f}")
+        return ("\n".join(lines) + "\n").encode()
+
+
+    def close(self):
+        self.values.release()
+        self.mem.close()
+
+
+
+class WorkerMetrics:
+    """
+    The slot of one worker. Threads of the worker share it, so updates are serialized with a lock.
+    """
+    __slots__ = ('values', 'base', 'lock')
+
+    def __init__(self, values: memoryview, base: int):
+        self.values = values
+        self.base = base
+        self.lock = threading.Lock()
+
+
+    def observe(self, phases: tuple[float | None, ...], bytes_in: int, bytes_out: int, status: int):
+        """
+        Record one request, `phases` is in the order of `PHASES` and None for phases the request didnt go through.
+        """
+        values, base = self.values, self.base
+        with self.lock:
+            for index, duration in enumerate(phases):
+                if duration is None:
+                    continue
+                offset = base + index * HISTOGRAM_SIZE
+                values[offset + bisect.bisect_left(BUCKETS, duration)] += 1
+                values[offset + len(BUCKETS) + 1] += 1
+                values[offset + len(BUCKETS) + 2] += duration
+
+            offset = base + COUNTERS_OFFSET
+            values[offset] += 1
+            values[offset + 1] += bytes_in
+            values[offset + 2] += bytes_out
+            if 100 <= status < 600:
+                values[offset + 3 + status // 100 - 1] += 1
+
+
+    def count_shed(self):
+        with self.lock:
+            self.values[self.base + COUNTERS_OFFSET + COUNTERS.index('shed')] += 1
+
+
+
+class StatsListener:
+    """
+    Answers every connection on `address` with the metrics in the Prometheus text format.
+
+    Runs in the master, which serves one scrape at a time between its other duties.
+    `address` is `host:port` or `unix:/path/to/socket`.
+    """
+    def __init__(self, address: str, metrics: Metrics, timeout: float = 1.0):
+        self.address = address
+        self.metrics = metrics
+        self.timeout = timeout
+        self.sock: socket.socket = None
+        self.unix_path: str = None
+        self.logger = logging.getLogger(__name__)
+
+
+    def listen(self, fd: int = None):
+        if fd is not None:
+            # taken over from the previous master, bound and listening already
+            self.unix_path = self.address[5:] if self.address.startswith('unix:') else None
+            self.sock = socket.socket(fileno=fd)
+            self.sock.set_inheritable(False)
+        elif self.address.startswith('unix:'):
+            unlink_socket(self.address[5:])
+            self.unix_path = self.address[5:]
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.bind(self.unix_path)
+        else:
+            host, port = self.address.rsplit(':', 1)
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.sock.bind((host, int(port)))
+        self.sock.listen(16)
+        self.sock.setblocking(False)
+        self.logger.info("Serving metrics on %s", self.address)
+
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+
+    def handle(self):
+        try:
+            client, _ = self.sock.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+
+        with client:
+            try:
+                client.settimeout(self.timeout)
+                request = client.recv(8192)
+                if not request.startswith((b"GET ", b"HEAD ")):
+                    client.sendall(b"HTTP/1.0 405 Method Not Allowed\r\nContent-Length: 0\r\n\r\n")
+                    return
+                body = self.metrics.render()
+                head = (b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                        b"Content-Length: %d\r\nConnection: close\r\n\r\n" % len(body))
+                client.sendall(head if request.startswith(b"HEAD ") else head + body)
+            except OSError as e:
+                self.logger.debug("Metrics scrape failed: %s", str(e))
+
+
+    def close(self, unlink: bool = True):
+        # forked workers only drop their copy of the descriptor, the socket file belongs to the master
+        self.sock.close()
+        if unlink and self.unix_path and os.path.exists(self.unix_path):
+            os.unlink(self.unix_path)
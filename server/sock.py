@@ -1,12 +1,77 @@
+import os
+import stat
+import time
 import socket
-from .errors import ClientDisconnect
+import struct
+import select
+import selectors
+import typing
+import contextlib
+from .errors import ClientDisconnect, FatalConfigException, client_error
+
+
+
+
+# listener descriptors a master passes on to the master it execs for a binary upgrade
+INHERIT_ENV = 'DEOUSERVER_FDS'
+
+# systemd socket activation passes its listeners from this descriptor on
+SD_LISTEN_FDS_START = 3
+
+
+
+class SocketOptions:
+    """
+    Kernel options of the listeners. Accepted connections inherit them from the listener,
+    except TCP_QUICKACK which wears off and is set on every accepted connection instead.
+    TCP options are skipped on unix sockets, options the platform doesnt have are skipped too.
+    """
+    __slots__ = ('nodelay', 'quickack', 'defer_accept', 'fastopen', 'rcvbuf', 'sndbuf')
+
+    def __init__(self, nodelay: bool = False, quickack: bool = False, defer_accept: int = 0, fastopen: int = 0,
+                 rcvbuf: int = 0, sndbuf: int = 0):
+        self.nodelay = nodelay
+        self.quickack = quickack
+        self.defer_accept = defer_accept # seconds the kernel holds a connection back until its first data
+        self.fastopen = fastopen # length of the pending TFO queue
+        self.rcvbuf = rcvbuf
+        self.sndbuf = sndbuf
+
+
+    @classmethod
+    def from_config(cls, cfg) -> "SocketOptions":
+        return cls(cfg.tcp_nodelay, cfg.tcp_quickack, cfg.tcp_defer_accept, cfg.tcp_fastopen,
+                   cfg.socket_rcvbuf, cfg.socket_sndbuf)
+
+
+    def apply_listener(self, sock: socket.socket):
+        # buffer sizes have to be set before listen() for the window scale to match them
+        if self.rcvbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        if self.sndbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+        if sock.family == socket.AF_UNIX:
+            return
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(self.nodelay))
+        if self.defer_accept and hasattr(socket, 'TCP_DEFER_ACCEPT'):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_DEFER_ACCEPT, self.defer_accept)
+        if self.fastopen and hasattr(socket, 'TCP_FASTOPEN'):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_FASTOPEN, self.fastopen)
+
+
+    def apply_client(self, sock: socket.socket):
+        if self.quickack and sock.family != socket.AF_UNIX and hasattr(socket, 'TCP_QUICKACK'):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+
 
 
 class BaseSocket:
-    def __init__(self, host: str, port: int, backlog: int):
+    def __init__(self, host: str, port: int, backlog: int, reuse_port: bool = False, options: SocketOptions = None):
         self.host = host
         self.port = port
         self.backlog = backlog
+        self.reuse_port = reuse_port
+        self.options = options or SocketOptions()
         self.sock: socket.socket = None
 
 
@@ -14,9 +79,14 @@ class BaseSocket:
         raise NotImplementedError()
 
 
+    def address(self) -> tuple[str, int] | str:
+        return (self.host, self.port)
+
+
     def deploy(self) -> socket.socket:
         self.init_socket()
-        self.sock.bind((self.host, self.port))
+        self.options.apply_listener(self.sock)
+        self.sock.bind(self.address())
         self.sock.listen(self.backlog)
 
         return self.sock
@@ -25,82 +95,359 @@ class BaseSocket:
 
 class TCPsocket(BaseSocket):
     def init_socket(self):
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 0)
+        family = socket.AF_INET6 if ':' in self.host else socket.AF_INET
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.sock.setblocking(0)
 
 
 
-def create_sockets(addresses: list[tuple[str, str]], backlog: int):
+class UnixSocket(BaseSocket):
+    """
+    Listener on a unix domain socket, for a proxy on the same host it saves the whole TCP stack.
+    A socket file left behind by a previous run is replaced, any other file at the path is not.
+    """
+    def __init__(self, path: str, backlog: int, options: SocketOptions = None):
+        super().__init__(path, None, backlog, options=options)
+
+
+    def address(self) -> str:
+        return self.host
+
+
+    def init_socket(self):
+        unlink_socket(self.host)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.setblocking(0)
+
+
+
+def unlink_socket(path: str):
+    """
+    Remove a stale socket file at `path` before binding it, a typo in the path must not delete anything else.
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FatalConfigException(f"{path} exists and is not a socket, refusing to replace it")
+    os.unlink(path)
+
+
+
+def create_sockets(addresses: list[tuple[str, int] | str], backlog: int, reuse_port: bool = False,
+                   options: SocketOptions = None) -> list[socket.socket]:
+    """
+    `addresses` holds (host, port) pairs and paths of unix sockets.
+    """
     sockets = []
-    for pair in addresses:
-        host, port = pair
-        sockets.append(TCPsocket(host, port, backlog).deploy())
+    for address in addresses:
+        if isinstance(address, str):
+            sockets.append(UnixSocket(address, backlog, options).deploy())
+        else:
+            host, port = address
+            sockets.append(TCPsocket(host, port, backlog, reuse_port, options).deploy())
     return sockets
 
 
 
+def format_address(sock: socket.socket) -> str:
+    address = sock.getsockname()
+    if sock.family == socket.AF_UNIX:
+        return f"unix:{address}"
+    if sock.family == socket.AF_INET6:
+        return f"http://[{address[0]}]:{address[1]}"
+    return f"http://{address[0]}:{address[1]}"
+
+
+
+def inherited_sockets() -> list[socket.socket]:
+    """
+    Listeners left to us by the master that execd this process, already bound and listening,
+    with whatever connections are waiting in their backlog.
+    """
+    fds = os.environ.pop(INHERIT_ENV, '')
+    sockets = []
+    for fd in filter(None, fds.split(',')):
+        sock = socket.socket(fileno=int(fd))
+        sock.set_inheritable(False)
+        sock.setblocking(False)
+        sockets.append(sock)
+    return sockets
+
+
+
+def systemd_sockets() -> list[socket.socket]:
+    """
+    Listeners handed to us by systemd socket activation. The variables are removed,
+    so the workers and a master execd later dont take them for their own.
+    """
+    if os.environ.get('LISTEN_PID') != str(os.getpid()):
+        return []
+    count = int(os.environ.pop('LISTEN_FDS', 0))
+    os.environ.pop('LISTEN_PID', None)
+    os.environ.pop('LISTEN_FDNAMES', None)
+
+    sockets = []
+    for fd in range(SD_LISTEN_FDS_START, SD_LISTEN_FDS_START + count):
+        sock = socket.socket(fileno=fd)
+        sock.set_inheritable(False)
+        sock.setblocking(False)
+        sockets.append(sock)
+    return sockets
+
+
+
+if hasattr(select, 'EPOLLEXCLUSIVE'):
+    class ExclusiveEpollSelector(selectors.EpollSelector):
+        """
+        Registers every descriptor with EPOLLEXCLUSIVE, a connection on a listener shared by several
+        workers wakes one of them instead of all. Descriptors can only be registered and unregistered,
+        the kernel refuses to modify exclusive ones.
+        """
+        _EVENT_READ = select.EPOLLIN | select.EPOLLEXCLUSIVE
+else:
+    ExclusiveEpollSelector = None
+
+
+
+def listener_selector(listeners: list[socket.socket], data: typing.Any = None) -> selectors.BaseSelector:
+    """
+    Selector with `listeners` registered for reading, exclusively where epoll supports it.
+    """
+    if ExclusiveEpollSelector is not None:
+        selector = ExclusiveEpollSelector()
+        try:
+            for sock in listeners:
+                selector.register(sock, selectors.EVENT_READ, data)
+            return selector
+        except OSError:
+            # kernels before 4.5 dont know the flag
+            selector.close()
+    selector = selectors.DefaultSelector()
+    for sock in listeners:
+        selector.register(sock, selectors.EVENT_READ, data)
+    return selector
+
+
+
+# offset of tcpi_last_data_recv in the linux struct tcp_info
+TCP_INFO_LAST_DATA_RECV = struct.Struct('=I'), 52
+
+
+
+def idle_for(sock: socket.socket) -> float | None:
+    """
+    Seconds since the connection last received data, or since it was established if nothing came yet.
+    For a request waiting its turn that is how long it has been queued, in the kernel backlog and in ours.
+    None where TCP_INFO isnt available, e.g. not on linux or not a TCP socket.
+    """
+    option = getattr(socket, 'TCP_INFO', None)
+    if option is None:
+        return None
+    field, offset = TCP_INFO_LAST_DATA_RECV
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, option, offset + field.size)
+    except OSError:
+        return None
+    if len(info) < offset + field.size:
+        return None
+    return field.unpack_from(info, offset)[0] / 1000
+
+
+
+@contextlib.contextmanager
+def corked(sock: socket.socket):
+    """
+    Hold back partial frames while the block runs, so headers written with sendmsg and the
+    body that follows with sendfile leave in full packets. A no-op where TCP_CORK doesnt exist and on unix sockets.
+    """
+    cork = getattr(socket, 'TCP_CORK', None)
+    if cork is None or sock.family == socket.AF_UNIX:
+        yield
+        return
+    sock.setsockopt(socket.IPPROTO_TCP, cork, 1)
+    try:
+        yield
+    finally:
+        sock.setsockopt(socket.IPPROTO_TCP, cork, 0)
+
+
+
+class BufferPool:
+    """
+    Free list of receive buffers, every worker keeps one so connections reuse memory
+    instead of allocating a fresh buffer each time.
+    """
+    __slots__ = ('bufsize', 'max_buffers', 'free')
+
+    def __init__(self, bufsize: int = 16384, max_buffers: int = 256):
+        self.bufsize = bufsize
+        self.max_buffers = max_buffers
+        self.free: list[bytearray] = []
+
+
+    def acquire(self) -> bytearray:
+        try:
+            return self.free.pop()
+        except IndexError:
+            return bytearray(self.bufsize)
+
+
+    def release(self, buf: bytearray):
+        # buffers that had to grow for a huge head are dropped, they would only waste memory here
+        if len(buf) == self.bufsize and len(self.free) < self.max_buffers:
+            self.free.append(buf)
+
+
+
 class SocketReader:
-    __slots__ = ('sock', 'buf', 'chunksize')
+    """
+    Buffered reader over a client socket.
+
+    Received data lives in `buf[start:end]` of one preallocated buffer filled with
+    `recv_into`. Consumed bytes are skipped by moving `start`, the data is only moved
+    to the front when the buffer runs out of room. Views returned by `read` and `peek`
+    point into the buffer and are only valid until the next call on the reader.
+
+    The socket timeout limits a single receive only, a client trickling in a byte at a time
+    would reset it forever. `deadline` is the total time the phase being read may take,
+    no receive waits past it.
+    """
+    __slots__ = ('sock', 'buf', 'start', 'end', 'pool', 'received', 'counted', 'deadline')
     
-    def __init__(self, sock: socket.socket):
+    def __init__(self, sock: socket.socket, pool: BufferPool = None):
         self.sock = sock
-        self.buf = bytearray()
-        self.chunksize: int = 8192
+        self.pool = pool
+        self.buf: bytearray = None
+        self.start: int = 0
+        self.end: int = 0
+        self.received: int = 0 # bytes received over the lifetime of the reader
+        self.counted: int = 0 # part of them already reported by take_received()
+        self.deadline: float | None = None # time.monotonic() the current phase has to be done by
+
+
+    def __len__(self) -> int:
+        return self.end - self.start
 
     
-    def read(self, amount: int = -1) -> bytearray:
+    def fill(self) -> int:
+        """
+        Receive once into the free space of the buffer, returns 0 when the client closed the connection.
+        """
+        if self.buf is None:
+            self.buf = self.pool.acquire() if self.pool else bytearray(16384)
+
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buf):
+            size = self.end - self.start
+            if self.start > 0:
+                with memoryview(self.buf) as view:
+                    view[:size] = view[self.start:self.end]
+            else:
+                grown = bytearray(len(self.buf) * 2)
+                grown[:size] = self.buf
+                self.release()
+                self.buf = grown
+            self.start, self.end = 0, size
+
+        with memoryview(self.buf) as view:
+            received = self.recv_into(view[self.end:])
+        self.end += received
+        self.received += received
+        return received
+
+
+    def peek(self) -> memoryview:
+        return memoryview(self.buf)[self.start:self.end] if self.buf is not None else memoryview(b'')
+
+
+    def consume(self, amount: int):
+        self.start = min(self.start + amount, self.end)
+
+
+    def find(self, sub: bytes, start: int = 0, end: int = None) -> int:
+        # offsets are relative to the unread data
+        end = len(self) if end is None else min(end, len(self))
+        idx = self.buf.find(sub, self.start + start, self.start + end) if self.buf is not None else -1
+        return idx - self.start if idx != -1 else -1
+
+
+    def read(self, amount: int = -1) -> memoryview:
+        """
+        Return up to `amount` bytes (everything buffered by default), receiving once if nothing is buffered.
+        An empty view means the client closed the connection.
+        """
         if amount < -1:
             raise TypeError('Amount cannot be less than -1')
         if amount == 0:
-            return bytearray()
-
-        # No amount = get data once
-        if amount == -1:
-            if not len(self.buf) > 0:   
-                self._read(self.chunksize) 
-            res = self.buf
-            self.buf = bytearray()
-            return res
-
-        # Buffer has all data we need
-        if len(self.buf) >= amount:
-            data = self.buf[:amount]
-            del self.buf[:amount]
-            return data
-        
-        # Not enough to satisfy the amount
-        size = min(self.chunksize, amount)
-        while len(self.buf) < amount:
-            received = self._read(size)
+            return memoryview(b'')
+
+        if self.start == self.end:
+            self.fill()
+
+        if amount == -1 or amount > len(self):
+            amount = len(self)
+        view = self.peek()[:amount]
+        self.start += amount
+        return view
+
+
+    def readinto(self, target: memoryview) -> int:
+        """
+        Fill `target` with buffered data first and receive the rest straight into it,
+        big bodies never pass through our buffer. Returns less only if the client went away.
+        """
+        size = target.nbytes
+        done = min(size, len(self))
+        if done:
+            with memoryview(self.buf) as view:
+                target[:done] = view[self.start:self.start + done]
+            self.start += done
+
+        while done < size:
+            received = self.recv_into(target[done:])
             if received == 0:
-                data = self.buf
-                self.buf = bytearray()
-                return data
-        
-        data = self.buf[:amount]
-        del self.buf[:amount]
-        return data
-    
+                break
+            done += received
+            self.received += received
+        return done
 
-    def _read(self, size: int):
-        data = self.sock.recv(size)
-        if data == b'':
-            return 0
-        self.buf.extend(data)
-        return len(data)
-
-
-    def put_back(self, data: bytes | bytearray, start: int = 0, end: int = -1):
-        if start > end and end > -1 and start > 0:
-            raise ValueError("Start argument must be less the than end argument.")
-        
-        view = memoryview(data)
-        if end == -1:
-            view = view[start:]
-        else:
-            view = view[start:end]
-            
-        self.buf[:0] = view
-        view.release()
\ No newline at end of file
+
+    def recv_into(self, view: memoryview) -> int:
+        try:
+            if self.deadline is None:
+                return self.sock.recv_into(view)
+            remaining = self.deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("Deadline of the request passed")
+            timeout = self.sock.gettimeout()
+            if timeout is not None and remaining >= timeout:
+                return self.sock.recv_into(view)
+            # only shortened for the last receives before the deadline, the timeout also bounds our writes
+            self.sock.settimeout(remaining)
+            try:
+                return self.sock.recv_into(view)
+            finally:
+                self.sock.settimeout(timeout)
+        except OSError as e:
+            raise client_error(e) from e
+
+
+    def take_received(self) -> int:
+        """
+        Bytes received since the last call, so every byte is reported once.
+        """
+        received, self.counted = self.received - self.counted, self.received
+        return received
+
+
+    def release(self):
+        if self.buf is not None and self.pool:
+            self.pool.release(self.buf)
+        self.buf = None
+        self.start = self.end = 0
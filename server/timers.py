@@ -0,0 +1,114 @@
+import time
+import math
+import typing
+import logging
+
+
+
+
+class Timer:
+    __slots__ = ('deadline', 'callback', 'slot')
+
+    def __init__(self, deadline: float, callback: typing.Callable[[], typing.Any], slot: int):
+        self.deadline = deadline
+        self.callback = callback
+        self.slot = slot
+
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel, the deadlines of all connections of a worker in one place.
+
+    The wheel is `slots` buckets of `tick` seconds. A timer goes into the bucket of the tick its
+    deadline falls in, modulo the size of the wheel, so scheduling and cancelling are a set insert
+    and removal and every tick only looks at the one bucket it passes. Timers more than one turn
+    ahead share a bucket with nearer ones and stay there until their turn comes. Not thread safe,
+    it belongs to the thread that drives the connections.
+    """
+    def __init__(self, tick: float = 0.25, slots: int = 1024):
+        self.tick = tick
+        self.buckets: list[set[Timer]] = [set() for _ in range(slots)]
+        self.current: int = int(time.monotonic() / tick) # last tick that was processed
+        self.logger = logging.getLogger(__name__)
+
+
+    def schedule(self, delay: float, callback: typing.Callable[[], typing.Any]) -> Timer:
+        deadline = time.monotonic() + delay
+        # never into a bucket that was already passed, the timer would wait a whole turn
+        slot = max(math.ceil(deadline / self.tick), self.current + 1) % len(self.buckets)
+        timer = Timer(deadline, callback, slot)
+        self.buckets[slot].add(timer)
+        return timer
+
+
+    def cancel(self, timer: Timer):
+        self.buckets[timer.slot].discard(timer)
+
+
+    def advance(self, now: float = None) -> int:
+        """
+        Fire the timers that are due, returns how many. Can be called at any rate, the ticks
+        passed since the last call are caught up on.
+        """
+        if now is None:
+            now = time.monotonic()
+        target = int(now / self.tick)
+        # after more than a turn every bucket is due a look, once is enough
+        first = max(self.current + 1, target - len(self.buckets) + 1)
+        fired = 0
+        for tick in range(first, target + 1):
+            bucket = self.buckets[tick % len(self.buckets)]
+            if not bucket:
+                continue
+            expired = [timer for timer in bucket if timer.deadline <= now]
+            for timer in expired:
+                bucket.discard(timer)
+                fired += 1
+                try:
+                    timer.callback()
+                except Exception:
+                    self.logger.exception("Error in a timer callback")
+        self.current = max(self.current, target)
+        return fired
+
+
+
+class Deadline:
+    """
+    The one timer of a connection, moved along as the connection goes from phase to phase
+    (idle, head, body, write). `on_expire` runs when the current phase overruns its time,
+    the phase stays in `expired` for the logs.
+    """
+    __slots__ = ('wheel', 'on_expire', 'timer', 'phase', 'expired')
+
+    def __init__(self, wheel: TimerWheel, on_expire: typing.Callable[[], typing.Any]):
+        self.wheel = wheel
+        self.on_expire = on_expire
+        self.timer: Timer = None
+        self.phase: str = None
+        self.expired: str = None
+
+
+    def start(self, phase: str, timeout: float):
+        self.stop()
+        if timeout and timeout > 0:
+            self.phase = phase
+            self.timer = self.wheel.schedule(timeout, self.fire)
+
+
+    def start_by(self, phase: str, at: float):
+        # absolute variant of `start`, a phase already overdue expires on the next tick
+        self.start(phase, max(at - time.monotonic(), self.wheel.tick))
+
+
+    def stop(self):
+        if self.timer is not None:
+            self.wheel.cancel(self.timer)
+            self.timer = None
+
+
+    def fire(self):
+        self.timer = None
+        self.expired = self.phase
+        self.on_expire()
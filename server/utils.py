@@ -5,6 +5,12 @@ from pathlib import Path
 import signal
 import typing
 import time
+import os
+
+
+
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
 
 
 
@@ -37,6 +43,39 @@ def find_application(path_or_callable: str | typing.Callable) -> typing.Callable
 
 
 
+def memory_usage(pid: int | str = 'self') -> tuple[int, int] | None:
+    """
+    Resident memory of a process in bytes as (shared, private), None where /proc doesnt have it.
+    """
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+
+    shared = private = 0
+    for line in lines:
+        name, _, value = line.partition(':')
+        if name in ('Shared_Clean', 'Shared_Dirty'):
+            shared += int(value.split()[0]) * 1024
+        elif name in ('Private_Clean', 'Private_Dirty'):
+            private += int(value.split()[0]) * 1024
+    return shared, private
+
+
+
+def resident_memory(pid: int | str = 'self') -> int | None:
+    """
+    Resident set size of a process in bytes, cheap enough to check between requests.
+    """
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        return None
+
+
+
 def init_signals(pairs: list[tuple[int, typing.Callable]]):
     for pair in pairs:
         signal.signal(pair[0], pair[1])
@@ -0,0 +1,502 @@
+import asyncio
+import socket
+import time
+import tempfile
+import typing
+from concurrent import futures
+from .base import BaseWorker
+from ..http.handlers import Request, Response, LAST_CHUNK, PAYLOAD_TOO_LARGE, BAD_REQUEST, HEADERS_TOO_LARGE, INTERNAL_ERROR
+from ..http.parser import RequestParser
+from ..http.static import StaticResult
+from ..http.cache import CachedResponse
+from ..http.wrappers import SpooledBody, CONTINUE
+from ..http.asgi import ASGICycle, AsyncChunkedReader, LifespanManager, is_asgi_app
+from ..http.errors import *
+from ..errors import *
+from ..config import Config
+from ..timers import TimerWheel, Deadline
+
+
+
+class AsyncioWorker(BaseWorker):
+    """
+    Serves every connection of the worker from a single asyncio event loop.
+
+    ASGI 3 applications are awaited directly, plain WSGI callables are run in a
+    thread pool of `cfg.threads` threads so they dont block the loop.
+    """
+    multithread = True # WSGI apps run in the executor threads
+
+    def __init__(self, app: typing.Callable, listeners: list[socket.socket], cfg: Config = Config()):
+        super().__init__(app, listeners, cfg)
+        self.asgi: bool = is_asgi_app(app)
+        self.threads: int = cfg.threads
+        self.keepalive: bool = not cfg.avoid_keepalive
+        self.keepalive_timeout: int | float = cfg.keepalive_timeout
+        self.max_keepalive_requests: int = cfg.max_keepalive_requests
+        self.graceful_timeout: int | float = cfg.graceful_timeout
+        self.executor: futures.ThreadPoolExecutor = None
+        self.lifespan: LifespanManager = None
+        self.servers: list[asyncio.Server] = []
+        self.connections: set[asyncio.Task] = set()
+        self.idle: set[asyncio.Task] = set() # connections waiting for their next request
+        self.timers: TimerWheel = TimerWheel() # deadlines of every phase of every connection
+
+
+    def run(self):
+        self.alive = True
+
+        self.prepare_worker()
+        asyncio.run(self.serve())
+
+        self.close()
+
+
+    async def serve(self):
+        if not self.asgi:
+            self.executor = futures.ThreadPoolExecutor(max_workers=self.threads)
+        else:
+            self.lifespan = LifespanManager(self.app)
+            await self.lifespan.startup()
+            if self.lifespan.failed is not None:
+                # the spec wants the server to exit, the master stops instead of respawning us
+                raise ApplicationStartupFailed(self.lifespan.failed)
+
+        limit = Request.MAX_REQUEST_LINE + Request.MAX_HEADER_SIZE
+        for sock in self.listeners:
+            server = await asyncio.start_server(self.handle_connection, sock=sock, limit=limit)
+            self.servers.append(server)
+        self.notify_ready()
+
+        while self.alive:
+            await asyncio.sleep(self.timers.tick)
+            self.timers.advance()
+            if not self.is_parent_alive():
+                self.logger.info("Master process is gone, stopping the worker")
+                break
+
+        await self.shutdown()
+
+
+    async def shutdown(self):
+        self.alive = False
+        for server in self.servers:
+            server.close()
+        # connections accepted right before are still being set up, it takes the loop a few
+        # rounds (accept task, connection_made, handler task) until their handlers register
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+        # idle keep-alive connections have nothing to finish
+        for task in list(self.idle):
+            task.cancel()
+
+        if self.connections:
+            _, pending = await asyncio.wait(set(self.connections), timeout=self.graceful_timeout)
+            for task in pending:
+                task.cancel()
+
+        if self.lifespan:
+            await self.lifespan.shutdown()
+        if self.executor:
+            self.executor.shutdown(wait=False)
+
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self.connections.add(task)
+        addr = writer.get_extra_info('peername')
+        self.socket_options.apply_client(writer.get_extra_info('socket'))
+        # an overrun phase aborts the transport, whatever waits on the connection fails right away
+        deadline = Deadline(self.timers, writer.transport.abort)
+
+        try:
+            served = 0
+            # a connection accepted right before shutdown still gets its first request served
+            while self.alive or not served:
+                first = b''
+                if served:
+                    # only keep-alive connections count as idle, a fresh one has its request on the way
+                    self.idle.add(task)
+                    deadline.start('idle', self.keepalive_timeout)
+                    try:
+                        first = await reader.read(1)
+                    finally:
+                        self.idle.discard(task)
+                    if not first:
+                        break
+
+                # the whole head has to arrive in time, however slowly it trickles in
+                deadline.start('head', self.header_timeout or self.client_sock_timeout)
+                head = await self.read_head(reader, first)
+                deadline.stop()
+                if head is None:
+                    break
+                if self.max_queue_latency and self.overloaded(writer.get_extra_info('socket')):
+                    self.count_shed(addr)
+                    writer.write(self.unavailable)
+                    break
+                # the head arrives in one piece, there is no first byte to time separately
+                started = time.perf_counter()
+                request = Request(reader=None)
+                RequestParser(request).feed(head)
+                parsed = time.perf_counter()
+
+                served += 1
+                if not self.keepalive or not self.alive or served >= self.max_keepalive_requests:
+                    request.keepalive = 0
+
+                refused = bool(self.max_body_size) and request.content_len > self.max_body_size
+                if refused:
+                    keepalive, response = self.refuse(Response(None, request), writer)
+                elif self.static is not None and (result := self.static.resolve(request)) is not None:
+                    keepalive, response = await self.write_static(request, result, writer, deadline)
+                elif self.asgi:
+                    keepalive, response = await self.handle_asgi(request, reader, writer, deadline)
+                else:
+                    keepalive, response = await self.handle_wsgi(request, reader, writer, deadline)
+                # like the other workers, only a request that got an environ or a scope called the app
+                self.record(request, response, addr, None, started, parsed, response.built, called_app=response.built is not None,
+                            bytes_in=len(head) + (0 if refused else request.content_len))
+
+                if not keepalive:
+                    break
+
+        except BodyTooLarge as e:
+            # only raised while dropping a body the app didnt read, its response is already out
+            self.logger.debug("Client %s sent too much: %s", addr, str(e))
+        except RequestBuildingError as e:
+            self.logger.debug("Bad request from %s: %s", addr, str(e))
+            writer.write(HEADERS_TOO_LARGE if isinstance(e, HeaderOverflow) else BAD_REQUEST)
+        except (ClientDisconnect, ConnectionError):
+            if deadline.expired:
+                self.logger.debug("Client %s timed out, phase: %s", addr, deadline.expired)
+            else:
+                self.logger.debug("Client %s disconnected", addr)
+        except asyncio.CancelledError:
+            self.logger.debug("Connection from %s cancelled on shutdown", addr)
+        except Exception:
+            self.logger.exception("Unexpected error while handling a connection from %s", addr)
+        finally:
+            deadline.stop()
+            self.connections.discard(task)
+            writer.close()
+
+
+    async def read_head(self, reader: asyncio.StreamReader, first: bytes = b'') -> bytes | None:
+        # `first` is the byte that ended the keep-alive wait
+        try:
+            head = first + await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if not e.partial and not first:
+                return None # client closed the connection between requests
+            raise ClientDisconnect
+        except asyncio.LimitOverrunError as e:
+            # the connection is closed after the error, what is buffered tells which limit was hit.
+            # empty lines before the request line are skipped like the parser does
+            head = (first + await reader.read(e.consumed)).lstrip(b"\r\n")
+            if b"\r\n" not in head[:Request.MAX_REQUEST_LINE + 2]:
+                raise RequestLineOverflow(Request.MAX_REQUEST_LINE)
+            raise HeaderOverflow(Request.MAX_HEADER_SIZE)
+        return head
+
+
+    async def write_static(self, request: Request, result: StaticResult, writer: asyncio.StreamWriter,
+                           deadline: Deadline) -> tuple[bool, Response]:
+        if request.content_len or request.chunked:
+            # the body is left unread, the connection cant be reused after it
+            request.keepalive = 0
+
+        response = Response(None, request, write_timeout=self.write_timeout)
+        try:
+            response.prepare_static(result)
+            buffers = [response.serialize_headers()]
+            if request.method != b"HEAD" and result.body is not None:
+                buffers.append(result.body)
+            writer.writelines(buffers)
+            await self.drain(response, writer, buffers, deadline)
+            if request.method != b"HEAD" and result.length and result.body is None:
+                started = time.perf_counter()
+                loop = asyncio.get_running_loop()
+                # aborting the transport under a running sendfile breaks it, the sendfile is cancelled instead
+                write_deadline = response.write_deadline()
+                timeout = None if write_deadline is None else max(write_deadline - time.monotonic(), 0)
+                try:
+                    response.written += await asyncio.wait_for(
+                        loop.sendfile(writer.transport, result.entry.file, result.offset, result.length), timeout)
+                except asyncio.TimeoutError:
+                    deadline.expired = 'write'
+                    raise ClientDisconnect
+                response.send_time += time.perf_counter() - started
+        finally:
+            self.static.release(result)
+
+        return bool(request.keepalive), response
+
+
+    async def handle_asgi(self, request: Request, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                          deadline: Deadline) -> tuple[bool, Response]:
+        cycle = ASGICycle(request, reader, writer, self.compression, self.max_body_size, deadline,
+                          self.body_timeout, self.write_timeout, self.client_sock_timeout)
+        scope = cycle.build_scope(writer.get_extra_info('sockname'), writer.get_extra_info('peername'), self.lifespan.state)
+        cycle.response.built = time.perf_counter()
+
+        try:
+            await self.app(scope, cycle.receive, cycle.send)
+        except ClientDisconnect:
+            return False, cycle.response
+        except BodyTooLarge:
+            return self.refuse(cycle.response, writer)
+        except Exception:
+            self.logger.exception("Error in ASGI application")
+            if not cycle.response_started:
+                writer.write(INTERNAL_ERROR)
+            return False, cycle.response
+        finally:
+            cycle.response_complete.set()
+
+        if not cycle.response_started:
+            self.logger.error("ASGI application returned without starting a response")
+            writer.write(INTERNAL_ERROR)
+            return False, cycle.response
+
+        if not cycle.response.should_keepalive():
+            return False, cycle.response
+
+        await cycle.discard_body()
+        return True, cycle.response
+
+
+    async def handle_wsgi(self, request: Request, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                          deadline: Deadline) -> tuple[bool, Response]:
+        response = Response(None, request, compression=self.compression, write_timeout=self.write_timeout)
+        if self.cache is not None and (key := self.cache.key(request)) is not None:
+            entry = self.cache.get(key, request)
+            flight = None
+            if entry is None and self.cache.coalesce:
+                flight, leading = self.cache.join(key)
+                if not leading:
+                    entry = await self.wait_flight(flight, request)
+                    flight = None
+            if entry is not None:
+                buffers = response.cached_buffers(entry)
+                writer.writelines(buffers)
+                await self.drain(response, writer, buffers, deadline)
+                return response.should_keepalive(), response
+            response.start_capture(key, self.cache.max_entry_size, flight)
+
+        try:
+            return await self.call_wsgi(request, reader, writer, response, deadline)
+        finally:
+            self.land_flight(response)
+
+
+    async def wait_flight(self, flight: futures.Future, request: Request) -> CachedResponse | None:
+        # the leader lands the flight from this loop, waiting doesnt take an executor thread
+        done, _ = await asyncio.wait([asyncio.wrap_future(flight)], timeout=self.cache.coalesce)
+        if not done:
+            self.logger.debug("Gave up waiting for a coalesced response to %s", request.path)
+            return None
+        return flight.result()
+
+
+    async def call_wsgi(self, request: Request, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                        response: Response, deadline: Deadline) -> tuple[bool, Response]:
+        loop = asyncio.get_running_loop()
+        # the body is only received once the app reads it, from its executor thread
+        fetch = lambda: asyncio.run_coroutine_threadsafe(self.spool_body(request, reader, writer, response, deadline), loop).result()
+        wsgi_input = SpooledBody(fetch, request.expect_continue and bool(request.content_len or request.chunked))
+        environ = response.build_environ(self.environ_template, body=wsgi_input)
+        response.built = time.perf_counter()
+
+        def start_response(status: str, headers: list[tuple[str, str]], exc_info = None) -> typing.Callable:
+            # called from the executor thread, legacy write() calls are pushed back onto the loop
+            response.start_response(status, headers, exc_info)
+            return lambda data: asyncio.run_coroutine_threadsafe(self.write_wsgi(response, writer, data, deadline), loop).result()
+
+        queued = time.perf_counter()
+        def call_app():
+            # the executor queue is where WSGI requests wait when the threads cant keep up
+            if self.max_queue_latency and time.perf_counter() - queued > self.max_queue_latency:
+                return None
+            return self.app(environ, start_response)
+
+        try:
+            app_result = await loop.run_in_executor(self.executor, call_app)
+        except BodyTooLarge:
+            wsgi_input.close()
+            return self.refuse(response, writer)
+        except (RequestBuildingError, ClientDisconnect):
+            wsgi_input.close()
+            raise
+        except Exception:
+            wsgi_input.close()
+            return self.app_error(response, writer)
+        if app_result is None:
+            wsgi_input.close()
+            self.count_shed(writer.get_extra_info('peername'))
+            response.status = '503 Service Unavailable'
+            writer.write(self.unavailable)
+            response.written += len(self.unavailable)
+            return False, response
+        try:
+            if isinstance(app_result, (list, tuple)):
+                body = response.compress_list(app_result)
+                response.set_length(body)
+                for chunk in body:
+                    await self.write_wsgi(response, writer, chunk, deadline)
+            else:
+                # the iterable may block (generators, files), step it in the executor
+                iterator = iter(app_result)
+                while True:
+                    chunk = await loop.run_in_executor(self.executor, next, iterator, None)
+                    if chunk is None:
+                        break
+                    await self.write_wsgi(response, writer, chunk, deadline)
+
+            if not response.headers_sent:
+                await self.write_wsgi(response, writer, b'', deadline)
+            tail = response.encode_tail()
+            if tail and response.capture is not None:
+                response.capture_data(tail)
+            buffers = response.frame(tail)
+            if response.chunked:
+                buffers.append(LAST_CHUNK)
+            writer.writelines(buffers)
+            response.written += sum(map(len, buffers))
+            response.complete = True
+        except (RequestBuildingError, ClientDisconnect):
+            raise
+        except Exception:
+            return self.app_error(response, writer)
+        finally:
+            if hasattr(app_result, 'close'):
+                await loop.run_in_executor(self.executor, app_result.close)
+            wsgi_input.close()
+
+        if response.should_keepalive() and wsgi_input.file is None and (request.content_len or request.chunked):
+            # the app never read the body, drop it so the next request starts at its request line
+            await self.read_body(request, reader, deadline=deadline)
+        self.store_cached(response)
+        return response.should_keepalive(), response
+
+
+    async def spool_body(self, request: Request, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                         response: Response, deadline: Deadline) -> typing.BinaryIO:
+        if response.body.continue_pending:
+            response.body.continue_pending = False
+            writer.write(CONTINUE)
+
+        spool = tempfile.SpooledTemporaryFile(max_size=self.body_spool_size)
+        try:
+            await self.read_body(request, reader, spool.write, deadline)
+        except BaseException:
+            spool.close()
+            # whatever is left of the body is still on its way, the connection cant be reused
+            request.keepalive = 0
+            raise
+        spool.seek(0)
+        return spool
+
+
+    async def read_body(self, request: Request, reader: asyncio.StreamReader, sink: typing.Callable[[bytes], typing.Any] = None,
+                        deadline: Deadline = None):
+        if deadline is not None:
+            deadline.start('body', self.body_timeout)
+        try:
+            if request.chunked:
+                chunks = AsyncChunkedReader(reader, self.max_body_size)
+                while data := await chunks.read():
+                    if sink is not None:
+                        sink(data)
+            else:
+                left = request.content_len
+                while left:
+                    data = await reader.read(min(left, 65536))
+                    if not data:
+                        raise ClientDisconnect
+                    left -= len(data)
+                    if sink is not None:
+                        sink(data)
+        except ConnectionError as e:
+            # an app thread waits on this for its wsgi.input, it has to see a client error
+            raise client_error(e) from e
+        if deadline is not None:
+            deadline.stop()
+
+
+    def refuse(self, response: Response, writer: asyncio.StreamWriter) -> tuple[bool, Response]:
+        # bodies over `max_body_size` get a 413 as long as nothing else was sent yet
+        if not response.headers_sent:
+            response.status = '413 Content Too Large'
+            writer.write(PAYLOAD_TOO_LARGE)
+            response.written += len(PAYLOAD_TOO_LARGE)
+        return False, response
+
+
+    def app_error(self, response: Response, writer: asyncio.StreamWriter) -> tuple[bool, Response]:
+        # the worker outlives a failing app, the client gets a 500 unless the response already started
+        self.logger.exception("Error in WSGI application")
+        if not response.headers_sent:
+            response.status = '500 Internal Server Error'
+            writer.write(INTERNAL_ERROR)
+            response.written += len(INTERNAL_ERROR)
+        return False, response
+
+
+    async def write_wsgi(self, response: Response, writer: asyncio.StreamWriter, data: bytes, deadline: Deadline):
+        if not isinstance(data, bytes):
+            try:
+                data = data.encode()
+            except AttributeError:
+                raise IncorrectWriteArgument
+
+        buffers = []
+        if not response.headers_sent:
+            buffers.append(response.serialize_headers())
+            response.headers_sent = True
+
+        if response.response_length is not None:
+            data = data[:max(response.response_length - response.sent, 0)]
+        if data:
+            response.sent += len(data)
+            if response.request.method != b"HEAD":
+                # streamed bodies stay streamed, compressed or not
+                data = response.encode_body(data, sync=True)
+                if response.capture is not None:
+                    response.capture_data(data)
+                buffers.extend(response.frame(data))
+        writer.writelines(buffers)
+        await self.drain(response, writer, buffers, deadline)
+
+
+    async def drain(self, response: Response, writer: asyncio.StreamWriter, buffers: list[bytes], deadline: Deadline):
+        # what the transport cant take right away is waited for here, that is our send time
+        started = time.perf_counter()
+        response.written += sum(map(len, buffers))
+        self.start_write(response, deadline)
+        try:
+            await writer.drain()
+        except ConnectionError as e:
+            raise client_error(e) from e
+        deadline.stop()
+        if writer.transport.is_closing():
+            # an aborted transport wakes the drain up without an error
+            raise ClientDisconnect
+        response.send_time += time.perf_counter() - started
+
+
+    def start_write(self, response: Response, deadline: Deadline):
+        # the whole response shares one deadline, without it every write gets the client timeout
+        write_deadline = response.write_deadline()
+        if write_deadline is not None:
+            deadline.start_by('write', write_deadline)
+        else:
+            deadline.start('write', self.client_sock_timeout)
+
+
+    def close(self):
+        self.alive = False
+        for sock in self.listeners:
+            sock.close()
+        super().close()
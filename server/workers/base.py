@@ -1,24 +1,84 @@
 import socket
 import typing
 import signal
-from ..utils import init_signals
+from ..utils import init_signals, memory_usage, resident_memory
 import logging
 import selectors
 import sys
+import os
+import time
+import gc
+import random
+import struct
+import threading
+import tracemalloc
+from concurrent import futures
 from ..config import Config
+from ..sock import BufferPool, SocketOptions, idle_for
+from ..http.static import StaticFiles
+from ..http.cache import ResponseCache
+from ..http.compression import CompressionPolicy
+from ..metrics import WorkerMetrics
+from ..accesslog import AccessLog
+from ..http.handlers import PAYLOAD_TOO_LARGE, BAD_REQUEST, HEADERS_TOO_LARGE, INTERNAL_ERROR, SERVICE_UNAVAILABLE, environ_template
+from ..http.errors import RequestBuildingError, HeaderOverflow
 
 
 
 
 class BaseWorker:
+    multithread: bool = False
+
     def __init__(self, app: typing.Callable, listeners: list[socket.socket], cfg: Config = Config()):
         self.app = app
         self.listeners = listeners
-        self.selector: selectors.BaseSelector = selectors.DefaultSelector
+        self.selector: selectors.BaseSelector = None
+        self.accept_batch: int = cfg.accept_batch # connections taken from one listener before the next gets a turn
+        self.socket_options: SocketOptions = SocketOptions.from_config(cfg) # the per connection ones are set on accept
         self.alive = False
         self.logger = logging.getLogger(__name__)
         self.server_sock_timeout: int | float = 0.5 # time we make the selector wait for if there are no data in any descriptors
         self.client_sock_timeout: int | float = cfg.client_timeout # how much we let the client sock hang for before closing it
+        self.header_timeout: int | float = cfg.header_timeout # total time for a request head
+        self.body_timeout: int | float = cfg.body_timeout # total time for a request body
+        self.write_timeout: int | float = cfg.write_timeout # total time for a response
+        self.multiprocess: bool = cfg.workers > 1
+        self.environ_template: dict = environ_template(self.multithread, self.multiprocess)
+        self.write_batch_size: int = cfg.write_batch_size
+        self.max_body_size: int = cfg.max_body_size
+        self.body_spool_size: int = cfg.body_spool_size
+        self.gc_threshold: list[int] = cfg.gc_threshold
+        self.max_requests: int = 0
+        if cfg.max_requests > 0:
+            self.max_requests = cfg.max_requests + random.randint(0, max(cfg.max_requests_jitter, 0))
+        self.max_memory: int = cfg.max_worker_memory
+        self.next_memory_check: float = 0
+        self.requests_served: int = 0
+        self.recycle_lock = threading.Lock() # threads of the threaded worker finish requests at the same time
+        self.tracemalloc_dir: str = cfg.tracemalloc_dir
+        self.snapshot: tracemalloc.Snapshot = None
+        self.max_queue_latency: float = cfg.max_queue_latency
+        self.unavailable: bytes = SERVICE_UNAVAILABLE % cfg.retry_after
+        self.shed_count: int = 0 # rejected since the last warning
+        self.shed_logged_at: float = 0
+        self.buffer_pool: BufferPool = BufferPool() # receive buffers reused between connections
+        self.pid: int = None
+        self.ready_fd: int = None # write end of the masters ready pipe, set by the arbiter
+        self.ppid: int = os.getpid() # workers are built in the master before forking
+        self.compression: CompressionPolicy = None
+        if cfg.compression:
+            self.compression = CompressionPolicy(cfg.compression_level, cfg.compression_min_size, cfg.compression_types)
+        self.static: StaticFiles = None
+        if cfg.static:
+            self.static = StaticFiles(cfg.static, cfg.static_cache_size, compression=self.compression)
+        self.metrics: WorkerMetrics = None # set by the arbiter when a stats listener is configured
+        self.cache: ResponseCache = None
+        if cfg.cache_ttl > 0:
+            self.cache = ResponseCache(cfg.cache_ttl, cfg.cache_size, cfg.cache_vary, cfg.cache_routes, cfg.cache_coalesce)
+        self.access_log: AccessLog = None
+        if cfg.access_log:
+            self.access_log = AccessLog(cfg.access_log, cfg.access_log_format, cfg.access_log_sample,
+                                        cfg.access_log_queue_size)
         
 
     def prepare_worker(self):
@@ -26,6 +86,45 @@ class BaseWorker:
         (signal.SIGINT, self.sigint_handler),
         (signal.SIGTERM, self.sigterm_handler),
         ])
+        if self.access_log:
+            self.access_log.start()
+
+        if self.gc_threshold == [0]:
+            gc.disable()
+        elif self.gc_threshold:
+            gc.set_threshold(*self.gc_threshold)
+
+        rss = resident_memory() if self.max_memory else None
+        if rss is not None and rss >= self.max_memory:
+            # a fresh worker would be replaced after every request
+            self.logger.warning("Worker %s already uses %.1f MiB at startup, above max_worker_memory, not checking it",
+                                os.getpid(), rss / 2**20)
+            self.max_memory = 0
+
+        if self.tracemalloc_dir:
+            tracemalloc.start()
+            self.snapshot = tracemalloc.take_snapshot()
+            init_signals([(signal.SIGUSR1, self.dump_allocations)])
+
+        usage = memory_usage()
+        if usage is not None:
+            self.logger.info("Worker %s started, %.1f MiB shared with the master, %.1f MiB private",
+                             os.getpid(), usage[0] / 2**20, usage[1] / 2**20)
+
+
+    def notify_ready(self):
+        """
+        Tell the master this worker accepts connections, a reload retires the previous
+        generation only once every new worker did.
+        """
+        if self.ready_fd is None:
+            return
+        try:
+            os.write(self.ready_fd, struct.pack('i', os.getpid()))
+        except OSError:
+            pass
+        os.close(self.ready_fd)
+        self.ready_fd = None
 
 
     def sigint_handler(self, signum, frame):
@@ -38,8 +137,222 @@ class BaseWorker:
         sys.exit(1)
 
 
+    def dump_allocations(self, signum, frame):
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        path = os.path.join(self.tracemalloc_dir, f"tracemalloc-{os.getpid()}-{int(time.time())}.txt")
+        try:
+            with open(path, 'w') as f:
+                f.write(f"worker {os.getpid()}, {self.requests_served} requests served, growth since the previous dump\n")
+                for stat in snapshot.compare_to(self.snapshot, 'lineno')[:50]:
+                    f.write(f"{stat}\n")
+        except OSError as e:
+            self.logger.error("Couldnt write the allocation dump to %s: %s", path, str(e))
+            return
+        self.snapshot = snapshot
+        self.logger.info("Allocation dump written to %s", path)
+
+
+    def check_recycle(self):
+        """
+        Stop taking new work once the worker served enough requests or grew too big,
+        it exits like on SIGINT and the master replaces it. With reuse_port the replacement
+        accepts from the same listeners, the master holds them meanwhile.
+        """
+        with self.recycle_lock:
+            self.requests_served += 1
+            if not self.alive:
+                return
+            if self.max_requests and self.requests_served >= self.max_requests:
+                self.logger.info("Worker %s served %i requests, restarting it", os.getpid(), self.requests_served)
+                self.alive = False
+            elif self.max_memory and time.monotonic() >= self.next_memory_check:
+                self.next_memory_check = time.monotonic() + 1.0
+                rss = resident_memory()
+                if rss is not None and rss > self.max_memory:
+                    self.logger.info("Worker %s uses %.1f MiB, restarting it", os.getpid(), rss / 2**20)
+                    self.alive = False
+
+
+    def is_parent_alive(self) -> bool:
+        # if the master died we got reparented, stop serving instead of becoming an orphan
+        return os.getppid() == self.ppid
+
+
+    def overloaded(self, sock: socket.socket, waited: float = None) -> bool:
+        """
+        True if the request on `sock` already waited past `max_queue_latency`. `waited` is the wait
+        the worker measured itself, only used where the kernel cant tell.
+        """
+        if not self.max_queue_latency:
+            return False
+        queued = idle_for(sock)
+        if queued is None:
+            queued = waited or 0
+        return queued > self.max_queue_latency
+
+
+    def count_shed(self, addr):
+        self.logger.debug("Shedding request from %s, it waited too long", addr)
+        if self.metrics is not None:
+            self.metrics.count_shed()
+        self.shed_count += 1
+        now = time.monotonic()
+        if now - self.shed_logged_at >= 5:
+            self.logger.warning("Worker %s is overloaded, rejected %i request(s) with 503", os.getpid(), self.shed_count)
+            self.shed_count = 0
+            self.shed_logged_at = now
+
+
+    def shed(self, sock: socket.socket, addr, response = None):
+        """
+        Answer with the pre-encoded 503, the caller closes the connection. `response` is the one
+        of an already parsed request, set up so the rejection gets recorded.
+        """
+        self.count_shed(addr)
+        sock.setblocking(False)
+        try:
+            # whatever the client sent is dropped, closing with unread data would reset the connection
+            while sock.recv(65536):
+                pass
+        except OSError:
+            pass
+        try:
+            sent = sock.send(self.unavailable)
+        except OSError:
+            return
+        if response is not None:
+            response.status = '503 Service Unavailable'
+            response.written += sent
+
+
+    def refuse_body(self, request, response) -> bool:
+        """
+        Answer 413 if the announced body is over `max_body_size`, before any of it is read.
+        """
+        if not self.max_body_size or request.content_len <= self.max_body_size:
+            return False
+        self.payload_too_large(response)
+        return True
+
+
+    def payload_too_large(self, response):
+        response.status = '413 Content Too Large'
+        response.sock.sendall(PAYLOAD_TOO_LARGE)
+        response.written += len(PAYLOAD_TOO_LARGE)
+
+
+    def bad_request(self, response, error: RequestBuildingError):
+        # the client learns why we hang up, unless its response already started
+        if response.headers_sent:
+            return
+        if isinstance(error, HeaderOverflow):
+            response.status, payload = '431 Request Header Fields Too Large', HEADERS_TOO_LARGE
+        else:
+            response.status, payload = '400 Bad Request', BAD_REQUEST
+        response.sock.sendall(payload)
+        response.written += len(payload)
+
+
+    def internal_error(self, response):
+        # the app failed, the client gets a 500 unless the response already started
+        if response.headers_sent:
+            return
+        response.status = '500 Internal Server Error'
+        response.sock.sendall(INTERNAL_ERROR)
+        response.written += len(INTERNAL_ERROR)
+
+
+    def serve_static(self, request, response) -> bool:
+        """
+        Answer the request from the static mounts, False if it belongs to the app.
+        """
+        if self.static is None:
+            return False
+        result = self.static.resolve(request)
+        if result is None:
+            return False
+
+        if request.content_len or request.chunked:
+            # nobody reads the body of a static GET, the connection cant be reused after it
+            request.keepalive = 0
+        try:
+            response.write_static(result)
+        finally:
+            self.static.release(result)
+        return True
+
+
+    def serve_cached(self, request, response) -> bool:
+        """
+        Answer the request from the response cache. On a miss the response is set up
+        to capture its body, `store_cached` keeps it once the app is done.
+        """
+        if self.cache is None:
+            return False
+        key = self.cache.key(request)
+        if key is None:
+            return False
+
+        entry = self.cache.get(key, request)
+        if entry is None and self.cache.coalesce and self.multithread:
+            # a single thread never sees two requests at once, there is nobody to wait for
+            flight, leading = self.cache.join(key)
+            if leading:
+                response.start_capture(key, self.cache.max_entry_size, flight)
+                return False
+            try:
+                entry = flight.result(self.cache.coalesce)
+            except futures.TimeoutError:
+                self.logger.debug("Gave up waiting for a coalesced response to %s", request.path)
+        if entry is None:
+            response.start_capture(key, self.cache.max_entry_size)
+            return False
+        response.write_cached(entry)
+        return True
+
+
+    def store_cached(self, response):
+        if response.cache_key is not None:
+            entry = self.cache.store(response.cache_key, response)
+            if response.flight is not None:
+                self.cache.land(response.cache_key, response.flight, entry)
+                response.flight = None
+
+
+    def land_flight(self, response):
+        # a leader that didnt get to store its response still has to let the waiters go
+        if response.flight is not None:
+            self.cache.land(response.cache_key, response.flight, None)
+            response.flight = None
+
+
+    def record(self, request, response, addr, waited: float | None, started: float, parsed: float,
+               built: float | None, called_app: bool = True, bytes_in: int = None):
+        """
+        Report a finished request to the access log and the metrics, and see if the worker is due for
+        a restart. `built` is None if no environ was built, phases a request didnt go through arent observed.
+        """
+        done = time.perf_counter()
+        self.check_recycle()
+        status = int(response.status[:3]) if response.status else 0
+        if self.access_log is not None:
+            self.access_log.log(addr, request, status, response.written, done - started)
+        if self.metrics is None:
+            return
+        first = request.first_byte_at or started
+        first_byte = first - started if request.first_byte_at is not None else None
+        environ = built - parsed if built is not None else None
+        app = max(done - (built or parsed) - response.send_time, 0.0) if called_app else None
+        if bytes_in is None:
+            bytes_in = request.reader.take_received()
+        self.metrics.observe((waited, first_byte, parsed - first, environ, app, response.send_time, done - started),
+                             bytes_in, response.written, status)
+
+
     def close(self):
-        raise NotImplementedError()
+        # subclasses close their own sockets first, whatever got logged until then is still written
+        if self.access_log:
+            self.access_log.close()
 
 
     def run(self):
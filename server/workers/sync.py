@@ -6,51 +6,85 @@ import typing
 from ..errors import *
 import errno
 import select
-from ..sock import SocketReader
+import time
+from ..sock import SocketReader, listener_selector
+from ..config import Config
 
 
 
 
 class SyncWorker(BaseWorker):
+    def __init__(self, app: typing.Callable, listeners: list[socket.socket], cfg: Config = Config()):
+        super().__init__(app, listeners, cfg)
+        self.keepalive: bool = not cfg.avoid_keepalive
+        self.keepalive_timeout: int | float = cfg.keepalive_timeout
+        self.max_keepalive_requests: int = cfg.max_keepalive_requests
+        self.rounds: int = 0
+
+
     def run(self):
         self.alive = True
 
         self.prepare_worker()
+        self.selector = listener_selector(self.listeners)
+        self.notify_ready()
 
         while self.alive:
             ready = self.get_ready()
-            if not ready and not self.alive:
-                break
+            if len(ready) > 1:
+                # rotate who goes first, every ready listener gets its batch each round
+                self.rounds += 1
+                ready.sort(key=lambda sock: (self.listeners.index(sock) - self.rounds) % len(self.listeners))
 
-            if ready:
-                for sock in ready:
-                    try:
-                        while True: # avoid syscalls by continuously accepting if we can
-                            self.accept(sock)
-                            continue
-                    except OSError as e:
-                        if e.errno not in (errno.EAGAIN, errno.ECONNABORTED, errno.EWOULDBLOCK):
-                            raise
-                        
+            for sock in ready:
+                self.accept_some(sock)
                 if not self.alive:
                     break
 
+            if not self.is_parent_alive():
+                self.logger.info("Master process is gone, stopping the worker")
+                break
+
         self.close()
 
 
-    def get_ready(self):
+    def get_ready(self) -> list[socket.socket]:
         try:
-            ready = select.select(self.listeners, [], [], self.server_sock_timeout)
-            return ready[0]
+            events = self.selector.select(self.server_sock_timeout)
         except OSError as err:
             if err.errno in (errno.EINTR, errno.EBADF):
                 return []
+            raise
+        return [key.fileobj for key, _ in events]
+
+
+    def accept_some(self, server_sock: socket.socket):
+        # avoid syscalls by accepting what is queued, up to a batch
+        for _ in range(self.accept_batch):
+            try:
+                self.accept(server_sock)
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.ECONNABORTED, errno.EWOULDBLOCK):
+                    raise
+                if e.errno != errno.ECONNABORTED:
+                    return
+            if not self.alive:
+                return
     
     
     def handle_connection(self, client: socket.socket, addr: str):
+        reader = SocketReader(client, self.buffer_pool)
         try:
-            request = Request(reader=SocketReader(client))
-            self.handle_request(request, client, addr)
+            served = 0
+            while True:
+                request = Request(reader=reader)
+                served += 1
+                if not self.handle_request(request, client, addr, last=served >= self.max_keepalive_requests):
+                    break
+                # pipelined requests are already buffered, otherwise give the client some time to send the next one
+                if not len(reader) and not self.wait_for_request(client):
+                    self.logger.debug("Keep-alive connection from %s timed out", addr)
+                    break
         except OSError as e:
             if e.errno not in (errno.EPIPE, errno.ECONNRESET, errno.ENOTCONN, errno.ECONNABORTED):
                 self.logger.exception("Socket processing error: %s", str(e))
@@ -63,41 +97,96 @@ class SyncWorker(BaseWorker):
             elif e.errno == errno.ECONNABORTED:
                 self.logger.debug('Connection terminated by client')
         finally:
+            reader.release()
             client.close()
+
+
+    def wait_for_request(self, client: socket.socket) -> bool:
+        poller = select.poll()
+        poller.register(client, select.POLLIN)
+        try:
+            return bool(poller.poll(self.keepalive_timeout * 1000))
+        except InterruptedError:
+            return False
     
     
-    def handle_request(self, request: Request, client: socket.socket, addr: str):
+    def handle_request(self, request: Request, client: socket.socket, addr: str, last: bool = False) -> bool:
+        started = time.perf_counter()
+        parsed = built = None
         try:
-            response = Response(client, request)
+            response = Response(client, request, self.write_batch_size, self.compression, self.write_timeout)
         
+            request.reader.deadline = time.monotonic() + self.header_timeout if self.header_timeout else None
             request.build_request()
-            request.notify()
+            request.reader.deadline = None
+            parsed = time.perf_counter()
             
-            # force connection: close on sync worker
-            request.keepalive = 0
+            if not self.keepalive or not self.alive or last:
+                request.keepalive = 0
             
-            environ = response.build_environ()
-
-            app_result = response.handle_app(self.app, environ)
+            if self.refuse_body(request, response):
+                return False
+            
+            if self.serve_static(request, response) or self.serve_cached(request, response):
+                return response.should_keepalive()
+
+            try:
+                environ = response.build_environ(self.environ_template, self.max_body_size,
+                                                 body_timeout=self.body_timeout, spool_size=self.body_spool_size)
+                built = time.perf_counter()
+                app_result = response.handle_app(self.app, environ)
+            except (RequestBuildingError, ClientDisconnect):
+                # the client side failed, handled below like anywhere else
+                raise
+            except Exception:
+                self.logger.exception("Error handling request from %s", addr)
+                self.internal_error(response)
+                return False
             
             # release resources
             if hasattr(app_result, 'close'):
                 app_result.close()
+            self.store_cached(response)
+
+            if not response.should_keepalive() or not self.alive:
+                return False
+
+            response.body.discard()
+            return True
 
         except TimeoutError:
             self.logger.debug("Client %s timed out", addr)
         except (ClientDisconnect, ConnectionResetError):
             self.logger.debug("Client %s disconnected", addr)
+        except BodyTooLarge as e:
+            self.logger.debug("Client %s sent too much: %s", addr, str(e))
+            if not response.headers_sent:
+                self.payload_too_large(response)
+        except RequestBuildingError as e:
+            self.logger.debug("Bad request from %s: %s", addr, str(e))
+            self.bad_request(response, e)
+        finally:
+            if parsed is not None:
+                self.record(request, response, addr, None, started, parsed, built, called_app=built is not None)
+        return False
 
 
     def accept(self, server_sock: socket.socket):
         client_sock, addr = server_sock.accept()
         self.logger.debug("Received connection from %s", addr)
+        self.socket_options.apply_client(client_sock)
+        if self.overloaded(client_sock):
+            self.shed(client_sock, addr)
+            client_sock.close()
+            return
         client_sock.settimeout(self.client_sock_timeout)
         self.handle_connection(client_sock, addr)
 
 
     def close(self):
         self.alive = False
+        if self.selector:
+            self.selector.close()
         for sock in self.listeners:
-            sock.close()
\ No newline at end of file
+            sock.close()
+        super().close()
\ No newline at end of file
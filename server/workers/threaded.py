@@ -1,7 +1,307 @@
 import socket
+import os
+import time
+import errno
+import queue
+import typing
+import selectors
+from concurrent import futures
 from .base import BaseWorker
+from ..http.handlers import Request, Response
+from ..http.errors import *
+from ..errors import *
+from ..sock import SocketReader, BufferPool, listener_selector
+from ..timers import TimerWheel, Timer
+from ..config import Config
+
+
+
+
+class TConnection:
+    __slots__ = ('sock', 'addr', 'reader', 'timer', 'requests', 'ready_at')
+
+    def __init__(self, sock: socket.socket, addr: str, pool: BufferPool = None):
+        self.sock = sock
+        self.addr = addr
+        self.reader = SocketReader(sock, pool)
+        self.timer: Timer = None # keep-alive timeout while parked
+        self.requests: int = 0 # requests served on this connection
+        self.ready_at: float = 0 # when the connection was handed to the pool
+
+
+    def close(self):
+        self.reader.release()
+        self.sock.close()
 
 
 
 class ThreadedWorker(BaseWorker):
-    pass
\ No newline at end of file
+    """
+    The main thread accepts connections and watches idle keep-alive ones in a selector,
+    connections with a request ready are handed to a thread pool of `cfg.threads` threads.
+    """
+    multithread = True
+
+    def __init__(self, app: typing.Callable, listeners: list[socket.socket], cfg: Config = Config()):
+        super().__init__(app, listeners, cfg)
+        self.threads: int = cfg.threads
+        self.max_connections: int = cfg.worker_connections
+        self.keepalive: bool = not cfg.avoid_keepalive
+        self.keepalive_timeout: int | float = cfg.keepalive_timeout
+        self.max_keepalive_requests: int = cfg.max_keepalive_requests
+        self.executor: futures.ThreadPoolExecutor = None
+        self.futures: set[futures.Future] = set()
+        self.keepalived: set[TConnection] = set() # parked connections
+        self.timers: TimerWheel = TimerWheel()
+        # connections coming back from the threads, with whether to keep them
+        self.returned: queue.SimpleQueue[tuple[TConnection, bool]] = queue.SimpleQueue()
+        self.wakeup_pipe: tuple[int, int] = None
+        self.nr_conns: int = 0 # only touched from the main thread
+
+
+    def run(self):
+        self.alive = True
+
+        self.prepare_worker()
+        self.init_loop()
+        self.notify_ready()
+
+        while self.alive:
+            self.park_returned()
+            self.murder_keepalived()
+
+            if self.nr_conns >= self.max_connections:
+                # at the limit, let some of the running requests finish before accepting more
+                futures.wait(list(self.futures), timeout=self.server_sock_timeout, return_when=futures.FIRST_COMPLETED)
+                continue
+
+            try:
+                events = self.selector.select(self.server_sock_timeout)
+            except OSError as err:
+                if err.errno != errno.EINTR:
+                    raise
+                events = []
+
+            for key, _ in events:
+                callback = key.data
+                callback(key.fileobj)
+
+            if not self.is_parent_alive():
+                self.logger.info("Master process is gone, stopping the worker")
+                break
+
+        self.close()
+
+
+    def init_loop(self):
+        self.selector = listener_selector(self.listeners, self.accept)
+        self.executor = futures.ThreadPoolExecutor(max_workers=self.threads)
+
+        self.wakeup_pipe = os.pipe()
+        for fd in self.wakeup_pipe:
+            os.set_blocking(fd, False)
+        self.selector.register(self.wakeup_pipe[0], selectors.EVENT_READ, self.drain_wakeup)
+
+
+    def wakeup(self):
+        try:
+            os.write(self.wakeup_pipe[1], b'.')
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EBADF):
+                raise
+
+
+    def drain_wakeup(self, fd: int):
+        try:
+            while os.read(fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+
+    def accept(self, server_sock: socket.socket):
+        # take what is queued up to a batch, other ready listeners get their turn in between
+        for _ in range(self.accept_batch):
+            if self.nr_conns >= self.max_connections:
+                return
+            try:
+                client_sock, addr = server_sock.accept()
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.ECONNABORTED, errno.EWOULDBLOCK):
+                    raise
+                if e.errno != errno.ECONNABORTED:
+                    return
+                continue
+
+            self.logger.debug("Received connection from %s", addr)
+            self.socket_options.apply_client(client_sock)
+            client_sock.setblocking(True)
+            client_sock.settimeout(self.client_sock_timeout)
+            self.nr_conns += 1
+            self.enqueue(TConnection(client_sock, addr, self.buffer_pool))
+
+
+    def enqueue(self, conn: TConnection):
+        conn.ready_at = time.perf_counter()
+        future = self.executor.submit(self.handle, conn)
+        self.futures.add(future)
+        future.add_done_callback(lambda fut: self.finish_request(fut, conn))
+
+
+    def finish_request(self, future: futures.Future, conn: TConnection):
+        # runs in the pool thread, the selector and the connection count are only touched from the main thread
+        self.futures.discard(future)
+        try:
+            keepalive = future.result()
+        except Exception:
+            self.logger.exception("Unexpected error while handling a connection from %s", conn.addr)
+            keepalive = False
+
+        self.returned.put((conn, keepalive))
+        self.wakeup()
+
+
+    def park_returned(self):
+        while True:
+            try:
+                conn, keepalive = self.returned.get_nowait()
+            except queue.Empty:
+                return
+
+            if not keepalive or not self.alive:
+                self.close_connection(conn)
+                continue
+            conn.timer = self.timers.schedule(self.keepalive_timeout, lambda conn=conn: self.expire_keepalived(conn))
+            self.keepalived.add(conn)
+            self.selector.register(conn.sock, selectors.EVENT_READ, lambda sock, conn=conn: self.resume(conn))
+
+
+    def resume(self, conn: TConnection):
+        self.selector.unregister(conn.sock)
+        self.keepalived.discard(conn)
+        self.timers.cancel(conn.timer)
+        self.enqueue(conn)
+
+
+    def murder_keepalived(self):
+        self.timers.advance()
+
+
+    def expire_keepalived(self, conn: TConnection):
+        self.keepalived.discard(conn)
+        self.selector.unregister(conn.sock)
+        self.logger.debug("Keep-alive connection from %s timed out", conn.addr)
+        self.close_connection(conn)
+
+
+    def close_connection(self, conn: TConnection):
+        try:
+            conn.close()
+        finally:
+            self.nr_conns -= 1
+
+
+    def handle(self, conn: TConnection) -> bool:
+        try:
+            keepalive = self.handle_request(conn, time.perf_counter() - conn.ready_at)
+            # pipelined requests are already in our buffer, the selector wouldnt wake us up for them
+            while keepalive and self.alive and len(conn.reader):
+                keepalive = self.handle_request(conn)
+            return keepalive
+        except OSError as e:
+            if e.errno not in (errno.EPIPE, errno.ECONNRESET, errno.ENOTCONN, errno.ECONNABORTED):
+                self.logger.exception("Socket processing error: %s", str(e))
+            else:
+                self.logger.debug("Connection from %s was lost: %s", conn.addr, str(e))
+        return False
+
+
+    def handle_request(self, conn: TConnection, waited: float = None) -> bool:
+        started = time.perf_counter()
+        parsed = built = None
+        try:
+            request = Request(reader=conn.reader)
+            response = Response(conn.sock, request, self.write_batch_size, self.compression, self.write_timeout)
+
+            conn.reader.deadline = time.monotonic() + self.header_timeout if self.header_timeout else None
+            request.build_request()
+            conn.reader.deadline = None
+            parsed = time.perf_counter()
+
+            if waited is not None and self.overloaded(conn.sock, waited):
+                self.shed(conn.sock, conn.addr, response)
+                return False
+
+            conn.requests += 1
+            if not self.keepalive or not self.alive or conn.requests >= self.max_keepalive_requests:
+                request.keepalive = 0
+
+            if self.refuse_body(request, response):
+                return False
+
+            if self.serve_static(request, response) or self.serve_cached(request, response):
+                return response.should_keepalive()
+
+            try:
+                environ = response.build_environ(self.environ_template, self.max_body_size,
+                                                 body_timeout=self.body_timeout, spool_size=self.body_spool_size)
+                built = time.perf_counter()
+                app_result = response.handle_app(self.app, environ)
+            except (RequestBuildingError, ClientDisconnect):
+                # the client side failed, handled below like anywhere else
+                raise
+            except Exception:
+                self.logger.exception("Error handling request from %s", conn.addr)
+                self.internal_error(response)
+                return False
+
+            # release resources
+            if hasattr(app_result, 'close'):
+                app_result.close()
+            self.store_cached(response)
+
+            if not response.should_keepalive():
+                return False
+
+            response.body.discard()
+            return True
+
+        except TimeoutError:
+            self.logger.debug("Client %s timed out", conn.addr)
+        except (ClientDisconnect, ConnectionResetError):
+            self.logger.debug("Client %s disconnected", conn.addr)
+        except BodyTooLarge as e:
+            self.logger.debug("Client %s sent too much: %s", conn.addr, str(e))
+            if not response.headers_sent:
+                self.payload_too_large(response)
+        except RequestBuildingError as e:
+            self.logger.debug("Bad request from %s: %s", conn.addr, str(e))
+            self.bad_request(response, e)
+        finally:
+            if parsed is not None:
+                self.land_flight(response)
+                self.record(request, response, conn.addr, waited, started, parsed, built, called_app=built is not None)
+        return False
+
+
+    def close(self):
+        self.alive = False
+        for sock in self.listeners:
+            sock.close()
+
+        # let the requests in flight finish, idle connections are just dropped
+        if self.executor:
+            self.executor.shutdown(wait=True)
+        self.park_returned()
+        while self.keepalived:
+            conn = self.keepalived.pop()
+            self.timers.cancel(conn.timer)
+            self.selector.unregister(conn.sock)
+            self.close_connection(conn)
+
+        if self.selector:
+            self.selector.close()
+        if self.wakeup_pipe:
+            for fd in self.wakeup_pipe:
+                os.close(fd)
+        super().close()